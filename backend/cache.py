@@ -0,0 +1,396 @@
+import array
+import asyncio
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_MISSING = object()
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalisation utilisée pour les clés de cache (unicode NFC + espaces)."""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+# -------------------
+# Cache LRU + TTL en mémoire
+# -------------------
+class TTLCache:
+    """Cache LRU borné, avec expiration optionnelle des entrées (thread-safe)."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# -------------------
+# Cache d'embeddings
+# -------------------
+class SQLiteVectorStore:
+    """Couche persistante (optionnelle) du cache d'embeddings."""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str, ttl: float | None) -> list[float] | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector, created_at FROM embedding_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (ttl and row[1] + ttl < time.time()):
+            return None
+        return array.array("d", row[0]).tolist()
+
+    def set(self, key: str, vector: list[float]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embedding_cache (key, vector, created_at) VALUES (?, ?, ?)",
+                (key, array.array("d", vector).tobytes(), time.time())
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Enveloppe un modèle d'embeddings avec un cache LRU/TTL en mémoire,
+    doublé d'une couche SQLite optionnelle. Clé : (modèle, texte normalisé).
+    En asynchrone, les accès SQLite passent par `executor` (None : exécuteur
+    par défaut de la boucle) pour ne pas bloquer la boucle d'événements.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, maxsize: int = 2048,
+                 ttl: float | None = None, sqlite_path: str | None = None, executor=None):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.persistent = SQLiteVectorStore(sqlite_path) if sqlite_path else None
+        self.executor = executor
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_name}:{normalize_text(text)}"
+
+    def _lookup_memory(self, key: str) -> list[float] | None:
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.hits += 1
+        return vector
+
+    def _lookup_persistent(self, key: str) -> list[float] | None:
+        vector = self.persistent.get(key, self.ttl)
+        if vector is not None:
+            self.persistent_hits += 1
+            self.memory.set(key, vector)
+        return vector
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self._key(text)
+        vector = self._lookup_memory(key)
+        if vector is None and self.persistent is not None:
+            vector = self._lookup_persistent(key)
+        if vector is None:
+            self.misses += 1
+            vector = self.underlying.embed_query(normalize_text(text))
+            self.memory.set(key, vector)
+            if self.persistent is not None:
+                self.persistent.set(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = self._key(text)
+        vector = self._lookup_memory(key)
+        if vector is None and self.persistent is not None:
+            vector = await self._run(self._lookup_persistent, key)
+        if vector is None:
+            self.misses += 1
+            vector = await self.underlying.aembed_query(normalize_text(text))
+            self.memory.set(key, vector)
+            if self.persistent is not None:
+                await self._run(self.persistent.set, key, vector)
+        return vector
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        # Les documents (ingestion) ne passent pas par le cache des requêtes
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.underlying.aembed_documents(texts)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "model": self.model_name,
+            "size": len(self.memory),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.persistent_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# -------------------
+# Cache sémantique des réponses
+# -------------------
+class SemanticAnswerCache:
+    """
+    Cache des réponses par sélection de documents : une question est servie
+    depuis le cache si son embedding est assez proche (cosinus) d'une question
+    déjà traitée pour la même sélection.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float | None = 3600,
+                 max_entries_per_scope: int = 256, max_scopes: int = 512):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries_per_scope = max_entries_per_scope
+        self._scopes = TTLCache(maxsize=max_scopes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _live_entries(self, scope: str) -> list:
+        entries = self._scopes.get(scope) or []
+        if self.ttl:
+            now = time.monotonic()
+            entries = [e for e in entries if e["created_at"] + self.ttl >= now]
+        return entries
+
+    def lookup(self, scope: str, vector) -> str | None:
+        with self._lock:
+            entries = self._live_entries(scope)
+            if entries:
+                matrix = np.stack([e["vector"] for e in entries])
+                scores = matrix @ self._unit(vector)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.hits += 1
+                    self.latency_saved += entries[best]["latency"]
+                    return entries[best]["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, scope: str, vector, answer: str, latency: float):
+        with self._lock:
+            entries = self._live_entries(scope)
+            entries.append({
+                "vector": self._unit(vector),
+                "answer": answer,
+                "latency": latency,
+                "created_at": time.monotonic(),
+            })
+            self._scopes.set(scope, entries[-self.max_entries_per_scope:])
+
+    def invalidate(self, scope: str | None = None):
+        if scope is None:
+            self._scopes.clear()
+        else:
+            self._scopes.pop(scope)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "scopes": len(self._scopes),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+        }
+
+
+# -------------------
+# Recherche externe : cache, coalescence et coupe-circuit
+# -------------------
+class SearchUnavailable(Exception):
+    """Recherche externe indisponible (timeout, erreur ou circuit ouvert)."""
+
+
+class CircuitBreaker:
+    """
+    Après `failure_threshold` échecs consécutifs, le circuit s'ouvre : les
+    appels échouent immédiatement pendant `reset_timeout` secondes, puis un
+    seul appel d'essai est autorisé (semi-ouvert) ; les autres restent refusés
+    jusqu'à son résultat.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def abort_trial(self):
+        """Appel d'essai annulé sans résultat : un autre pourra être tenté."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.trial_in_flight = False
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                # (Re)ouverture, y compris après un essai semi-ouvert raté
+                self.opened_at = time.monotonic()
+
+
+class CachedSearch:
+    """
+    Enveloppe une recherche asynchrone (query -> texte) : cache TTL sur la
+    requête normalisée, un seul appel amont par requête identique en cours
+    (single-flight), timeout et coupe-circuit. Les échecs ne sont pas mis en cache.
+    """
+
+    def __init__(self, search, maxsize: int = 512, ttl: float = 6 * 3600, timeout: float = 10.0,
+                 breaker: CircuitBreaker | None = None):
+        self.search = search
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: dict = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.failures = 0
+        self.rejected = 0
+
+    @staticmethod
+    def _key(query: str) -> str:
+        return normalize_text(query).casefold()
+
+    async def _fetch(self, key: str, query: str) -> str:
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise SearchUnavailable("circuit ouvert")
+        self.upstream_calls += 1
+        try:
+            result = await asyncio.wait_for(self.search(query), timeout=self.timeout)
+        except asyncio.CancelledError:
+            self.breaker.abort_trial()
+            raise
+        except Exception as e:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise SearchUnavailable(str(e) or type(e).__name__) from e
+        self.breaker.record_success()
+        self._cache.set(key, result)
+        return result
+
+    async def run(self, query: str) -> str:
+        key = self._key(query)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, query))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield : l'annulation d'un appelant n'annule pas l'appel partagé
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "circuit": self.breaker.state,
+        }
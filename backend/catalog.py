@@ -0,0 +1,134 @@
+import hashlib
+import json
+import threading
+import time
+
+from sqlalchemy import text
+
+# -------------------
+# Catalogue des documents
+# -------------------
+# Table maintenue à côté de langchain_pg_embedding : une ligne par source, avec
+# le nombre de chunks et la date de dernière mise à jour. /documents la lit au
+# lieu de refaire un SELECT DISTINCT sur toute la table des embeddings.
+CATALOG_DDL = text("""
+    CREATE TABLE IF NOT EXISTS document_catalog (
+        source TEXT PRIMARY KEY,
+        chunk_count INTEGER NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        content_hash TEXT
+    );
+    ALTER TABLE document_catalog ADD COLUMN IF NOT EXISTS content_hash TEXT;
+""")
+
+# Reconstruction complète depuis les embeddings (parcours complet, rare)
+CATALOG_REBUILD = text("""
+    INSERT INTO document_catalog (source, chunk_count, updated_at)
+    SELECT cmetadata->>'source', COUNT(*), now()
+    FROM langchain_pg_embedding
+    WHERE cmetadata IS NOT NULL
+      AND cmetadata::jsonb ? 'source'
+    GROUP BY 1
+    ON CONFLICT (source) DO UPDATE
+        SET chunk_count = EXCLUDED.chunk_count, updated_at = now()
+        WHERE document_catalog.chunk_count <> EXCLUDED.chunk_count;
+""")
+
+CATALOG_PRUNE = text("""
+    DELETE FROM document_catalog c
+    WHERE NOT EXISTS (
+        SELECT 1 FROM langchain_pg_embedding e
+        WHERE e.cmetadata->>'source' = c.source
+    );
+""")
+
+CATALOG_UPSERT = text("""
+    INSERT INTO document_catalog (source, chunk_count, updated_at, content_hash)
+    VALUES (:source, :chunk_count, now(), :content_hash)
+    ON CONFLICT (source) DO UPDATE
+        SET chunk_count = EXCLUDED.chunk_count, updated_at = now(),
+            content_hash = EXCLUDED.content_hash;
+""")
+
+CATALOG_HASHES = text("SELECT source, content_hash FROM document_catalog WHERE source = ANY(:sources);")
+
+CATALOG_DELETE = text("DELETE FROM document_catalog WHERE source = :source;")
+
+CATALOG_SELECT = text("""
+    SELECT source, chunk_count, updated_at
+    FROM document_catalog
+    ORDER BY source;
+""")
+
+
+class DocumentCatalog:
+    """
+    Cache en mémoire du catalogue, invalidé par l'ingestion. Le TTL permet aux
+    autres instances (Cloud Run) de voir les ingestions faites ailleurs.
+    """
+
+    def __init__(self, engine, ttl: float = 300):
+        self.engine = engine
+        self.ttl = ttl
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._table_ready = False
+        self._lock = threading.Lock()
+
+    def ensure_table(self):
+        with self.engine.begin() as conn:
+            conn.execute(CATALOG_DDL)
+            is_empty = conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM document_catalog)")).scalar()
+            if is_empty:
+                conn.execute(CATALOG_REBUILD)
+        self._table_ready = True
+
+    def rebuild(self):
+        with self.engine.begin() as conn:
+            conn.execute(CATALOG_DDL)
+            conn.execute(CATALOG_REBUILD)
+            conn.execute(CATALOG_PRUNE)
+        self.invalidate()
+
+    def upsert(self, conn, source: str, chunk_count: int, content_hash: str | None = None):
+        """Mise à jour incrémentale, dans la transaction de l'ingestion."""
+        if chunk_count:
+            conn.execute(CATALOG_UPSERT, {"source": source, "chunk_count": chunk_count, "content_hash": content_hash})
+        else:
+            conn.execute(CATALOG_DELETE, {"source": source})
+
+    def content_hashes(self, sources: list[str]) -> dict:
+        if not self._table_ready:
+            self.ensure_table()
+        with self.engine.connect() as conn:
+            return dict(conn.execute(CATALOG_HASHES, {"sources": list(sources)}).fetchall())
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def _load(self) -> dict:
+        if not self._table_ready:
+            self.ensure_table()
+        with self.engine.connect() as conn:
+            rows = conn.execute(CATALOG_SELECT).fetchall()
+        entries = [
+            {"source": row[0], "chunk_count": row[1], "updated_at": row[2].isoformat()}
+            for row in rows if row[0] is not None
+        ]
+        digest = hashlib.sha1(json.dumps(entries, sort_keys=True).encode("utf-8")).hexdigest()
+        return {"entries": entries, "etag": f'"{digest}"'}
+
+    def get(self) -> dict:
+        with self._lock:
+            expired = time.monotonic() - self._loaded_at > self.ttl
+            if self._snapshot is None or expired:
+                self._snapshot = self._load()
+                self._loaded_at = time.monotonic()
+            return self._snapshot
+
+    def entry(self, source: str) -> dict | None:
+        for item in self.get()["entries"]:
+            if item["source"] == source:
+                return item
+        return None
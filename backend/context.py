@@ -0,0 +1,109 @@
+import re
+import threading
+
+import tiktoken
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+# -------------------
+# Construction du contexte (budget de tokens + déduplication)
+# -------------------
+class ContextPacker:
+    """
+    Assemble les chunks (déjà triés par pertinence) dans la limite d'un budget
+    de tokens, en écartant les quasi-doublons (similarité de Jaccard sur des
+    shingles de mots : avec k <= 20 chunks, le calcul exact coûte moins qu'un
+    MinHash).
+    """
+
+    def __init__(self, encoding_name: str = "cl100k_base", dedup_threshold: float = 0.8,
+                 shingle_size: int = 5):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self.dedup_threshold = dedup_threshold
+        self.shingle_size = shingle_size
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    @property
+    def encoding(self):
+        # Chargé à la première utilisation (téléchargement du BPE au premier appel)
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return self._encoding
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Début du texte tenant dans `max_tokens`."""
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max(0, max_tokens)])
+
+    def _shingles(self, text: str) -> set:
+        words = _WORD_RE.findall(text.lower())
+        if len(words) <= self.shingle_size:
+            return {" ".join(words)}
+        return {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def _is_duplicate(self, shingles: set, kept: list[set]) -> bool:
+        for other in kept:
+            union = len(shingles | other)
+            if union and len(shingles & other) / union >= self.dedup_threshold:
+                return True
+        return False
+
+    def pack(self, docs: list, max_tokens: int, separator: str = "\n\n") -> dict:
+        separator_tokens = self.count_tokens(separator)
+        kept_docs, kept_shingles = [], []
+        used = 0
+        raw = 0
+        duplicates = 0
+        over_budget = 0
+
+        for doc in docs:
+            content = doc.page_content
+            tokens = self.count_tokens(content)
+            raw += tokens + (separator_tokens if raw else 0)
+
+            shingles = self._shingles(content)
+            if self._is_duplicate(shingles, kept_shingles):
+                duplicates += 1
+                continue
+
+            cost = tokens + (separator_tokens if kept_docs else 0)
+            if used + cost > max_tokens:
+                # Chunk trop long pour le budget restant : on tente les suivants
+                over_budget += 1
+                continue
+
+            kept_docs.append(doc)
+            kept_shingles.append(shingles)
+            used += cost
+
+        with self._lock:
+            self.requests += 1
+            self.tokens_in += raw
+            self.tokens_out += used
+
+        return {
+            "text": separator.join(doc.page_content for doc in kept_docs),
+            "docs": kept_docs,
+            "tokens": used,
+            "tokens_saved": raw - used,
+            "dropped_duplicates": duplicates,
+            "dropped_over_budget": over_budget,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "tokens_saved": self.tokens_in - self.tokens_out,
+        }
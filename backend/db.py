@@ -0,0 +1,85 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+
+load_dotenv()
+
+# -------------------
+# Configuration DB
+# -------------------
+PG_CONNECTION_STRING = (
+    f"postgresql+psycopg2://"
+    f"{os.getenv('PG_USER')}:{os.getenv('PG_PASSWORD')}"
+    f"@{os.getenv('PG_HOST')}:{os.getenv('PG_PORT')}"
+    f"/{os.getenv('PG_DB')}"
+)
+
+# Pool unique partagé par PGVector et les requêtes SQL. Sur Cloud Run, chaque
+# instance ouvre au plus DB_POOL_SIZE + DB_MAX_OVERFLOW connexions.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recyclage avant les coupures côté serveur / proxy (Cloud SQL : ~10 min d'inactivité)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+
+class PoolMonitor:
+    """Compteurs du pool (connexions ouvertes, empruntées, pic d'emprunts)."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.connects = 0
+        self.invalidated = 0
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidated += 1
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        return {
+            "pool_size": pool.size(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "peak_checked_out": self.peak_checked_out,
+            "connections_opened": self.connects,
+            "invalidated": self.invalidated,
+        }
+
+
+def create_db_engine(pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW):
+    return create_engine(
+        PG_CONNECTION_STRING,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        # Vérifie la connexion à l'emprunt : plus d'erreurs sur connexions mortes
+        pool_pre_ping=True,
+        connect_args={"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"},
+    )
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+
+from backend.cache import TTLCache
+
+logger = logging.getLogger("uvicorn")
+
+SUMMARY_PROMPT = """
+Tu maintiens le résumé d'une séance de révision entre un étudiant et un tuteur de science politique.
+Mets à jour le résumé existant avec les nouveaux échanges. Conserve les notions abordées, les
+questions de l'étudiant et les points expliqués ; sois concis (10 lignes maximum).
+
+### RÉSUMÉ EXISTANT
+{summary}
+
+### NOUVEAUX ÉCHANGES
+{messages}
+
+Réponds UNIQUEMENT par le résumé mis à jour.
+"""
+
+
+def format_messages(messages: list) -> str:
+    return "\n".join(f"{m.role.upper()}: {m.content}" for m in messages)
+
+
+# -------------------
+# Mémoire de conversation compacte
+# -------------------
+class ConversationMemory:
+    """
+    Historique envoyé au LLM : les derniers messages verbatim, précédés d'un
+    résumé des plus anciens. Le résumé est mis à jour de façon incrémentale et
+    mis en cache par identifiant de conversation ; le tout est borné en tokens.
+
+    La réponse n'attend jamais le LLM de résumé : le prompt part du dernier
+    résumé en cache (plus les anciens messages pas encore résumés, verbatim) et
+    la mise à jour tourne en tâche de fond, une à la fois par conversation.
+    """
+
+    def __init__(self, summarize, count_tokens, keep_messages: int = 6, max_tokens: int = 1500,
+                 max_conversations: int = 2000, ttl: float = 6 * 3600):
+        # summarize : coroutine (prompt) -> texte, count_tokens : (texte) -> int
+        self.summarize = summarize
+        self.count_tokens = count_tokens
+        self.keep_messages = keep_messages
+        self.max_tokens = max_tokens
+        self._summaries = TTLCache(maxsize=max_conversations, ttl=ttl)
+        # Mises à jour en cours (conversation -> tâche) : une seule par conversation
+        self._updates: dict[str, asyncio.Task] = {}
+
+    def _state(self, conversation_id: str, older: list) -> dict:
+        state = self._summaries.get(conversation_id)
+        # Historique plus court que ce qui a été résumé : nouvelle conversation côté client
+        if state is None or state["summarized"] > len(older):
+            state = {"summary": "", "summarized": 0}
+        return state
+
+    async def _update_summary(self, conversation_id: str, older: list):
+        state = self._state(conversation_id, older)
+        new_messages = older[state["summarized"]:]
+        if not new_messages:
+            return
+        prompt = SUMMARY_PROMPT.format(
+            summary=state["summary"] or "(aucun)",
+            messages=format_messages(new_messages)
+        )
+        try:
+            summary = await self.summarize(prompt)
+        except Exception:
+            # Résumé non mis à jour : les messages restent envoyés verbatim
+            logger.exception("Erreur résumé de l'historique")
+            return
+        self._summaries.set(conversation_id, {"summary": summary.strip(), "summarized": len(older)})
+        logger.info(f"🗜️ [HISTORY] Résumé mis à jour ({len(older)} messages résumés)")
+
+    def _schedule_update(self, conversation_id: str, older: list):
+        task = self._updates.get(conversation_id)
+        if task is not None and not task.done():
+            return  # le tour suivant reprendra les messages restants
+        task = asyncio.create_task(self._update_summary(conversation_id, list(older)))
+        self._updates[conversation_id] = task
+        task.add_done_callback(lambda done: self._forget_update(conversation_id, done))
+
+    def _forget_update(self, conversation_id: str, task: asyncio.Task):
+        if self._updates.get(conversation_id) is task:
+            del self._updates[conversation_id]
+
+    async def wait_updates(self):
+        """Attend les résumés en cours (tests, arrêt propre)."""
+        if self._updates:
+            await asyncio.gather(*self._updates.values(), return_exceptions=True)
+
+    def _truncate(self, summary: str, recent: list) -> str:
+        parts = [f"RÉSUMÉ DES ÉCHANGES PLUS ANCIENS : {summary}"] if summary else []
+        lines = [f"{m.role.upper()}: {m.content}" for m in recent]
+
+        # On retire d'abord les messages récents les plus anciens, puis on coupe le résumé
+        while lines and self.count_tokens("\n".join(parts + lines)) > self.max_tokens:
+            lines.pop(0)
+        text = "\n".join(parts + lines)
+        if self.count_tokens(text) > self.max_tokens:
+            # Résumé seul encore trop long : coupe approximative (~3 caractères par token)
+            text = text[: self.max_tokens * 3]
+        return text
+
+    async def compact(self, history: list, conversation_id: str | None = None) -> str:
+        recent = history[-self.keep_messages:] if self.keep_messages else []
+        older = history[: len(history) - len(recent)]
+
+        summary = ""
+        if older and conversation_id:
+            state = self._state(conversation_id, older)
+            summary = state["summary"]
+            # Pas encore résumés : envoyés tels quels (les plus anciens sautent en premier si trop long)
+            recent = older[state["summarized"]:] + recent
+            if state["summarized"] < len(older):
+                self._schedule_update(conversation_id, older)
+        return self._truncate(summary, recent)
+
+    def forget(self, conversation_id: str):
+        self._summaries.pop(conversation_id)
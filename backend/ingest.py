@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import uuid
+from pathlib import Path
+
+from backend.llm_dispatch import RETRYABLE_ERRORS
+from backend.process_pool import ProcessPool
+from backend.retrieval import to_pgvector
+
+logger = logging.getLogger("uvicorn")
+
+# -------------------
+# Paramètres d'ingestion
+# -------------------
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "150"))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "256"))
+EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("INGEST_EMBED_MAX_RETRIES", "6"))
+PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", str(os.cpu_count() or 2)))
+
+COPY_SQL = """
+    COPY langchain_pg_embedding (uuid, collection_id, embedding, document, cmetadata, custom_id)
+    FROM STDIN WITH (FORMAT csv)
+"""
+DELETE_SOURCE_SQL = """
+    DELETE FROM langchain_pg_embedding
+    WHERE collection_id = %s AND cmetadata->>'source' = %s
+"""
+
+process_pool = ProcessPool(PARSE_WORKERS)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_name(path: str) -> str:
+    """Nom du document tel qu'affiché dans /documents (nom du fichier sans extension)."""
+    return Path(path).stem
+
+
+# -------------------
+# Parsing + découpage (exécuté dans le pool de processus)
+# -------------------
+def parse_pdf(path: str) -> list[dict]:
+    from pypdf import PdfReader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chunks = []
+    for page_number, page in enumerate(PdfReader(path).pages, start=1):
+        page_text = page.extract_text() or ""
+        for piece in splitter.split_text(page_text):
+            chunks.append({"text": piece, "page": page_number, "chunk": len(chunks)})
+    return chunks
+
+
+# -------------------
+# Embeddings par lots
+# -------------------
+async def embed_batch(embedder, texts: list[str], semaphore: asyncio.Semaphore) -> list[list[float]]:
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        async with semaphore:
+            try:
+                return await embedder.aembed_documents(texts)
+            except RETRYABLE_ERRORS as e:
+                # 429, timeouts / erreurs réseau et 5xx : mêmes erreurs que le dispatcher LLM
+                if attempt == EMBED_MAX_RETRIES:
+                    raise
+                reason = type(e).__name__
+        # Backoff exponentiel avec jitter, hors du sémaphore
+        delay = min(60, 2 ** attempt) * (0.5 + random.random())
+        logger.warning(f"⏳ [INGEST] {reason}, nouvel essai dans {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+async def embed_chunks(embedder, chunks: list[dict], semaphore: asyncio.Semaphore) -> list[list[float]]:
+    batches = [chunks[i:i + EMBED_BATCH_SIZE] for i in range(0, len(chunks), EMBED_BATCH_SIZE)]
+    results = await asyncio.gather(*[
+        embed_batch(embedder, [c["text"] for c in batch], semaphore) for batch in batches
+    ])
+    return [vector for batch_vectors in results for vector in batch_vectors]
+
+
+# -------------------
+# Insertion en masse (COPY)
+# -------------------
+def copy_chunks(engine, catalog, collection_id, source: str, content_hash: str,
+                chunks: list[dict], vectors: list[list[float]]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for chunk, vector in zip(chunks, vectors):
+        metadata = {"source": source, "page": chunk["page"], "chunk": chunk["chunk"]}
+        row_id = str(uuid.uuid4())
+        writer.writerow([
+            row_id, str(collection_id), to_pgvector(vector),
+            chunk["text"], json.dumps(metadata, ensure_ascii=False), row_id
+        ])
+    buffer.seek(0)
+
+    # Remplacement atomique des chunks du document + mise à jour du catalogue
+    with engine.begin() as conn:
+        cursor = conn.connection.cursor()
+        cursor.execute(DELETE_SOURCE_SQL, (str(collection_id), source))
+        cursor.copy_expert(COPY_SQL, buffer)
+        catalog.upsert(conn, source, len(chunks), content_hash)
+
+
+# -------------------
+# Pipeline
+# -------------------
+async def ingest_paths(paths: list[str], engine, catalog, embedder, collection_id,
+                       force: bool = False) -> list[dict]:
+    """
+    Ingère des PDF : les fichiers inchangés (même hash) sont ignorés, les autres
+    sont parsés en parallèle dans un pool de processus puis embeddés et copiés
+    au fur et à mesure qu'ils sont prêts. Un fichier en échec est rapporté avec
+    le statut "error" sans interrompre les autres. Deux fichiers qui donnent le
+    même document (même nom dans deux dossiers) sont refusés tous les deux :
+    leurs remplacements se feraient concurrence.
+    """
+    by_source = {}
+    for path in paths:
+        by_source.setdefault(source_name(path), []).append(path)
+
+    report = []
+    for source, duplicates in by_source.items():
+        if len(duplicates) > 1:
+            logger.error(f"❌ [INGEST] Plusieurs fichiers pour {source} : {duplicates}")
+            report.extend(
+                {"source": source, "path": path, "status": "error",
+                 "error": f"Plusieurs fichiers pour le document {source} : {', '.join(duplicates)}"}
+                for path in duplicates
+            )
+    paths = [path for path in paths if len(by_source[source_name(path)]) == 1]
+
+    loop = asyncio.get_running_loop()
+    hashes = {path: await loop.run_in_executor(None, file_hash, path) for path in paths}
+    known = {} if force else await loop.run_in_executor(
+        None, catalog.content_hashes, [source_name(p) for p in paths]
+    )
+
+    todo = []
+    for path in paths:
+        source = source_name(path)
+        if known.get(source) == hashes[path]:
+            logger.info(f"⏭️ [INGEST] Inchangé : {source}")
+            report.append({"source": source, "status": "unchanged"})
+        else:
+            todo.append(path)
+
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def ingest_one(path: str) -> dict:
+        source = source_name(path)
+        try:
+            chunks = await process_pool.run(parse_pdf, path)
+            logger.info(f"📄 [INGEST] {source} : {len(chunks)} chunks")
+            vectors = await embed_chunks(embedder, chunks, semaphore) if chunks else []
+            await loop.run_in_executor(
+                None, copy_chunks, engine, catalog, collection_id, source, hashes[path], chunks, vectors
+            )
+        except Exception as e:
+            # Un fichier en échec n'interrompt pas les autres (copy_chunks est atomique)
+            logger.exception(f"❌ [INGEST] Échec pour {source}")
+            return {"source": source, "status": "error", "error": str(e)}
+        logger.info(f"✅ [INGEST] {source} indexé")
+        return {"source": source, "status": "indexed", "chunks": len(chunks)}
+
+    for task in asyncio.as_completed([ingest_one(path) for path in todo]):
+        report.append(await task)
+
+    if any(item["status"] == "indexed" for item in report):
+        catalog.invalidate()
+    return report
+
+
+def collect_pdfs(inputs: list[str]) -> list[str]:
+    paths = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            paths.extend(str(p) for p in sorted(path.rglob("*.pdf")))
+        elif path.suffix.lower() == ".pdf":
+            paths.append(str(path))
+    return paths
+
+
+if __name__ == "__main__":
+    # Usage : python -m backend.ingest cours/ autre_cours.pdf [--force]
+    from langchain_community.vectorstores import PGVector
+    from langchain_openai import OpenAIEmbeddings
+
+    from backend.catalog import DocumentCatalog
+    from backend.db import PG_CONNECTION_STRING, create_db_engine
+    from backend.retrieval import PGVectorSearch
+
+    parser = argparse.ArgumentParser(description="Ingestion de cours PDF dans PGVector")
+    parser.add_argument("inputs", nargs="+", help="Fichiers PDF ou dossiers")
+    parser.add_argument("--force", action="store_true", help="Réindexe même les fichiers inchangés")
+    parser.add_argument("--collection", default="documents")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format="%(asctime)s %(levelname)s %(message)s")
+    engine = create_db_engine()
+    embedder = OpenAIEmbeddings(model="text-embedding-3-small")
+    # Crée la collection si besoin
+    PGVector(connection_string=PG_CONNECTION_STRING, connection=engine, embedding_function=embedder,
+             collection_name=args.collection)
+    collection_id = PGVectorSearch(engine, args.collection).collection_id()
+
+    results = asyncio.run(ingest_paths(
+        collect_pdfs(args.inputs), engine, DocumentCatalog(engine), embedder, collection_id, force=args.force
+    ))
+    for item in results:
+        print(json.dumps(item, ensure_ascii=False))
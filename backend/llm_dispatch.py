@@ -0,0 +1,206 @@
+import asyncio
+import contextvars
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+
+import openai
+
+logger = logging.getLogger("uvicorn")
+
+# Priorités (la plus petite passe en premier)
+PRIORITY_INTERACTIVE = 0  # /ask, /ask/stream : un étudiant attend la réponse
+PRIORITY_BATCH = 1        # QCM, fiches de révision, tâches de fond
+
+# Appelant courant, lu par le dispatcher (même principe que selected_doc_ctx) :
+# par défaut, un appel sans contexte est une tâche de fond.
+llm_user_ctx: contextvars.ContextVar = contextvars.ContextVar("llm_user", default="background")
+llm_priority_ctx: contextvars.ContextVar = contextvars.ContextVar("llm_priority", default=PRIORITY_BATCH)
+
+
+# Erreurs retentées : quota (429), timeouts / réseau (APITimeoutError hérite
+# d'APIConnectionError) et erreurs serveur OpenAI (5xx)
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def set_llm_caller(user: str, priority: int):
+    llm_user_ctx.set(user)
+    llm_priority_ctx.set(priority)
+
+
+# -------------------
+# Seau à jetons
+# -------------------
+class TokenBucket:
+    """Capacité `per_minute`, rechargée en continu (per_minute / 60 par seconde)."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Secondes avant de pouvoir consommer `amount` (0 si disponible)."""
+        self._refill()
+        amount = min(amount, self.capacity)  # une requête énorme passe quand le seau est plein
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def consume(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class _Ticket:
+    __slots__ = ("user", "tokens", "future", "enqueued_at")
+
+    def __init__(self, user: str, tokens: int, future: asyncio.Future):
+        self.user = user
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+# -------------------
+# Dispatcher des appels LLM
+# -------------------
+class LLMDispatcher:
+    """
+    File d'attente des appels à un modèle :
+    - quotas requêtes/min et tokens/min (seaux à jetons),
+    - priorité stricte des requêtes interactives sur les tâches batch,
+    - équité entre utilisateurs (tourniquet) au sein d'une même priorité,
+    - nouvel essai avec backoff exponentiel et jitter sur les 429 et erreurs transitoires.
+    """
+
+    def __init__(self, name: str, rpm: int, tpm: int, max_concurrency: int = 16,
+                 max_retries: int = 5, max_delay: float = 30.0):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # priorité -> utilisateur -> tickets en attente (ordre d'arrivée)
+        self._queues: dict[int, OrderedDict] = {}
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self.dispatched = 0
+        self.rate_limited = 0
+        self.transient_errors = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+
+    # --- File équitable ---
+    def _enqueue(self, priority: int, ticket: _Ticket):
+        users = self._queues.setdefault(priority, OrderedDict())
+        users.setdefault(ticket.user, deque()).append(ticket)
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    def _peek(self):
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            while users:
+                user, tickets = next(iter(users.items()))
+                # Appelant parti (client déconnecté) : on l'oublie
+                while tickets and tickets[0].future.done():
+                    tickets.popleft()
+                if tickets:
+                    return priority, user, tickets[0]
+                del users[user]
+        return None
+
+    def _pop(self, priority: int, user: str):
+        users = self._queues[priority]
+        tickets = users[user]
+        tickets.popleft()
+        # Tourniquet : l'utilisateur servi passe en fin de file
+        if tickets:
+            users.move_to_end(user)
+        else:
+            del users[user]
+
+    async def _run(self):
+        while True:
+            head = self._peek()
+            if head is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            priority, user, ticket = head
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(ticket.tokens))
+            if wait > 0:
+                # Réveil anticipé si une requête plus prioritaire arrive
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._pop(priority, user)
+            self.requests.consume(1)
+            self.tokens.consume(ticket.tokens)
+            self.dispatched += 1
+            self.wait_seconds += time.monotonic() - ticket.enqueued_at
+            ticket.future.set_result(None)
+
+    async def _acquire(self, tokens: int):
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(llm_priority_ctx.get(), _Ticket(llm_user_ctx.get(), tokens, future))
+        await future
+
+    # --- Appel ---
+    async def call(self, func, tokens: int):
+        """
+        Exécute `func()` (coroutine) une fois les quotas disponibles. Le client
+        OpenAI ne retente plus rien (max_retries=0) : 429, timeouts, erreurs
+        réseau et 5xx sont retentés ici.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(tokens)
+            retry_after = None
+            async with self._semaphore:
+                try:
+                    return await func()
+                except RETRYABLE_ERRORS as e:
+                    if isinstance(e, openai.RateLimitError):
+                        self.rate_limited += 1
+                        retry_after = e.response.headers.get("retry-after") if getattr(e, "response", None) else None
+                    else:
+                        self.transient_errors += 1
+                    if attempt == self.max_retries:
+                        raise
+                    reason = type(e).__name__
+            # Backoff exponentiel avec jitter (ou Retry-After du serveur), hors du sémaphore
+            delay = min(self.max_delay, 2 ** attempt) * (0.5 + random.random())
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            self.retries += 1
+            logger.warning(f"⏳ [LLM:{self.name}] {reason}, nouvel essai dans {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "queued": {
+                "interactive" if priority == PRIORITY_INTERACTIVE else "batch":
+                    sum(len(tickets) for tickets in users.values())
+                for priority, users in self._queues.items()
+            },
+            "dispatched": self.dispatched,
+            "rate_limited": self.rate_limited,
+            "transient_errors": self.transient_errors,
+            "retries": self.retries,
+            "avg_wait_seconds": round(self.wait_seconds / self.dispatched, 3) if self.dispatched else 0.0,
+            "tokens_available": int(self.tokens.level),
+        }
@@ -0,0 +1,257 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from langchain.callbacks.base import AsyncCallbackHandler
+
+logger = logging.getLogger("uvicorn")
+
+# Bornes (s) adaptées aux étapes d'un RAG : quelques ms (cache) à ~1 min (fiche)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# -------------------
+# Métriques au format Prometheus (texte)
+# -------------------
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    labels = _labels_text(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _labels_text(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+REQUEST_LATENCY = registry.register(Histogram(
+    "rag_request_duration_seconds", "Durée des requêtes HTTP (jusqu'aux en-têtes)", ("method", "path", "status")
+))
+STAGE_LATENCY = registry.register(Histogram(
+    "rag_stage_duration_seconds", "Durée de chaque étape (embedding, recherche, LLM, outil, PDF...)", ("stage",)
+))
+STAGE_ERRORS = registry.register(Counter(
+    "rag_stage_errors_total", "Étapes terminées par une exception", ("stage",)
+))
+LLM_TOKENS = registry.register(Counter(
+    "rag_llm_tokens_total", "Tokens consommés par les appels LLM", ("model", "kind")
+))
+
+
+# -------------------
+# Traces échantillonnées
+# -------------------
+# Toutes les étapes alimentent les histogrammes ; seule une fraction des
+# requêtes (TRACE_SAMPLE_RATE) produit une trace détaillée, écrite en une
+# seule ligne JSON à la fin de la requête.
+current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+
+class Tracer:
+    def __init__(self, sample_rate: float = 0.1):
+        self.sample_rate = sample_rate
+
+    def start(self, name: str):
+        if random.random() >= self.sample_rate:
+            return None
+        trace = {"trace_id": uuid.uuid4().hex[:16], "name": name, "start": time.perf_counter(), "spans": []}
+        return current_trace.set(trace)
+
+    def finish(self, token, **attributes):
+        if token is None:
+            return
+        trace = current_trace.get()
+        current_trace.reset(token)
+        if trace is None:
+            return
+        logger.info("🧭 [TRACE] " + json.dumps({
+            "trace_id": trace["trace_id"],
+            "name": trace["name"],
+            "duration_ms": round((time.perf_counter() - trace["start"]) * 1000, 1),
+            **attributes,
+            "spans": trace["spans"],
+        }, ensure_ascii=False))
+
+
+def record_span(stage: str, duration: float, error: bool = False, **attributes):
+    STAGE_LATENCY.observe(duration, stage=stage)
+    if error:
+        STAGE_ERRORS.inc(stage=stage)
+    trace = current_trace.get()
+    if trace is not None:
+        span = {"stage": stage, "offset_ms": round((time.perf_counter() - duration - trace["start"]) * 1000, 1),
+                "duration_ms": round(duration * 1000, 1)}
+        if error:
+            span["error"] = True
+        span.update(attributes)
+        trace["spans"].append(span)
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Chronomètre une étape : `with stage("vector_search"): ...` (code sync ou async)."""
+    started = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException:
+        record_span(name, time.perf_counter() - started, error=True, **attributes)
+        raise
+    record_span(name, time.perf_counter() - started, **attributes)
+
+
+class MetricsCallbackHandler(AsyncCallbackHandler):
+    """
+    Durée et tokens de chaque appel LLM, durée de chaque outil de l'agent.
+    En streaming, l'API ne renvoie pas d'usage : les tokens sont alors comptés
+    localement (count_tokens).
+    """
+
+    def __init__(self, count_tokens=None):
+        self.count_tokens = count_tokens
+        self._runs: dict = {}
+
+    def _model(self, serialized: dict, kwargs: dict) -> str:
+        params = kwargs.get("invocation_params") or {}
+        return params.get("model_name") or params.get("model") or (serialized or {}).get("name") or "llm"
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        prompt_tokens = None
+        if self.count_tokens:
+            prompt_tokens = sum(self.count_tokens(str(m.content)) for batch in messages for m in batch)
+        self._runs[run_id] = (time.perf_counter(), self._model(serialized, kwargs), prompt_tokens)
+
+    async def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        prompt_tokens = sum(self.count_tokens(p) for p in prompts) if self.count_tokens else None
+        self._runs[run_id] = (time.perf_counter(), self._model(serialized, kwargs), prompt_tokens)
+
+    async def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        started, model, prompt_tokens = run
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt = usage.get("prompt_tokens", prompt_tokens)
+        completion = usage.get("completion_tokens")
+        if completion is None and self.count_tokens:
+            completion = sum(self.count_tokens(g.text or "") for gens in response.generations for g in gens)
+        if prompt:
+            LLM_TOKENS.inc(prompt, model=model, kind="prompt")
+        if completion:
+            LLM_TOKENS.inc(completion, model=model, kind="completion")
+        record_span(f"llm:{model}", time.perf_counter() - started,
+                    prompt_tokens=prompt, completion_tokens=completion)
+
+    async def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record_span(f"llm:{run[1]}", time.perf_counter() - run[0], error=True)
+
+    async def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._runs[run_id] = (time.perf_counter(), (serialized or {}).get("name", "tool"), None)
+
+    async def on_tool_end(self, output, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record_span(f"tool:{run[1]}", time.perf_counter() - run[0])
+
+    async def on_tool_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record_span(f"tool:{run[1]}", time.perf_counter() - run[0], error=True)
+
+
+# -------------------
+# Journalisation hors du chemin critique
+# -------------------
+def use_queue_logging(target: logging.Logger) -> logging.handlers.QueueListener:
+    """
+    Remplace les handlers du logger par un QueueHandler : les requêtes ne font
+    qu'empiler l'enregistrement, l'écriture sur stdout se fait dans un thread.
+    """
+    log_queue: queue.Queue = queue.Queue(-1)
+    handlers = list(target.handlers)
+    for handler in handlers:
+        target.removeHandler(handler)
+    target.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,119 @@
+import functools
+import io
+import os
+import re
+
+from backend.process_pool import ProcessPool
+
+# -------------------
+# Rendu PDF des fiches de révision
+# -------------------
+# Conversion Markdown (sous-ensemble produit par REVISION_PROMPT : ###, listes,
+# **gras**, *italique*) vers les flowables ReportLab. Le rendu tourne dans un
+# pool de processus : c'est du CPU pur, il ne doit pas occuper la boucle
+# d'événements ni les threads du pool bloquant.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+# Taille des morceaux envoyés au client (StreamingResponse)
+PDF_STREAM_CHUNK_SIZE = int(os.getenv("PDF_STREAM_CHUNK_SIZE", str(64 * 1024)))
+
+BOLD_RE = re.compile(r"\*\*(.*?)\*\*")
+ITALIC_RE = re.compile(r"\*(.*?)\*")
+TITLE_MARKUP_RE = re.compile(r"#{3}|\*")
+
+ACCENT_COLOR = "#96151b"
+
+process_pool = ProcessPool(PDF_WORKERS)
+
+
+@functools.lru_cache(maxsize=1)
+def revision_styles() -> dict:
+    """Styles construits une fois par processus (getSampleStyleSheet est coûteux)."""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    styles = getSampleStyleSheet()
+    return {
+        "header": ParagraphStyle('Header', parent=styles['Normal'], fontSize=9, textColor=colors.grey),
+        "title": ParagraphStyle(
+            'Title',
+            parent=styles['Heading1'],
+            fontSize=24,
+            textColor=colors.HexColor(ACCENT_COLOR),
+            spaceAfter=30,
+            alignment=1
+        ),
+        "sub": ParagraphStyle(
+            'Sub',
+            parent=styles['Heading2'],
+            fontSize=14,
+            textColor=colors.HexColor(ACCENT_COLOR),
+            spaceBefore=15,
+            spaceAfter=10,
+            borderPadding=5
+        ),
+        "bullet": styles['Bullet'],
+        "normal": styles['Normal'],
+    }
+
+
+def inline_markup(text: str) -> str:
+    """Gras/italique Markdown -> balises ReportLab."""
+    return ITALIC_RE.sub(r"<i>\1</i>", BOLD_RE.sub(r"<b>\1</b>", text))
+
+
+def markdown_to_flowables(content: str) -> list:
+    from reportlab.platypus import Paragraph, Spacer
+
+    styles = revision_styles()
+    elements = []
+    for line in content.split('\n'):
+        clean_line = line.strip()
+        if not clean_line:
+            continue
+
+        # 1. Titres (###) : on retire aussi les ** / * que le LLM aurait mis dans le titre
+        if clean_line.startswith('###'):
+            elements.append(Paragraph(TITLE_MARKUP_RE.sub("", clean_line).strip(), styles["sub"]))
+        # 2. Listes (• ou -)
+        elif clean_line.startswith('•') or clean_line.startswith('-'):
+            elements.append(Paragraph(inline_markup(clean_line.lstrip('•- ').strip()), styles["bullet"]))
+        # 3. Texte standard
+        else:
+            elements.append(Paragraph(inline_markup(clean_line), styles["normal"]))
+
+        elements.append(Spacer(1, 8))
+    return elements
+
+
+def render_revision_pdf(content: str, doc_name: str) -> bytes:
+    """Fiche complète (en-tête, contenu, pied de page) ; renvoie les octets du PDF."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+    styles = revision_styles()
+    buffer = io.BytesIO()
+    # Marges plus larges pour un look plus pro
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=50, leftMargin=50, topMargin=50, bottomMargin=50)
+
+    # En-tête : "Polly AI - Assistant Pédagogique"
+    elements = [Paragraph("POLLY AI | Assistant Pédagogique Intelligent", styles["header"]), Spacer(1, 12)]
+    elements.extend(markdown_to_flowables(content))
+
+    # Pied de page
+    elements.append(Spacer(1, 30))
+    elements.append(Paragraph("<hr/>", styles["normal"]))
+    elements.append(Paragraph(f"Généré par Polly AI - Projet de Fin d'Études 2026 - Cours : {doc_name}", styles["header"]))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+async def render_revision_pdf_async(content: str, doc_name: str) -> bytes:
+    return await process_pool.run(render_revision_pdf, content, doc_name)
+
+
+def iter_pdf_chunks(pdf: bytes, chunk_size: int = PDF_STREAM_CHUNK_SIZE):
+    """Découpe le PDF pour l'envoi : le client reçoit les premiers octets sans attendre la copie complète."""
+    view = memoryview(pdf)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start:start + chunk_size])
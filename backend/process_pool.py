@@ -0,0 +1,48 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+# -------------------
+# Pool de processus pour le travail CPU (parsing PDF, rendu ReportLab)
+# -------------------
+class ProcessPool:
+    """
+    ProcessPoolExecutor créé au premier usage, en spawn et non fork : le serveur
+    a déjà des threads (pools, connexions) quand il en a besoin. Un pool cassé
+    (worker tué, OOM) est abandonné et l'appel retenté une fois sur un pool neuf.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.resets = 0
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def reset(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.resets += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self.executor()
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                self.reset(executor)
+                if attempt:
+                    raise
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+
+from sqlalchemy import text
+
+# -------------------
+# Banque de questions QCM
+# -------------------
+# Questions déjà validées, par sélection de documents et sujet. /generate-qcm
+# pioche dedans ; des workers de fond la remplissent.
+QCM_BANK_DDL = text("""
+    CREATE TABLE IF NOT EXISTS qcm_bank (
+        id BIGSERIAL PRIMARY KEY,
+        doc_key TEXT NOT NULL,
+        topic_key TEXT NOT NULL,
+        question_hash TEXT NOT NULL,
+        item JSONB NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        UNIQUE (doc_key, topic_key, question_hash)
+    );
+""")
+
+QCM_BANK_COUNT = text("SELECT COUNT(*) FROM qcm_bank WHERE doc_key = :doc_key AND topic_key = :topic_key;")
+
+QCM_BANK_SAMPLE = text("""
+    SELECT item FROM qcm_bank
+    WHERE doc_key = :doc_key AND topic_key = :topic_key
+    ORDER BY random()
+    LIMIT :n;
+""")
+
+QCM_BANK_INSERT = text("""
+    INSERT INTO qcm_bank (doc_key, topic_key, question_hash, item)
+    VALUES (:doc_key, :topic_key, :question_hash, CAST(:item AS jsonb))
+    ON CONFLICT (doc_key, topic_key, question_hash) DO NOTHING;
+""")
+
+QCM_BANK_DELETE_SOURCE = text("""
+    DELETE FROM qcm_bank
+    WHERE :source = ANY(string_to_array(doc_key, '|'));
+""")
+
+# Mots de commande retirés de la demande pour obtenir le sujet
+_COMMAND_WORDS = {
+    "qcm", "quiz", "test", "fais", "fait", "faire", "moi", "un", "une", "des", "le", "la", "les",
+    "sur", "de", "du", "d", "l", "genere", "generer", "cree", "creer", "donne", "propose",
+    "questions", "question", "svp", "stp", "merci", "me", "m", "en", "au", "aux", "cours",
+}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+GENERAL_TOPIC = "general"
+
+
+def topic_key(request: str) -> str:
+    """'Fais moi un QCM sur la Ve République' -> 've republique'."""
+    ascii_text = unicodedata.normalize("NFKD", request.lower()).encode("ascii", "ignore").decode("ascii")
+    words = [w for w in _WORD_RE.findall(ascii_text) if w not in _COMMAND_WORDS]
+    return " ".join(words) or GENERAL_TOPIC
+
+
+def question_hash(item: dict) -> str:
+    normalized = " ".join(_WORD_RE.findall(item["question"].lower()))
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class QCMBank:
+    def __init__(self, engine):
+        self.engine = engine
+        self._table_ready = False
+        self._lock = threading.Lock()
+
+    def _ensure_table(self):
+        with self._lock:
+            if not self._table_ready:
+                with self.engine.begin() as conn:
+                    conn.execute(QCM_BANK_DDL)
+                self._table_ready = True
+
+    def count(self, doc_key: str, topic: str) -> int:
+        self._ensure_table()
+        with self.engine.connect() as conn:
+            return conn.execute(QCM_BANK_COUNT, {"doc_key": doc_key, "topic_key": topic}).scalar()
+
+    def sample(self, doc_key: str, topic: str, n: int) -> list[dict]:
+        """Tirage aléatoire ; l'unicité des questions est garantie par question_hash."""
+        self._ensure_table()
+        with self.engine.connect() as conn:
+            rows = conn.execute(QCM_BANK_SAMPLE, {"doc_key": doc_key, "topic_key": topic, "n": n}).fetchall()
+        return [row[0] for row in rows]
+
+    def add(self, doc_key: str, topic: str, items: list[dict]):
+        """Ajoute les questions ; les doublons (même question normalisée) sont ignorés."""
+        self._ensure_table()
+        params = [
+            {"doc_key": doc_key, "topic_key": topic, "question_hash": question_hash(item),
+             "item": json.dumps(item, ensure_ascii=False)}
+            for item in items
+        ]
+        if not params:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(QCM_BANK_INSERT, params)
+
+    def invalidate(self, source: str):
+        self._ensure_table()
+        with self.engine.begin() as conn:
+            conn.execute(QCM_BANK_DELETE_SOURCE, {"source": source})
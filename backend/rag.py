@@ -1,5 +1,5 @@
 import os
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
@@ -12,28 +12,45 @@ import json
 import re
 import logging
 import sys
+import asyncio
+import contextvars
+import time
+import threading
+import functools
+import secrets
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
 from dotenv import load_dotenv
+import openai
 
 # LangChain
-from langchain_community.vectorstores import PGVector
 from langchain_openai import OpenAIEmbeddings
 from langchain.chat_models import ChatOpenAI
-from langchain_community.utilities import SerpAPIWrapper
 from langchain.tools import tool
 from langchain.schema import Document
-from langchain.agents import initialize_agent, AgentType
 from langchain.schema import SystemMessage
 from langchain.schema import HumanMessage
-
-from sqlalchemy import create_engine, text
+from langchain.callbacks.base import AsyncCallbackHandler
+
+from sqlalchemy import text
+
+from backend.db import DB_MAX_OVERFLOW, DB_POOL_SIZE, PG_CONNECTION_STRING, PoolMonitor, create_db_engine
+from backend.cache import CachedEmbeddings, CachedSearch, CircuitBreaker, SearchUnavailable, SemanticAnswerCache
+from backend.catalog import DocumentCatalog
+from backend.rerank import CrossEncoderReranker, mmr_rerank, rerank_config, strip_embeddings
+from backend.retrieval import PGVectorSearch, reciprocal_rank_fusion, selected_sources
+from backend.ingest import ingest_paths
+from backend.context import ContextPacker
+from backend.history import ConversationMemory
+from backend.qcm_bank import GENERAL_TOPIC, QCMBank, question_hash, topic_key
+from backend.llm_dispatch import LLMDispatcher, PRIORITY_BATCH, PRIORITY_INTERACTIVE, llm_user_ctx, set_llm_caller
+from backend.observability import MetricsCallbackHandler, REQUEST_LATENCY, Tracer, registry, stage, use_queue_logging
+from backend.pdf_renderer import iter_pdf_chunks, render_revision_pdf_async
+from backend.sheets import BatchSummaryCache, RevisionSheetStore, batch_hash, sheet_key, split_batches
 
 # PDF generation
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-import io
+import tempfile
 from fastapi.responses import StreamingResponse
 
 load_dotenv()
@@ -52,21 +69,33 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.propagate = False
 
+# Détails volumineux (chunks récupérés, réponses SerpAPI, trace de l'agent) :
+# désactivés par défaut, LOG_VERBOSE=1 pour les réactiver.
+LOG_VERBOSE = os.getenv("LOG_VERBOSE", "0") == "1"
+# LOG_ASYNC=1 : écriture des logs dans un thread (QueueHandler), hors du chemin des requêtes
+if os.getenv("LOG_ASYNC", "0") == "1":
+    log_listener = use_queue_logging(logger)
+
+# Traces détaillées échantillonnées (les histogrammes de /metrics couvrent toutes les requêtes)
+tracer = Tracer(sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0.1")))
+
 # -------------------
 # Configuration DB
 # -------------------
-PG_CONNECTION_STRING = (
-    f"postgresql+psycopg2://"
-    f"{os.getenv('PG_USER')}:{os.getenv('PG_PASSWORD')}"
-    f"@{os.getenv('PG_HOST')}:{os.getenv('PG_PORT')}"
-    f"/{os.getenv('PG_DB')}"
-)
+# Un seul pool de connexions pour PGVector et les requêtes SQL
+engine = create_db_engine()
+pool_monitor = PoolMonitor(engine)
+
+# Catalogue des documents (source, nb de chunks, date de mise à jour)
+catalog = DocumentCatalog(engine, ttl=float(os.getenv("CATALOG_CACHE_TTL", "300")))
 
-engine = create_engine(PG_CONNECTION_STRING)
+# Fiches de révision stockées par document et version du contenu
+sheet_store = RevisionSheetStore(engine, catalog)
 
 TABLE_NAME = "langchain_pg_embedding"
-CURRENT_SELECTED_DOC = None
-CURRENT_USER_QUESTION = None
+# Document(s) sélectionné(s) pour la requête en cours. Un ContextVar (et non une
+# globale) pour que les requêtes concurrentes ne se partagent pas leur filtre.
+selected_doc_ctx: contextvars.ContextVar = contextvars.ContextVar("selected_doc", default=None)
 
 class ChatMessage(BaseModel):
     role: str  # "user" | "assistant"
@@ -76,82 +105,211 @@ class ChatRequest(BaseModel):
     question: str
     history: list[ChatMessage]
     document: str | list[str] | None = None
+    conversation_id: str | None = None
+
+# -------------------
+# Pool de travail pour les appels bloquants
+# -------------------
+# Les appels synchrones (SQL, PGVector, ReportLab) sont déportés dans un pool
+# borné pour ne jamais bloquer la boucle d'événements d'uvicorn. Par défaut, il
+# est aligné sur le pool de connexions : plus de threads que de connexions ne
+# ferait qu'attendre dans pool_timeout.
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+blocking_pool = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="rag-blocking")
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_pool, lambda: func(*args, **kwargs))
+
+# -------------------
+# Initialisation paresseuse
+# -------------------
+# Les composants qui touchent au réseau (PGVector, SerpAPI, LLM, agent) sont
+# construits au premier usage et non à l'import : démarrage à froid rapide sur
+# Cloud Run, et un service indisponible ne fait plus échouer le démarrage.
+def lazy(factory):
+    """Construit la ressource au premier appel (thread-safe), puis la réutilise."""
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    get.initialized = lambda: bool(instance)
+    return get
 
 # -------------------
 # Embeddings et vectordb
 # -------------------
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-vectordb = PGVector(
-    connection_string=PG_CONNECTION_STRING,
-    embedding_function=embeddings,
-    collection_name="documents" # Correspond au nom dans langchain_pg_collection
+EMBEDDING_MODEL = "text-embedding-3-small"
+COLLECTION_NAME = "documents"
+
+# Cache des embeddings de requêtes (LRU/TTL en mémoire + SQLite optionnel)
+embeddings = CachedEmbeddings(
+    OpenAIEmbeddings(model=EMBEDDING_MODEL),
+    model_name=EMBEDDING_MODEL,
+    maxsize=int(os.getenv("EMBEDDING_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("EMBEDDING_CACHE_TTL", "86400")),
+    sqlite_path=os.getenv("EMBEDDING_CACHE_PATH"),
+    executor=blocking_pool,
 )
+@lazy
+def get_vectordb():
+    # Crée l'extension, les tables et la collection : accès DB, donc au premier besoin
+    from langchain_community.vectorstores import PGVector
+    return PGVector(
+        connection_string=PG_CONNECTION_STRING,
+        connection=engine,  # réutilise le pool partagé au lieu d'ouvrir le sien
+        embedding_function=embeddings,
+        collection_name=COLLECTION_NAME # Correspond au nom dans langchain_pg_collection
+    )
+
+vector_search = PGVectorSearch(engine, COLLECTION_NAME)
 
 # -------------------
 # Recherche interne
 # -------------------
-def retrieve_relevant_chunks(question: str, k: int = 8, document_name: str | list | None = None):
-    filter_metadata = None
-
-    if document_name:
-        # Cas 1 : C'est une liste
-        if isinstance(document_name, list):
-            if len(document_name) == 1:
-                # UN SEUL document dans la liste -> on simplifie le filtre
-                filter_metadata = {"source": document_name[0]}
-            elif len(document_name) > 1:
-                # PLUSIEURS documents -> on utilise $in
-                filter_metadata = {"source": {"$in": document_name}}
-        
-        # Cas 2 : C'est une string (et pas GLOBAL)
-        elif isinstance(document_name, str) and document_name != "GLOBAL":
-            filter_metadata = {"source": document_name}
-
-    logger.info("="*50)
-    logger.info("--- 🔍 DÉBUT RECHERCHE VECTORIELLE ---")
-    logger.info(f"Question envoyée à PGVector: '{question}'")
-    logger.info(f"Filtre appliqué: {filter_metadata}")
-
-    docs = vectordb.similarity_search(
-        query=question,
-        k=k,
-        filter=filter_metadata
+# "vector" : similarité cosinus seule | "hybrid" : vecteur + plein texte fusionnés (RRF)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+
+# Reranking par usage : on sur-échantillonne (fetch_k) puis on garde k chunks
+# pertinents et diversifiés. "mmr" (vecteurs stockés, NumPy), "cross-encoder"
+# (sentence-transformers, CPU, optionnel) ou "none" (top-k cosinus brut).
+RERANK_CONFIGS = {
+    "ask": rerank_config("ask", "mmr", fetch_k=24, k=5),
+    "qcm": rerank_config("qcm", "mmr", fetch_k=24, k=8),
+    "sheet": rerank_config("sheet", "mmr", fetch_k=40, k=12),
+}
+cross_encoder = CrossEncoderReranker()
+
+async def rerank_chunks(question: str, query_embedding, docs: list, method: str, k: int) -> list:
+    if method == "cross-encoder" and await run_blocking(cross_encoder.available):
+        with stage("rerank:cross-encoder", candidates=len(docs)):
+            return await run_blocking(cross_encoder.rerank, question, docs, k)
+    with stage("rerank:mmr", candidates=len(docs)):
+        return mmr_rerank(query_embedding, docs, k)
+
+async def hybrid_retrieve_chunks(question: str, k: int, sources: list[str] | None, query_embedding,
+                                 with_embeddings: bool = False):
+    """Recherche vectorielle et plein texte en parallèle, fusionnées par Reciprocal Rank Fusion."""
+    fetch_k = max(k, HYBRID_CANDIDATES)
+    vector_docs, text_docs = await asyncio.gather(
+        run_blocking(vector_search.search, query_embedding, k=fetch_k, sources=sources,
+                     with_embeddings=with_embeddings),
+        run_blocking(vector_search.full_text_search, question, k=fetch_k, sources=sources,
+                     with_embeddings=with_embeddings),
     )
+    logger.info(f"🔀 [HYBRID] {len(vector_docs)} vecteur / {len(text_docs)} plein texte")
+    return reciprocal_rank_fusion([vector_docs, text_docs], k=k)
+
+async def retrieve_relevant_chunks(question: str, k: int = 8, document_name: str | list | None = None,
+                                   mode: str | None = None, usage: str | None = None):
+    """
+    usage ("ask", "qcm", "sheet") active le reranking configuré pour cet usage :
+    le nombre de chunks renvoyés est alors celui de RERANK_CONFIGS, et non k.
+    """
+    sources = selected_sources(document_name)
+    mode = mode or RETRIEVAL_MODE
+    config = RERANK_CONFIGS.get(usage)
+    rerank = config is not None and config["method"] != "none"
+    fetch_k = max(k, config["fetch_k"]) if rerank else k
+
+    logger.info(f"🔍 [VECTOR SEARCH] '{question}' (mode: {mode}, filtre: {sources})")
+
+    # Embedding asynchrone, puis recherche SQL (colonne source + index HNSW) dans le pool borné
+    with stage("embedding"):
+        query_embedding = await embeddings.aembed_query(question)
+    with stage(f"search:{mode}", k=fetch_k):
+        if mode == "hybrid":
+            docs = await hybrid_retrieve_chunks(question, fetch_k, sources, query_embedding, with_embeddings=rerank)
+        else:
+            docs = await run_blocking(vector_search.search, query_embedding, k=fetch_k, sources=sources,
+                                      with_embeddings=rerank)
+    if rerank:
+        candidates = len(docs)
+        docs = await rerank_chunks(question, query_embedding, docs, config["method"], config["k"])
+        logger.info(f"🎯 [RERANK:{usage}] {config['method']} : {len(docs)}/{candidates} chunks retenus")
+    strip_embeddings(docs)
 
     logger.info(f"✅ [VECTOR SEARCH] {len(docs)} chunks récupérés.")
-    for i, doc in enumerate(docs):
-        # On affiche les 100 premiers caractères de chaque chunk pour le suivi
-        content_snippet = doc.page_content.replace('\n', ' ')[:100]
-        logger.info(f"   [Chunk {i+1}] Source: {doc.metadata.get('source')} | Contenu: {content_snippet}...")
-    logger.info("="*50)
+    if LOG_VERBOSE:
+        for i, doc in enumerate(docs):
+            # On affiche les 100 premiers caractères de chaque chunk pour le suivi
+            content_snippet = doc.page_content.replace('\n', ' ')[:100]
+            logger.info(f"   [Chunk {i+1}] Source: {doc.metadata.get('source')} | Contenu: {content_snippet}...")
 
     return docs
 
-def format_chunks(chunks):
-    return "\n\n".join([doc.page_content for doc in chunks])
+# Budgets de tokens du contexte injecté dans les prompts
+CONTEXT_BUDGETS = {
+    "ask": int(os.getenv("CONTEXT_TOKENS_ASK", "3000")),
+    "qcm": int(os.getenv("CONTEXT_TOKENS_QCM", "3000")),
+    "sheet": int(os.getenv("CONTEXT_TOKENS_SHEET", "6000")),
+}
+context_packer = ContextPacker(dedup_threshold=float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8")))
+
+def format_chunks(chunks, usage: str = "ask"):
+    """Contexte dédupliqué et tronqué au budget de tokens de l'usage."""
+    with stage("context_packing"):
+        packed = context_packer.pack(chunks, max_tokens=CONTEXT_BUDGETS[usage])
+    logger.info(
+        f"📦 [CONTEXT:{usage}] {len(packed['docs'])}/{len(chunks)} chunks, {packed['tokens']} tokens "
+        f"({packed['tokens_saved']} économisés, {packed['dropped_duplicates']} doublons)"
+    )
+    return packed["text"]
 
 # -------------------
 # Recherche externe
 # -------------------
-serp = SerpAPIWrapper()  # nécessite SERPAPI_API_KEY dans .env
+@lazy
+def get_serp():
+    from langchain_community.utilities import SerpAPIWrapper
+    return SerpAPIWrapper()  # nécessite SERPAPI_API_KEY dans .env
+
+async def serp_search(query: str) -> str:
+    return await get_serp().arun(query)
+
+# Cache des recherches web + coalescence des requêtes identiques + coupe-circuit
+web_search = CachedSearch(
+    serp_search,
+    maxsize=int(os.getenv("SERP_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("SERP_CACHE_TTL", "21600")),
+    timeout=float(os.getenv("SERP_TIMEOUT", "10")),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("SERP_BREAKER_FAILURES", "3")),
+        reset_timeout=float(os.getenv("SERP_BREAKER_RESET", "60")),
+    ),
+)
 
 @tool
-def external_search_tool(query: str) -> str:
+async def external_search_tool(query: str) -> str:
     """
     Effectue une recherche Internet via SerpAPI.
     À utiliser uniquement si les informations ne sont pas disponibles
     dans les documents internes ou si des notions sont complexes.
     """
 
-    logger.info(f"🛠️ Tool utilisé avec la question forcée : {query}")
     logger.info(f"🌐 [TOOL: EXTERNAL] Recherche web pour : '{query}'")
     
-    res = serp.run(query)
-    logger.info(f"✅ [TOOL: EXTERNAL] Résultat récupéré (reponse: {res} ")
+    try:
+        with stage("web_search"):
+            res = await web_search.run(query)
+    except SearchUnavailable as e:
+        logger.warning(f"⚠️ [TOOL: EXTERNAL] Recherche web indisponible : {e}")
+        return "La recherche Internet est momentanément indisponible. Réponds à partir des cours uniquement."
+    logger.info(f"✅ [TOOL: EXTERNAL] Résultat récupéré ({len(res)} caractères)")
+    if LOG_VERBOSE:
+        logger.info(f"   [TOOL: EXTERNAL] Réponse : {res}")
     return res
 
 @tool
-def internal_document_search(query: str) -> str:
+async def internal_document_search(query: str) -> str:
     """
     Recherche des informations pertinentes dans les cours de science politique.
     Utilise cet outil pour répondre aux questions sur le contenu des cours.
@@ -160,25 +318,30 @@ def internal_document_search(query: str) -> str:
     
 
     logger.info(f"🛠️ [TOOL: INTERNAL] Requête finale choisie : '{query}'")
-    logger.info(f"📍 [TOOL: INTERNAL] Contexte Document: {CURRENT_SELECTED_DOC}")
+    selected_doc = selected_doc_ctx.get()
+    logger.info(f"📍 [TOOL: INTERNAL] Contexte Document: {selected_doc}")
 
-    docs = retrieve_relevant_chunks(query, document_name=CURRENT_SELECTED_DOC)
-    return "\n\n".join([doc.page_content for doc in docs])
+    docs = await retrieve_relevant_chunks(query, document_name=selected_doc, usage="ask")
+    return format_chunks(docs, usage="ask")
 
 # -------------------
 # CoT + synthèse
 # -------------------
 
 
-SYSTEM_PROMPT = """
+PROMPT_IDENTITY = """
 Tu es Polly AI, un assistant pédagogique strict pour un cours de science politique ({course_name}). (mentionne ce nom si l'utilisateur pose des questions sur l'identité du cours). 
+"""
 
+PROMPT_PEDAGOGY = """
 ### 🎓 POSTURE PÉDAGOGIQUE & ÉTHIQUE
 1. TON BUT : Tu es un mentor dont l'objectif est la COMPRÉHENSION. Tu dois aider l'étudiant à assimiler les concepts, pas faire le travail à sa place.
 2. INTERDICTION : Tu ne dois JAMAIS rédiger un devoir complet, une dissertation entière ou répondre à un exercice de bout en bout.
 3. MÉTHODE : Si un étudiant demande de faire un travail, décompose la tâche. Explique la méthodologie, définis les concepts clés et aiguille l'étudiant vers les parties pertinentes du cours pour qu'il puisse construire sa propre réponse.
 4. GUIDAGE : Pose des questions réflexives pour vérifier la compréhension ou suggère des pistes de réflexion.
+"""
 
+PROMPT_AGENT_PROTOCOL = """
 ### 🛠️ PROTOCOLE DE RÉPONSE OBLIGATOIRE
 1. Tu dois TOUJOURS commencer par utiliser l'outil 'internal_document_search' pour chercher l'information, même si la question semble générale ou factuelle.
 2. Si, et seulement si, l'outil interne ne renvoie pas l'information (ou si tu as un doute sérieux), tu dois répondre : 
@@ -201,7 +364,23 @@ Exemple :
 - Agent : (Cherche "démocratie")
 - User : "Donne moi des exemples." 
 - Agent : (Cherche "exemples de démocratie science politique") et non juste "exemples".
+"""
+
+# Mode pipeline : la recherche interne est déjà faite, le contexte est fourni
+PROMPT_PIPELINE_PROTOCOL = """
+### 🛠️ PROTOCOLE DE RÉPONSE OBLIGATOIRE
+1. Réponds UNIQUEMENT à partir des extraits du cours fournis dans la section "EXTRAITS DU COURS".
+2. Si les extraits ne contiennent pas l'information (ou si tu as un doute sérieux), tu dois répondre : 
+   "Je suis désolé, je ne trouve pas cette information dans le cours '{course_name}'. Souhaitez-vous que je fasse une recherche sur Internet pour vous ?"
 
+### 📋 RÈGLES STRICTES
+1. Si un document est sélectionné, RESTE strictement dans le cadre de ce document.
+2. Ne réponds jamais à une question qui n'a aucun rapport avec le cours sélectionné.
+3. Indique clairement que les informations proviennent du cours (source interne).
+4. Ne fais aucune supposition sans source
+"""
+
+PROMPT_STYLE = """
 ### 🎨 DIRECTIVES DE STYLE ET FORMATAGE (MARKDOWN OBLIGATOIRE)
 1. Titres : Utilise '###' pour les sections principales.
 2. Mise en forme : Utilise le **gras** pour les concepts clés et l'italique pour les citations ou termes latins.
@@ -211,37 +390,317 @@ Exemple :
 6. Tableaux : Si tu compares deux concepts (ex: Démocratie vs Totalitarisme), utilise un tableau Markdown.
 """
 
+SYSTEM_PROMPT = PROMPT_IDENTITY + PROMPT_PEDAGOGY + PROMPT_AGENT_PROTOCOL + PROMPT_STYLE
+PIPELINE_SYSTEM_PROMPT = PROMPT_IDENTITY + PROMPT_PEDAGOGY + PROMPT_PIPELINE_PROTOCOL + PROMPT_STYLE
+
+REWRITE_PROMPT = """
+Transforme la dernière question de l'étudiant en une requête de recherche complète et autonome, en utilisant l'historique de la conversation.
+Exemple : après "Parle moi de la démocratie.", la question "Donne moi des exemples." devient "exemples de démocratie science politique".
+Réponds UNIQUEMENT par la requête, sans guillemets ni commentaire.
+
+### 💬 ÉCHANGES PRÉCÉDENTS
+{history_text}
+
+### ❓ DERNIÈRE QUESTION
+{question}
+"""
+
+
+# Durée et tokens de chaque appel LLM / outil, exportés sur /metrics
+llm_metrics = MetricsCallbackHandler(count_tokens=context_packer.count_tokens)
+
+# -------------------
+# Dispatch des appels LLM (quotas, équité, priorité)
+# -------------------
+# Un dispatcher par modèle : les limites OpenAI (RPM / TPM) sont par modèle.
+LLM_RPM = int(os.getenv("LLM_RPM", "500"))
+LLM_TPM = int(os.getenv("LLM_TPM", "40000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+# Tokens de sortie réservés par appel (la réponse n'est pas connue à l'avance)
+LLM_COMPLETION_ESTIMATE = int(os.getenv("LLM_COMPLETION_ESTIMATE", "600"))
+llm_dispatchers: dict[str, LLMDispatcher] = {}
+
+def get_dispatcher(model_name: str) -> LLMDispatcher:
+    if model_name not in llm_dispatchers:
+        llm_dispatchers[model_name] = LLMDispatcher(
+            model_name, rpm=LLM_RPM, tpm=LLM_TPM,
+            max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES
+        )
+    return llm_dispatchers[model_name]
+
+class DispatchedChatOpenAI(ChatOpenAI):
+    """ChatOpenAI dont chaque appel (agent compris) passe par le dispatcher de son modèle."""
+
+    # stop / run_manager explicites : langchain ne transmet run_manager (et donc
+    # les tokens en streaming vers les callbacks) que si la signature le déclare.
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        generate = super()._agenerate
+        tokens = sum(context_packer.count_tokens(str(m.content)) for m in messages) + LLM_COMPLETION_ESTIMATE
+        return await get_dispatcher(self.model_name).call(
+            lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs), tokens=tokens
+        )
 
-llm = ChatOpenAI(model_name="gpt-4", temperature=0)
+def caller_id(request: Request) -> str:
+    """
+    Utilisateur pour l'équité : adresse du client vue par le proxy Cloud Run,
+    c'est-à-dire la dernière entrée de X-Forwarded-For (celle qu'il ajoute). Les
+    entrées précédentes et le conversation_id sont fournis par le client : une
+    clé qu'il choisit lui donnerait autant de tours qu'il le veut.
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return f"ip:{forwarded.split(',')[-1].strip()}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+# max_retries=0 : 429, timeouts et 5xx sont retentés par le dispatcher (backoff + file), pas par le client OpenAI.
+# streaming=True : les tokens sont remontés aux callbacks (utilisé par /ask/stream),
+# ainvoke renvoie toujours le message complet.
+@lazy
+def get_llm():
+    return DispatchedChatOpenAI(model_name="gpt-4", temperature=0, streaming=True, max_retries=0, callbacks=[llm_metrics])
 
 tools = [
     internal_document_search,
     external_search_tool
 ]
 
-agent = initialize_agent(
-    tools=tools,
-    llm=llm,
-    agent=AgentType.OPENAI_FUNCTIONS,
-    verbose=True,
+@lazy
+def get_agent():
+    # Import différé : la machinerie d'agent ne sert qu'à la recherche Internet
+    from langchain.agents import initialize_agent, AgentType
+    return initialize_agent(
+        tools=tools,
+        llm=get_llm(),
+        agent=AgentType.OPENAI_FUNCTIONS,
+        verbose=LOG_VERBOSE,
+    )
+
+# "pipeline" : reformulation (si historique) -> recherche interne -> un seul appel GPT-4.
+# L'agent n'est utilisé que pour la recherche Internet (ou si ANSWER_MODE=agent).
+ANSWER_MODE = os.getenv("ANSWER_MODE", "pipeline")
+@lazy
+def get_rewrite_llm():
+    return DispatchedChatOpenAI(model_name=os.getenv("REWRITE_MODEL", "gpt-3.5-turbo"), temperature=0, max_retries=0,
+                                callbacks=[llm_metrics])
+
+# Demande explicite de recherche (verbe de recherche + cible web) : une simple
+# mention (« le rôle d'internet », « en ligne de mire ») reste une question de cours.
+INTERNET_REQUEST_RE = re.compile(
+    r"\b(?:re)?cherch(?:e|es|er|ez)\b(?:\s+\S+){0,3}?\s+(?:(?:sur|dans)\s+(?:internet|le\s+web|google)|en\s+ligne|internet|web)\b"
+    r"|\b(?:trouv|regard|v[ée]rifi)\w*(?:\s+\S+){0,3}?\s+(?:sur|dans)\s+(?:internet|le\s+web|google)\b"
+    r"|\bsur\s+le\s+web\b|\bgoogl(?:er|ise|ize)\w*",
+    re.IGNORECASE,
 )
+AFFIRMATIVE_RE = re.compile(r"^\s*(oui|ok|okay|d'accord|vas-y|volontiers|yes)\b", re.IGNORECASE)
 
-def format_history(history):
-    return "\n".join(
-        [f"{m.role.upper()}: {m.content}" for m in history]
-    )
+# -------------------
+# Historique compacté (derniers messages + résumé des plus anciens)
+# -------------------
+async def summarize_text(prompt: str) -> str:
+    # Tâche de fond (ConversationMemory) : ne passe pas devant les réponses en attente
+    set_llm_caller(llm_user_ctx.get(), PRIORITY_BATCH)
+    response = await get_rewrite_llm().ainvoke([HumanMessage(content=prompt)])
+    return response.content
+
+conversation_memory = ConversationMemory(
+    summarize=summarize_text,
+    count_tokens=context_packer.count_tokens,
+    keep_messages=int(os.getenv("HISTORY_KEEP_MESSAGES", "6")),
+    max_tokens=int(os.getenv("HISTORY_MAX_TOKENS", "1500")),
+)
 
-def answer_question(question: str, history: list):
-    history_text = format_history(history)
-    
-    if isinstance(CURRENT_SELECTED_DOC, list):
-        doc_display = ", ".join(CURRENT_SELECTED_DOC)
-    else:
-        doc_display = CURRENT_SELECTED_DOC
+async def compact_history(question: str, history: list, conversation_id: str | None = None) -> str:
+    # Le frontend ajoute la question courante à l'historique : elle a sa propre section du prompt
+    if history and history[-1].role == "user" and history[-1].content == question:
+        history = history[:-1]
+    return await conversation_memory.compact(history, conversation_id)
 
-    dynamic_system_prompt = SYSTEM_PROMPT.format(course_name=doc_display)
+# -------------------
+# Cache sémantique des réponses (questions de premier tour)
+# -------------------
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    max_entries_per_scope=int(os.getenv("ANSWER_CACHE_SIZE", "256")),
+)
+
+def document_scope(document: str | list[str]) -> str:
+    """Clé stable d'une sélection de documents (ordre indifférent)."""
+    if isinstance(document, list):
+        return "|".join(sorted(document))
+    return document
+
+def is_first_turn(history: list) -> bool:
+    # Le frontend ajoute déjà la question courante à l'historique
+    return not any(m.role == "assistant" for m in history)
+
+def is_cacheable_answer(answer: str) -> bool:
+    # On ne met pas en cache les propositions de recherche Internet
+    return "recherche sur Internet" not in answer
+
+async def lookup_cached_answer(question: str, history: list, document):
+    """
+    Renvoie (réponse en cache ou None, embedding de la question ou None). Une
+    demande de recherche Internet ne doit pas recevoir la réponse tirée du cours.
+    """
+    if not is_first_turn(history) or wants_internet_search(question, history):
+        return None, None
+    question_vector = await embeddings.aembed_query(question)
+    cached = answer_cache.lookup(document_scope(document), question_vector)
+    if cached is not None:
+        logger.info(f"⚡ [ANSWER CACHE] Réponse servie depuis le cache pour : '{question}'")
+    return cached, question_vector
+
+def store_answer(document, question_vector, answer: str, started_at: float):
+    if question_vector is not None and is_cacheable_answer(answer):
+        answer_cache.store(document_scope(document), question_vector, answer, time.perf_counter() - started_at)
+
+def wants_internet_search(question: str, history: list) -> bool:
+    """Recherche Internet demandée explicitement, ou acceptée après proposition."""
+    if INTERNET_REQUEST_RE.search(question):
+        return True
+    previous_answers = [m.content for m in history if m.role == "assistant"]
+    return bool(previous_answers) and "recherche sur Internet" in previous_answers[-1] \
+        and bool(AFFIRMATIVE_RE.match(question))
+
+def course_display(document: str | list[str]) -> str:
+    if isinstance(document, list):
+        return ", ".join(document)
+    return document
+
+async def rewrite_query(question: str, history_text: str) -> str:
+    prompt = REWRITE_PROMPT.format(history_text=history_text, question=question)
+    response = await get_rewrite_llm().ainvoke([HumanMessage(content=prompt)])
+    search_query = response.content.strip().strip('"') or question
+    logger.info(f"🧠 [REWRITE] '{question}' -> '{search_query}'")
+    return search_query
+
+def build_pipeline_messages(question: str, history_text: str, document, context_text: str) -> list:
+    system_prompt = PIPELINE_SYSTEM_PROMPT.format(course_name=course_display(document))
+    return [
+        SystemMessage(content=system_prompt),
+        HumanMessage(content=f"""
+### 📚 CONTEXTE DE TRAVAIL
+Document(s) sélectionné(s) : "{document}"
+(Si "GLOBAL", tu as accès à toute la base de connaissance).
 
-    response = agent.invoke({
+### 📄 EXTRAITS DU COURS
+{context_text}
+
+### 💬 ÉCHANGES PRÉCÉDENTS
+{history_text}
+
+### ❓ QUESTION À TRAITER
+{question}
+
+RAPPEL : **CONSIGNE DE SORTIE :** Réponds en utilisant un Markdown riche (###, **, •).
+"""),
+    ]
+
+async def run_pipeline(question: str, history: list, history_text: str, document,
+                       callbacks: list | None = None) -> str:
+    """Chemin rapide : pas de boucle d'agent, un seul appel GPT-4."""
+    search_query = question if is_first_turn(history) else await rewrite_query(question, history_text)
+    # Appel direct de l'outil : les callbacks (statut /ask/stream) sont déclenchés comme avec l'agent
+    context_text = await internal_document_search.ainvoke(search_query, config={"callbacks": [*(callbacks or []), llm_metrics]})
+    messages = build_pipeline_messages(question, history_text, document, context_text)
+    response = await get_llm().ainvoke(messages, config={"callbacks": callbacks or []})
+    return response.content
+
+async def generate_answer(question: str, history: list, document, callbacks: list | None = None,
+                          conversation_id: str | None = None) -> str:
+    """Choisit le mode : agent (recherche Internet) ou pipeline direct."""
+    history_text = await compact_history(question, history, conversation_id)
+    if ANSWER_MODE == "agent" or wants_internet_search(question, history):
+        logger.info("🤖 [MODE] Agent")
+        agent_input = prepare_agent_input(question, history_text, document)
+        with stage("agent"):
+            response = await get_agent().ainvoke(agent_input, config={"callbacks": [*(callbacks or []), llm_metrics]})
+        return response["output"]
+    logger.info("⚡ [MODE] Pipeline direct")
+    return await run_pipeline(question, history, history_text, document, callbacks)
+
+def prepare_agent_input(question: str, history_text: str, document: str | list[str]) -> dict:
+    dynamic_system_prompt = SYSTEM_PROMPT.format(course_name=course_display(document))
+    return build_agent_input(question, history_text, document, dynamic_system_prompt)
+
+async def answer_question(question: str, history: list, document: str | list[str],
+                          conversation_id: str | None = None):
+    cached, question_vector = await lookup_cached_answer(question, history, document)
+    if cached is not None:
+        return cached
+
+    started_at = time.perf_counter()
+
+    # Le filtre documentaire est lu par internal_document_search via le contexte
+    # de la tâche courante : il ne fuit pas vers les autres requêtes.
+    ctx_token = selected_doc_ctx.set(document)
+    try:
+        answer = await generate_answer(question, history, document, conversation_id=conversation_id)
+    finally:
+        selected_doc_ctx.reset(ctx_token)
+
+    store_answer(document, question_vector, answer, started_at)
+    return answer
+
+class StreamingEventHandler(AsyncCallbackHandler):
+    """Pousse les étapes (outils, tokens) de l'agent ou du pipeline dans une file asyncio."""
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        # Les appels de fonction (choix d'outil) arrivent avec un token vide
+        if token:
+            await self.queue.put({"type": "token", "content": token})
+
+    async def on_tool_start(self, serialized: dict, input_str: str, **kwargs) -> None:
+        await self.queue.put({"type": "status", "tool": serialized.get("name"), "input": input_str})
+
+async def answer_question_stream(question: str, history: list, document: str | list[str],
+                                 conversation_id: str | None = None):
+    """Variante streaming de answer_question : génère des événements SSE."""
+    cached, question_vector = await lookup_cached_answer(question, history, document)
+    if cached is not None:
+        yield f"data: {json.dumps({'type': 'done', 'answer': cached}, ensure_ascii=False)}\n\n"
+        return
+
+    started_at = time.perf_counter()
+    queue: asyncio.Queue = asyncio.Queue()
+    handler = StreamingEventHandler(queue)
+
+    async def run_agent():
+        # La tâche possède sa propre copie du contexte
+        selected_doc_ctx.set(document)
+        # Le flux s'exécute après la fin du middleware : trace propre à la tâche
+        trace_token = tracer.start("/ask/stream")
+        try:
+            answer = await generate_answer(
+                question, history, document, callbacks=[handler], conversation_id=conversation_id
+            )
+            store_answer(document, question_vector, answer, started_at)
+            await queue.put({"type": "done", "answer": answer})
+        except Exception as e:
+            logger.exception("Erreur interne /ask/stream")
+            await queue.put({"type": "error", "error": str(e)})
+        finally:
+            tracer.finish(trace_token)
+
+    task = asyncio.create_task(run_agent())
+    try:
+        while True:
+            event = await queue.get()
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if event["type"] in ("done", "error"):
+                break
+    finally:
+        # Client déconnecté : on arrête la génération
+        if not task.done():
+            task.cancel()
+
+def build_agent_input(question: str, history_text: str, document, dynamic_system_prompt: str) -> dict:
+    return {
         "input": f"""
 SYSTEM_INSTRUCTIONS: {dynamic_system_prompt}
 
@@ -250,7 +709,7 @@ Tu es un **tuteur pédagogique**. Ton but est d'accompagner l'étudiant vers la
 Si la question demande de "faire à sa place", refuse poliment et propose une décomposition méthodologique.
 
 ### 📚 CONTEXTE DE TRAVAIL
-Document(s) sélectionné(s) : "{CURRENT_SELECTED_DOC}"
+Document(s) sélectionné(s) : "{document}"
 (Si "GLOBAL", tu as accès à toute la base de connaissance).
 
 ### 💬 ÉCHANGES PRÉCÉDENTS
@@ -261,9 +720,7 @@ Document(s) sélectionné(s) : "{CURRENT_SELECTED_DOC}"
 
 RAPPEL : **CONSIGNE DE SORTIE :** Réponds en utilisant un Markdown riche (###, **, •).
 """
-    })
-
-    return response["output"]
+    }
 
 
 def normalize_llm_json(text: str) -> str:
@@ -279,6 +736,21 @@ def normalize_llm_json(text: str) -> str:
     return text.strip()
 
 
+def validate_qcm_item(q: dict):
+    if not isinstance(q, dict):
+        raise ValueError("Question invalide")
+
+    for key in ["question", "choices", "correct", "explanation"]:
+        if key not in q:
+            raise ValueError(f"Champ manquant : {key}")
+
+    if not isinstance(q["choices"], list):
+        raise ValueError("choices doit être une liste")
+
+    q["correct"] = int(q["correct"])  # sécurité
+    if not 0 <= q["correct"] < len(q["choices"]):
+        raise ValueError("correct hors des choix")
+
 def validate_qcm(qcm: dict):
     if "title" not in qcm or "questions" not in qcm:
         raise ValueError("Structure QCM invalide")
@@ -287,19 +759,21 @@ def validate_qcm(qcm: dict):
         raise ValueError("Aucune question dans le QCM")
 
     for q in qcm["questions"]:
-        for key in ["question", "choices", "correct", "explanation"]:
-            if key not in q:
-                raise ValueError(f"Champ manquant : {key}")
-
-        if not isinstance(q["choices"], list):
-            raise ValueError("choices doit être une liste")
-
-        q["correct"] = int(q["correct"])  # sécurité
+        validate_qcm_item(q)
 
 # -------------------
 # FastAPI
 # -------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Workers de remplissage de la banque de QCM, arrêtés avec le serveur
+    workers = [asyncio.create_task(qcm_refill_worker()) for _ in range(QCM_WORKERS)]
+    yield
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS pour frontend
 app.add_middleware(
@@ -309,6 +783,54 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+# Flux SSE : la trace est ouverte dans la tâche de génération (answer_question_stream)
+STREAMING_PATHS = {"/ask/stream"}
+
+# /upload : réservé à l'administrateur (jeton dans l'en-tête X-Admin-Token), taille
+# totale plafonnée. Sans UPLOAD_ADMIN_TOKEN, l'upload est désactivé.
+UPLOAD_ADMIN_TOKEN = os.getenv("UPLOAD_ADMIN_TOKEN")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_READ_CHUNK = 1024 * 1024
+
+@app.middleware("http")
+async def guard_uploads(request: Request, call_next):
+    """Refus avant lecture du corps : pas de fichier temporaire pour un appel non autorisé."""
+    if request.url.path != "/upload":
+        return await call_next(request)
+    token = request.headers.get("x-admin-token", "")
+    if not UPLOAD_ADMIN_TOKEN or not secrets.compare_digest(token.encode(), UPLOAD_ADMIN_TOKEN.encode()):
+        logger.warning("🔒 [UPLOAD] Jeton administrateur absent ou invalide")
+        return JSONResponse(status_code=401, content={"error": "Jeton administrateur requis"})
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES:
+        return JSONResponse(status_code=413, content={"error": f"Upload limité à {UPLOAD_MAX_BYTES} octets"})
+    return await call_next(request)
+
+@app.exception_handler(openai.RateLimitError)
+async def rate_limit_handler(request: Request, exc: openai.RateLimitError):
+    # Quotas OpenAI encore dépassés après les nouveaux essais : 503 explicite plutôt qu'une 500
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Le service est très sollicité, réessayez dans quelques instants."},
+        headers={"Retry-After": "30"}
+    )
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Latence par route (histogramme /metrics) + trace échantillonnée."""
+    started = time.perf_counter()
+    trace_token = None if request.url.path in STREAMING_PATHS else tracer.start(request.url.path)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        REQUEST_LATENCY.observe(time.perf_counter() - started, method=request.method, path=path, status=status)
+        tracer.finish(trace_token, status=status)
+
 # Serve frontend statique
 app.mount("/static", StaticFiles(directory="frontend"), name="static")
 @app.get("/")
@@ -319,25 +841,74 @@ class Question(BaseModel):
     question: str
 
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness : le processus répond (aucune dépendance externe vérifiée)."""
+    return {"status": "ok"}
+
+
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", "5"))
+
+def check_database():
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness : base joignable et collection vectorielle initialisée. Le premier
+    appel déclenche l'initialisation paresseuse de PGVector.
+    """
+    checks = {}
+    for name, func in (("database", check_database), ("vectordb", get_vectordb)):
+        try:
+            await asyncio.wait_for(run_blocking(func), timeout=READINESS_TIMEOUT)
+            checks[name] = "ok"
+        except Exception as e:
+            checks[name] = f"error: {type(e).__name__}"
+    ready = all(value == "ok" for value in checks.values())
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "checks": checks})
+
+
+@app.get("/stats")
+async def get_stats():
+    """Compteurs internes (caches, pool de connexions)"""
+    return {
+        "db_pool": pool_monitor.stats(),
+        "web_search": web_search.stats(),
+        "embedding_cache": embeddings.stats(),
+        "answer_cache": answer_cache.stats(),
+        "context_packing": context_packer.stats(),
+        "llm_dispatch": {name: dispatcher.stats() for name, dispatcher in llm_dispatchers.items()},
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Histogrammes et compteurs au format texte Prometheus."""
+    pool = pool_monitor.stats()
+    gauges = [
+        "# HELP rag_db_pool_checked_out Connexions empruntées au pool",
+        "# TYPE rag_db_pool_checked_out gauge",
+        f"rag_db_pool_checked_out {pool['checked_out']}",
+        "# HELP rag_db_pool_peak_checked_out Pic de connexions empruntées",
+        "# TYPE rag_db_pool_peak_checked_out gauge",
+        f"rag_db_pool_peak_checked_out {pool['peak_checked_out']}",
+    ]
+    return Response(
+        content=registry.render() + "\n".join(gauges) + "\n",
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/documents")
-async def list_documents():
+async def list_documents(request: Request):
     """
-    Récupère la liste des documents avec un cast explicite en JSONB
+    Liste des documents servie depuis le catalogue maintenu (document_catalog),
+    avec ETag : le frontend revalide et reçoit un 304 si rien n'a changé.
     """
-    # On ajoute ::jsonb pour régler le problème d'opérateur
-    query = text("""
-        SELECT DISTINCT cmetadata->>'source' AS source_name
-        FROM langchain_pg_embedding
-        WHERE cmetadata IS NOT NULL 
-          AND cmetadata::jsonb ? 'source'
-        ORDER BY source_name;
-    """)
     try:
-        with engine.connect() as conn:
-            results = conn.execute(query).fetchall()
-            documents = [row[0] for row in results if row[0] is not None]
-            logger.info(f"✅ Documents récupérés : {documents}")
-            return {"documents": documents}
+        snapshot = await run_blocking(catalog.get)
     except Exception as e:
         logger.error(f"❌ Erreur SQL dans list_documents : {e}")
         return JSONResponse(
@@ -345,62 +916,129 @@ async def list_documents():
             content={"error": "Erreur SQL", "details": str(e)}
         )
 
+    headers = {"ETag": snapshot["etag"], "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == snapshot["etag"]:
+        return Response(status_code=304, headers=headers)
+
+    documents = [entry["source"] for entry in snapshot["entries"]]
+    logger.info(f"✅ Documents récupérés : {len(documents)} documents")
+    return JSONResponse(
+        content={"documents": documents, "details": snapshot["entries"]},
+        headers=headers
+    )
+
+
+@app.post("/upload")
+async def upload_documents(background_tasks: BackgroundTasks, files: list[UploadFile] = File(...)):
+    """
+    Ingestion de cours PDF : parsing parallèle, embeddings par lots, COPY.
+    Les fichiers déjà indexés avec le même contenu sont ignorés. Accès contrôlé
+    par guard_uploads (jeton administrateur, taille maximale).
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        received = 0
+        for i, upload in enumerate(files):
+            filename = os.path.basename(upload.filename or "")
+            if not filename.lower().endswith(".pdf"):
+                return JSONResponse(
+                    status_code=400,
+                    content={"error": f"Format non supporté : {filename}"}
+                )
+            # Un dossier par fichier : deux envois du même nom ne s'écrasent pas,
+            # ingest_paths les signale comme doublons
+            path = os.path.join(tmp_dir, str(i), filename)
+            os.makedirs(os.path.dirname(path))
+            # Copie par morceaux : le plafond vaut aussi sans Content-Length (chunked)
+            with open(path, "wb") as f:
+                while chunk := await upload.read(UPLOAD_READ_CHUNK):
+                    received += len(chunk)
+                    if received > UPLOAD_MAX_BYTES:
+                        return JSONResponse(
+                            status_code=413,
+                            content={"error": f"Upload limité à {UPLOAD_MAX_BYTES} octets"}
+                        )
+                    f.write(chunk)
+            paths.append(path)
+
+        logger.info(f"📥 [UPLOAD] {len(paths)} fichier(s) reçu(s)")
+        try:
+            await run_blocking(get_vectordb)  # la collection doit exister avant l'ingestion
+            collection_id = await run_blocking(vector_search.collection_id)
+            report = await ingest_paths(paths, engine, catalog, embeddings, collection_id)
+        except Exception as e:
+            logger.exception("Erreur interne upload")
+            return JSONResponse(
+                status_code=500,
+                content={"error": "Erreur lors de l'ingestion", "details": str(e)}
+            )
+
+    # Les réponses et fiches en cache peuvent porter sur un contenu remplacé
+    indexed = [item["source"] for item in report if item["status"] == "indexed"]
+    if indexed:
+        answer_cache.invalidate()
+        for source in indexed:
+            await run_blocking(sheet_store.invalidate, source)
+            await run_blocking(qcm_bank.invalidate, source)
+            schedule_qcm_refill([source], QCM_DEFAULT_TOPIC, topic=GENERAL_TOPIC)
+        background_tasks.add_task(pregenerate_revision_sheets, indexed)
+
+    return {"results": report}
+
 
 @app.post("/ask")
-async def ask_question(req: ChatRequest):
-    global CURRENT_SELECTED_DOC, CURRENT_USER_QUESTION
-    
-    logger.info("\n" + "🚀"*20)
-    logger.info(f"RÉCEPTION REQUÊTE /ASK")
-    logger.info(f"Utilisateur demande: '{req.question}'")
-    logger.info(f"Document sélectionné: '{req.document}'")
+async def ask_question(req: ChatRequest, request: Request):
+    set_llm_caller(caller_id(request), PRIORITY_INTERACTIVE)
+    logger.info(f"🚀 RÉCEPTION REQUÊTE /ASK | Document: '{req.document}' | Question: '{req.question}'")
 
     if not req.document:
         return {"answer": "⚠️ Veuillez sélectionner un cours."}
 
-    CURRENT_SELECTED_DOC = req.document 
-    CURRENT_USER_QUESTION = req.question  
-    
-    answer = answer_question(
+    answer = await answer_question(
         question=req.question,
-        history=req.history
+        history=req.history,
+        document=req.document,
+        conversation_id=req.conversation_id
     )
 
-    logger.info(f"📤 RÉPONSE FINALE ENVOYÉE : {answer[:100]}...")
-    logger.info("🚀"*20 + "\n")
+    logger.info(f"📤 RÉPONSE FINALE ENVOYÉE ({len(answer)} caractères)")
 
     return {"answer": answer}
 
-@app.post("/generate-qcm")
-async def generate_qcm(question: str = Form(...), document: str = Form(None)):
+@app.post("/ask/stream")
+async def ask_question_stream(req: ChatRequest, request: Request):
+    # Le contexte est copié dans la tâche de génération du flux
+    set_llm_caller(caller_id(request), PRIORITY_INTERACTIVE)
+    logger.info(f"🚀 RÉCEPTION REQUÊTE /ASK/STREAM | Document: '{req.document}'")
 
-    actual_docs = document
-    if document and "," in document:
-        actual_docs = [d.strip() for d in document.split(",")]
-
-    logger.info("📝 [QCM] Demande de génération reçue")
-    logger.info(f"📝 [QCM] Sujet: '{question}' | Source: '{actual_docs}'")
-    
-    try:
-        # 1️⃣ Récupérer les documents internes
-        # Utilisation du filtre aussi pour le QCM
-        docs = retrieve_relevant_chunks(question, k=8, document_name=actual_docs)
-        context_text = "\n\n".join([doc.page_content for doc in docs])
+    if not req.document:
+        warning = {"type": "done", "answer": "⚠️ Veuillez sélectionner un cours."}
+        events = iter([f"data: {json.dumps(warning, ensure_ascii=False)}\n\n"])
+    else:
+        events = answer_question_stream(
+            question=req.question,
+            history=req.history,
+            document=req.document,
+            conversation_id=req.conversation_id
+        )
 
-        if not context_text.strip():
-            return JSONResponse(
-                status_code=404, 
-                content={"error": "Aucun contenu trouvé pour générer ce QCM."}
-            )
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        # 2️⃣ Prompt
-        QCM_PROMPT = """
+# -------------------
+# QCM : génération structurée + banque de questions
+# -------------------
+QCM_PROMPT = """
 Tu es un enseignant expert en science politique. 
 L'élève souhaite un QCM spécifique sur le sujet suivant : "{user_query}"
 
-Utilise les documents de référence fournis ci-dessous pour créer les questions. 
-
-Réponds EXCLUSIVEMENT par du JSON valide.
+Utilise les documents de référence fournis ci-dessous pour créer {count} questions. 
+Chaque question a 4 choix, l'index (à partir de 0) de la bonne réponse et une explication.
+{avoid}
+Si tu ne peux pas appeler la fonction create_qcm, réponds EXCLUSIVEMENT par du JSON valide.
 
 Format attendu :
 {{
@@ -418,36 +1056,170 @@ Format attendu :
 Documents de référence :
 {document}
 """
-        # Injection des variables
-        prompt = QCM_PROMPT.format(user_query=question, document=context_text)  
-        # 3️⃣ Appel LLM
-        response = llm.invoke([HumanMessage(content=prompt)])
-        raw_content = response.content
-        logger.info("Raw response du LLM : %s", raw_content)
-
-        # 4️⃣ Extraction robuste du JSON par Regex
-        # Cherche le premier '{' et le dernier '}' pour ignorer le texte autour
-        match = re.search(r"(\{.*\})", raw_content, re.DOTALL)
-        
-        if not match:
-            return JSONResponse(
-                status_code=500, 
-                content={"error": "Le modèle n'a pas généré un format JSON valide", "raw": raw_content}
-            )
-
-        clean_content = normalize_llm_json(match.group(1))
 
+# Sortie structurée par function calling : plus de JSON à extraire du texte
+QCM_FUNCTION = {
+    "name": "create_qcm",
+    "description": "Enregistre un QCM généré à partir des documents de référence.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string", "description": "Titre du QCM"},
+            "questions": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "question": {"type": "string"},
+                        "choices": {"type": "array", "items": {"type": "string"}, "minItems": 4, "maxItems": 4},
+                        "correct": {"type": "integer", "description": "Index de la bonne réponse (0 à 3)"},
+                        "explanation": {"type": "string", "description": "Pourquoi c'est la bonne réponse"},
+                    },
+                    "required": ["question", "choices", "correct", "explanation"],
+                },
+            },
+        },
+        "required": ["title", "questions"],
+    },
+}
+
+QCM_SIZE = int(os.getenv("QCM_SIZE", "5"))
+QCM_BANK_TARGET = int(os.getenv("QCM_BANK_TARGET", "30"))
+QCM_MAX_RETRIES = int(os.getenv("QCM_MAX_RETRIES", "2"))
+QCM_BATCH_SIZE = int(os.getenv("QCM_BATCH_SIZE", "10"))
+QCM_WORKERS = int(os.getenv("QCM_WORKERS", "2"))
+# Consigne envoyée au LLM pour la pré-génération à l'upload ; la banque la range
+# sous GENERAL_TOPIC, la clé des demandes génériques ("Fais moi un QCM").
+QCM_DEFAULT_TOPIC = "Concepts clés du cours"
+
+qcm_bank = QCMBank(engine)
+
+@lazy
+def get_qcm_llm():
+    return get_llm().bind(functions=[QCM_FUNCTION], function_call={"name": "create_qcm"})
+
+def parse_qcm_message(message) -> dict:
+    function_call = message.additional_kwargs.get("function_call")
+    if function_call:
+        return json.loads(function_call["arguments"])
+    # Repli : JSON dans le texte (modèle sans function calling)
+    match = re.search(r"(\{.*\})", message.content or "", re.DOTALL)
+    if not match:
+        raise ValueError("Le modèle n'a pas généré un format JSON valide")
+    return json.loads(normalize_llm_json(match.group(1)))
+
+async def generate_qcm_items(question: str, actual_docs, count: int) -> tuple[str | None, list[dict]]:
+    """Génère `count` questions valides ; seules les questions invalides sont redemandées."""
+    docs = await retrieve_relevant_chunks(question, k=8, document_name=actual_docs, usage="qcm")
+    context_text = format_chunks(docs, usage="qcm")
+    if not context_text.strip():
+        return None, []
+
+    title, items = None, []
+    for attempt in range(QCM_MAX_RETRIES + 1):
+        missing = count - len(items)
+        if missing <= 0:
+            break
+        avoid = ""
+        if items:
+            avoid = "Ne reprends pas ces questions déjà posées :\n" + "\n".join(f"- {q['question']}" for q in items) + "\n"
+        prompt = QCM_PROMPT.format(user_query=question, count=missing, avoid=avoid, document=context_text)
+        try:
+            payload = parse_qcm_message(await get_qcm_llm().ainvoke([HumanMessage(content=prompt)]))
+        except (ValueError, KeyError) as e:
+            logger.warning(f"⚠️ [QCM] Sortie inexploitable (essai {attempt + 1}) : {e}")
+            continue
+
+        title = title or payload.get("title")
+        seen = {question_hash(q) for q in items}
+        invalid = duplicates = 0
+        for q in payload.get("questions", []):
+            if len(items) >= count:
+                break
+            try:
+                validate_qcm_item(q)
+            except (ValueError, TypeError):
+                invalid += 1
+                continue
+            # Un nouvel essai peut reproposer une question déjà retenue
+            digest = question_hash(q)
+            if digest in seen:
+                duplicates += 1
+                continue
+            seen.add(digest)
+            items.append({key: q[key] for key in ("question", "choices", "correct", "explanation")})
+        if invalid or duplicates:
+            logger.warning(f"⚠️ [QCM] {invalid} question(s) invalide(s), {duplicates} doublon(s), nouvel essai pour celles-ci")
+
+    return title, items
+
+# Remplissage de la banque en tâche de fond
+qcm_refill_queue: asyncio.Queue = asyncio.Queue()
+qcm_refill_pending: set = set()
+
+def schedule_qcm_refill(actual_docs: list[str], question: str, topic: str | None = None):
+    """`topic` force la clé de banque (sinon dérivée de la demande)."""
+    topic = topic or topic_key(question)
+    key = (sheet_key(actual_docs), topic)
+    if key not in qcm_refill_pending:
+        qcm_refill_pending.add(key)
+        qcm_refill_queue.put_nowait((actual_docs, question, topic))
+
+async def qcm_refill_worker():
+    while True:
+        actual_docs, question, topic = await qcm_refill_queue.get()
+        doc_key = sheet_key(actual_docs)
         try:
-            qcm_json = json.loads(clean_content)
-            validate_qcm(qcm_json)
-            return JSONResponse(content=qcm_json)
-        except json.JSONDecodeError as e:
-            logger.error("Erreur parsing : %s", clean_content)
+            available = await run_blocking(qcm_bank.count, doc_key, topic)
+            if available < QCM_BANK_TARGET:
+                scope = None if actual_docs == ["GLOBAL"] else actual_docs
+                _, items = await generate_qcm_items(question, scope, min(QCM_BATCH_SIZE, QCM_BANK_TARGET - available))
+                await run_blocking(qcm_bank.add, doc_key, topic, items)
+                logger.info(f"🏦 [QCM BANK] {len(items)} question(s) ajoutée(s) pour {doc_key} / '{topic}'")
+        except Exception:
+            logger.exception("Erreur worker QCM")
+        finally:
+            qcm_refill_pending.discard((doc_key, topic))
+            qcm_refill_queue.task_done()
+
+@app.post("/generate-qcm")
+async def generate_qcm(request: Request, question: str = Form(...), document: str = Form(None)):
+    set_llm_caller(caller_id(request), PRIORITY_BATCH)
+
+    actual_docs = document
+    if document and "," in document:
+        actual_docs = [d.strip() for d in document.split(",")]
+
+    logger.info("📝 [QCM] Demande de génération reçue")
+    logger.info(f"📝 [QCM] Sujet: '{question}' | Source: '{actual_docs}'")
+    
+    try:
+        bank_docs = selected_sources(actual_docs) or ["GLOBAL"]
+        doc_key, topic = sheet_key(bank_docs), topic_key(question)
+
+        # 1️⃣ Banque de questions : réponse immédiate si elle est assez fournie
+        items = await run_blocking(qcm_bank.sample, doc_key, topic, QCM_SIZE)
+        if len(items) >= QCM_SIZE:
+            logger.info(f"⚡ [QCM BANK] QCM servi depuis la banque ({doc_key} / '{topic}')")
+            schedule_qcm_refill(bank_docs, question)
+            return JSONResponse(content={"title": f"QCM : {question}", "questions": items})
+
+        # 2️⃣ Banque épuisée : génération en direct, puis remplissage en fond
+        title, items = await generate_qcm_items(question, actual_docs, QCM_SIZE)
+        if not items:
             return JSONResponse(
-                status_code=500, 
-                content={"error": "Erreur de décodage JSON", "details": str(e)}
+                status_code=404, 
+                content={"error": "Aucun contenu trouvé pour générer ce QCM."}
             )
 
+        qcm_json = {"title": title or f"QCM : {question}", "questions": items}
+        validate_qcm(qcm_json)
+        await run_blocking(qcm_bank.add, doc_key, topic, items)
+        schedule_qcm_refill(bank_docs, question)
+        return JSONResponse(content=qcm_json)
+
+    except openai.RateLimitError:
+        raise  # 503 via rate_limit_handler
     except Exception as e:
         logger.exception("Erreur interne generate-qcm")
         return JSONResponse(
@@ -455,16 +1227,10 @@ Documents de référence :
             content={"error": "Erreur serveur interne", "details": str(e)}
         )
     
-@app.post("/generate-revision-sheet")
-async def generate_revision_sheet(document: str = Form(...)):
-    actual_docs = [d.strip() for d in document.split(",")] if "," in document else [document]
-    doc_name = actual_docs[0]
-    
-    # 1. Récupération et synthèse par le LLM
-    chunks = retrieve_relevant_chunks("Concepts clés, définitions importantes et résumé structuré", k=15, document_name=actual_docs)
-    context_text = format_chunks(chunks)
-
-    prompt = f"""
+# -------------------
+# Fiches de révision
+# -------------------
+REVISION_PROMPT = """
     Tu es un expert en pédagogie spécialisé en Science Politique. 
     Génère une fiche de révision académique pour le cours : "{doc_name}".
     Utilise exclusivement les documents fournis.
@@ -484,82 +1250,157 @@ async def generate_revision_sheet(document: str = Form(...)):
     - Synthèse thématique (Points essentiels)
 
     Texte de référence : {context_text}
-    """
-    
-    response = llm.invoke([HumanMessage(content=prompt)])
-    content = response.content
-
-    # 2. Construction du PDF
-    buffer = io.BytesIO()
-    # Marges plus larges pour un look plus pro
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=50, leftMargin=50, topMargin=50, bottomMargin=50)
-    styles = getSampleStyleSheet()
-    
-    # Styles personnalisés
-    style_header = ParagraphStyle('Header', parent=styles['Normal'], fontSize=9, textColor=colors.grey)
-    style_title = ParagraphStyle(
-        'Title', 
-        parent=styles['Heading1'], 
-        fontSize=24, 
-        textColor=colors.HexColor("#96151b"), # Correction ici
-        spaceAfter=30, 
-        alignment=1
-    )
-    style_sub = ParagraphStyle(
-        'Sub', 
-        parent=styles['Heading2'], 
-        fontSize=14, 
-        textColor=colors.HexColor("#96151b"), # Correction ici
-        spaceBefore=15, 
-        spaceAfter=10, 
-        borderPadding=5
-    )
-    
-    elements = []
+"""
 
-    # En-tête : "Polly AI - Assistant Pédagogique"
-    elements.append(Paragraph("POLLY AI | Assistant Pédagogique Intelligent", style_header))
-    elements.append(Spacer(1, 12))
-    
-    # Transformation du contenu LLM
-    lines = content.split('\n')
-    for line in lines:
-        clean_line = line.strip()
-        if not clean_line: continue
-
-        # 1. Gestion des Titres (###)
-        if clean_line.startswith('###'):
-            # On retire les ### et on nettoie les éventuels ** que le LLM aurait mis dans le titre
-            text_content = clean_line.replace('###', '').replace('**', '').replace('*', '').strip()
-            elements.append(Paragraph(text_content, style_sub))
-        
-        # 2. Gestion des Listes (• ou -)
-        elif clean_line.startswith('•') or clean_line.startswith('-'):
-            text_content = clean_line.lstrip('•- ').strip()
-            # Transformation du gras/italique Markdown en balises PDF
-            text_content = re.sub(r"\*\*(.*?)\*\*", r"<b>\1</b>", text_content)
-            text_content = re.sub(r"\*(.*?)\*", r"<i>\1</i>", text_content)
-            elements.append(Paragraph(text_content, styles['Bullet']))
-            
-        # 3. Texte standard
-        else:
-            # Transformation du gras/italique Markdown en balises PDF
-            clean_line = re.sub(r"\*\*(.*?)\*\*", r"<b>\1</b>", clean_line)
-            clean_line = re.sub(r"\*(.*?)\*", r"<i>\1</i>", clean_line)
-            elements.append(Paragraph(clean_line, styles['Normal']))
-        
-        elements.append(Spacer(1, 8))
+MAP_PROMPT = """
+Tu prépares une fiche de révision de science politique.
+Résume l'extrait de cours ci-dessous sous forme de liste à puces concise, en conservant les concepts clés,
+les définitions, les auteurs, les dates et les arguments essentiels. N'ajoute rien qui ne figure pas dans l'extrait.
 
-    # Pied de page
-    elements.append(Spacer(1, 30))
-    elements.append(Paragraph("<hr/>", styles['Normal']))
-    elements.append(Paragraph(f"Généré par Polly AI - Projet de Fin d'Études 2026 - Cours : {doc_name}", style_header))
+Extrait : {text}
+"""
 
-    doc.build(elements)
-    buffer.seek(0)
+# "mapreduce" : tout le document est résumé par lots puis synthétisé | "topk" : 15 chunks les plus proches
+REVISION_MODE = os.getenv("REVISION_MODE", "mapreduce")
+SHEET_MAP_CONCURRENCY = int(os.getenv("SHEET_MAP_CONCURRENCY", "4"))
+SHEET_BATCH_MIN_TOKENS = int(os.getenv("SHEET_BATCH_MIN_TOKENS", "1500"))
+SHEET_BATCH_MAX_TOKENS = int(os.getenv("SHEET_BATCH_MAX_TOKENS", "3000"))
+@lazy
+def get_map_llm():
+    return DispatchedChatOpenAI(model_name=os.getenv("SHEET_MAP_MODEL", "gpt-3.5-turbo"), temperature=0, max_retries=0,
+                                callbacks=[llm_metrics])
+
+batch_summaries = BatchSummaryCache(engine)
+
+async def summarize_batches(batches: list[list[str]]) -> list[str]:
+    """Phase map : un résumé par lot, en parallèle borné, avec cache par contenu du lot."""
+    hashes = [batch_hash(batch) for batch in batches]
+    cached = await run_blocking(batch_summaries.get_many, hashes)
+    semaphore = asyncio.Semaphore(SHEET_MAP_CONCURRENCY)
+
+    async def summarize(batch: list[str], hash_value: str) -> str:
+        if hash_value in cached:
+            return cached[hash_value]
+        async with semaphore:
+            response = await get_map_llm().ainvoke([HumanMessage(content=MAP_PROMPT.format(text="\n\n".join(batch)))])
+        await run_blocking(batch_summaries.put, hash_value, response.content)
+        return response.content
+
+    summaries = await asyncio.gather(*[summarize(b, h) for b, h in zip(batches, hashes)])
+    logger.info(f"🗺️ [MAP] {len(batches)} lots, {len(cached)} résumés depuis le cache")
+    return list(summaries)
+
+async def collect_revision_context_mapreduce(actual_docs: list[str]) -> str | None:
+    def read_batches():
+        # Les chunks sont lus en flux (curseur serveur) et regroupés au fil de l'eau
+        chunks = (chunk for _, chunk in vector_search.iter_document_chunks(actual_docs))
+        return split_batches(chunks, context_packer.count_tokens, SHEET_BATCH_MIN_TOKENS, SHEET_BATCH_MAX_TOKENS)
+
+    batches = await run_blocking(read_batches)
+    if not batches:
+        return None
+    summaries = await summarize_batches(batches)
+
+    # Phase reduce : tant que les résumés dépassent le budget, on les regroupe et on les résume à nouveau
+    while len(summaries) > 1 and context_packer.count_tokens("\n\n".join(summaries)) > CONTEXT_BUDGETS["sheet"]:
+        regrouped = split_batches(summaries, context_packer.count_tokens, SHEET_BATCH_MIN_TOKENS, SHEET_BATCH_MAX_TOKENS)
+        if len(regrouped) >= len(summaries):
+            break
+        summaries = await summarize_batches(regrouped)
+
+    # Résumés qui ne se regroupent plus : chacun est tronqué à une part égale du
+    # budget, pour ne pas dépasser la fenêtre de contexte de GPT-4
+    budget = CONTEXT_BUDGETS["sheet"]
+    if context_packer.count_tokens("\n\n".join(summaries)) > budget:
+        share = (budget - context_packer.count_tokens("\n\n") * (len(summaries) - 1)) // len(summaries)
+        logger.warning(f"✂️ [REDUCE] {len(summaries)} résumés au-delà du budget, tronqués à {share} tokens chacun")
+        summaries = [context_packer.truncate(summary, share) for summary in summaries]
+    return "\n\n".join(summaries)
+
+async def collect_revision_context_topk(actual_docs: list[str]) -> str:
+    chunks = await retrieve_relevant_chunks("Concepts clés, définitions importantes et résumé structuré", k=15, document_name=actual_docs, usage="sheet")
+    return format_chunks(chunks, usage="sheet")
+
+async def build_revision_markdown(actual_docs: list[str], doc_name: str) -> str:
+    # 1. Récupération et synthèse par le LLM
+    context_text = None
+    if REVISION_MODE == "mapreduce":
+        context_text = await collect_revision_context_mapreduce(actual_docs)
+    if context_text is None:
+        context_text = await collect_revision_context_topk(actual_docs)
+
+    prompt = REVISION_PROMPT.format(doc_name=doc_name, context_text=context_text)
+    response = await get_llm().ainvoke([HumanMessage(content=prompt)])
+    return response.content
+
+# Une seule génération à la fois par sélection de documents
+sheet_build_locks: dict[str, asyncio.Lock] = {}
+
+async def get_or_build_revision_sheet(actual_docs: list[str]) -> dict:
+    """Fiche en cache si la version du contenu n'a pas changé, sinon génération."""
+    sheet = await run_blocking(sheet_store.get, actual_docs)
+    if sheet is not None:
+        logger.info(f"⚡ [REVISION] Fiche servie depuis le cache : {actual_docs}")
+        return sheet
+
+    lock = sheet_build_locks.setdefault(sheet_key(actual_docs), asyncio.Lock())
+    async with lock:
+        # Une requête concurrente a peut-être généré la fiche entre-temps
+        sheet = await run_blocking(sheet_store.get, actual_docs)
+        if sheet is not None:
+            return sheet
+
+        version = await run_blocking(sheet_store.version, actual_docs)
+        doc_name = actual_docs[0]
+        content = await build_revision_markdown(actual_docs, doc_name)
+
+        # 2. Construction du PDF (CPU) dans le pool de processus
+        with stage("pdf_build"):
+            pdf = await render_revision_pdf_async(content, doc_name)
+
+        if version is None:
+            # Document absent du catalogue : pas de version, pas de cache
+            return {"version": None, "markdown": content, "pdf": pdf}
+        return await run_blocking(sheet_store.put, actual_docs, version, content, pdf)
+
+async def pregenerate_revision_sheets(sources: list[str]):
+    """Tâche de fond après ingestion : une fiche par document réindexé."""
+    for source in sources:
+        try:
+            await get_or_build_revision_sheet([source])
+            logger.info(f"✅ [REVISION] Fiche pré-générée : {source}")
+        except Exception:
+            logger.exception(f"Erreur de pré-génération de la fiche : {source}")
+
+def parse_documents_param(document: str) -> list[str]:
+    return [d.strip() for d in document.split(",")] if "," in document else [document]
+
+def revision_sheet_response(request: Request, sheet: dict, doc_name: str) -> Response:
+    headers = {
+        "Content-Disposition": f"attachment; filename=Fiche_{doc_name.replace(' ', '_')}.pdf",
+        "Cache-Control": "no-cache",
+    }
+    if sheet["version"]:
+        etag = f'"{sheet["version"]}"'
+        headers["ETag"] = etag
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+    # Envoi par morceaux : ReportLab ne produit le PDF qu'à la fin du build,
+    # mais le client commence à recevoir sans attendre une copie complète du corps.
+    headers["Content-Length"] = str(len(sheet["pdf"]))
+    return StreamingResponse(iter_pdf_chunks(sheet["pdf"]), media_type="application/pdf", headers=headers)
+
+@app.get("/revision-sheet")
+async def get_revision_sheet(request: Request, document: str):
+    """Version GET (requête conditionnelle If-None-Match -> 304)."""
+    set_llm_caller(caller_id(request), PRIORITY_BATCH)
+    actual_docs = parse_documents_param(document)
+    sheet = await get_or_build_revision_sheet(actual_docs)
+    return revision_sheet_response(request, sheet, actual_docs[0])
 
-    return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=Fiche_{doc_name.replace(' ', '_')}.pdf"}
-    )
\ No newline at end of file
+@app.post("/generate-revision-sheet")
+async def generate_revision_sheet(request: Request, document: str = Form(...)):
+    set_llm_caller(caller_id(request), PRIORITY_BATCH)
+    actual_docs = parse_documents_param(document)
+    sheet = await get_or_build_revision_sheet(actual_docs)
+    return revision_sheet_response(request, sheet, actual_docs[0])
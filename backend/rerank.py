@@ -0,0 +1,95 @@
+import logging
+import os
+import threading
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+logger = logging.getLogger("uvicorn")
+
+# Modèle multilingue (les cours sont en français), exécuté sur CPU
+CROSS_ENCODER_MODEL = os.getenv("RERANK_CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_METHODS = ("none", "mmr", "cross-encoder")
+
+
+# -------------------
+# Configuration par usage
+# -------------------
+def rerank_config(usage: str, method: str, fetch_k: int, k: int) -> dict:
+    """RERANK_METHOD_<USAGE>, RERANK_FETCH_K_<USAGE>, RERANK_K_<USAGE> surchargent les valeurs par défaut."""
+    prefix = usage.upper()
+    config = {
+        "method": os.getenv(f"RERANK_METHOD_{prefix}", method),
+        "fetch_k": int(os.getenv(f"RERANK_FETCH_K_{prefix}", str(fetch_k))),
+        "k": int(os.getenv(f"RERANK_K_{prefix}", str(k))),
+    }
+    if config["method"] not in RERANK_METHODS:
+        raise ValueError(f"RERANK_METHOD_{prefix} inconnu : {config['method']}")
+    return config
+
+
+def strip_embeddings(docs: list) -> list:
+    """Les vecteurs ne servent qu'au reranking : on ne les laisse pas circuler."""
+    for doc in docs:
+        doc.metadata.pop("embedding", None)
+    return docs
+
+
+# -------------------
+# MMR sur les vecteurs stockés
+# -------------------
+def mmr_rerank(query_embedding, docs: list, k: int, lambda_mult: float = 0.5) -> list:
+    """
+    Maximal Marginal Relevance : pertinence vis-à-vis de la question moins
+    redondance avec les chunks déjà retenus (calcul matriciel NumPy).
+    """
+    if len(docs) <= 1:
+        return docs[:k]
+    embedding_list = np.stack([doc.metadata["embedding"] for doc in docs])
+    selected = maximal_marginal_relevance(
+        np.asarray(query_embedding, dtype=np.float32), embedding_list, lambda_mult=lambda_mult, k=min(k, len(docs))
+    )
+    return [docs[i] for i in selected]
+
+
+# -------------------
+# Cross-encoder local (optionnel)
+# -------------------
+class CrossEncoderReranker:
+    """
+    Score (question, chunk) par un cross-encoder sentence-transformers. La
+    dépendance est optionnelle : sans elle, available() renvoie False et
+    l'appelant se rabat sur le MMR.
+    """
+
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._unavailable = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None and not self._unavailable:
+                try:
+                    from sentence_transformers import CrossEncoder
+                except ImportError:
+                    logger.warning("⚠️ [RERANK] sentence-transformers absent : repli sur le MMR")
+                    self._unavailable = True
+                    return None
+                self._model = CrossEncoder(self.model_name, device="cpu")
+            return self._model
+
+    def available(self) -> bool:
+        return self._load() is not None
+
+    def rerank(self, question: str, docs: list, k: int) -> list:
+        """Appel bloquant (inférence CPU) : à exécuter hors de la boucle d'événements."""
+        model = self._load()
+        if model is None or not docs:
+            return docs[:k]
+        scores = model.predict([(question, doc.page_content) for doc in docs])
+        order = np.argsort(-np.asarray(scores))[:k]
+        for i in order:
+            docs[i].metadata["rerank_score"] = round(float(scores[i]), 4)
+        return [docs[i] for i in order]
@@ -0,0 +1,210 @@
+import os
+import threading
+
+import numpy as np
+from langchain.schema import Document
+from sqlalchemy import text
+
+from backend.schema import EMBEDDING_DIM, has_column
+
+# -------------------
+# Recherche vectorielle SQL
+# -------------------
+# Requête écrite à la main plutôt que le filtre JSON de PGVector : le filtre
+# porte sur la colonne source indexée et le tri sur l'expression de l'index HNSW.
+DISTANCE_EXPR = f"(e.embedding::vector({EMBEDDING_DIM})) <=> CAST(:embedding AS vector({EMBEDDING_DIM}))"
+
+# Requête plein texte en OU : une question en langage naturel ne contient
+# jamais tous ses mots dans un même chunk.
+TSQUERY_EXPR = "to_tsquery('french', replace(plainto_tsquery('french', :query)::text, ' & ', ' | '))"
+
+# Constante de lissage de la Reciprocal Rank Fusion (valeur usuelle)
+RRF_K = 60
+
+# pgvector >= 0.8 : parcours HNSW itératif, qui continue tant que le filtre
+# (source) n'a pas laissé passer k lignes
+ITERATIVE_SCAN_VERSION = (0, 8)
+
+
+def selected_sources(document_name: str | list | None) -> list[str] | None:
+    """Sources à filtrer, ou None pour une recherche globale."""
+    if isinstance(document_name, list):
+        return document_name or None
+    if isinstance(document_name, str) and document_name and document_name != "GLOBAL":
+        return [document_name]
+    return None
+
+
+def numeric_metadata(key: str) -> str:
+    """Métadonnée entière pour le tri ; NULL si la valeur n'est pas un entier (anciennes ingestions LangChain)."""
+    return f"(CASE WHEN e.cmetadata->>'{key}' ~ '^[0-9]+$' THEN (e.cmetadata->>'{key}')::bigint END)"
+
+
+def to_pgvector(embedding) -> str:
+    return "[" + ",".join(str(float(x)) for x in embedding) + "]"
+
+
+def parse_pgvector(value) -> np.ndarray:
+    """Vecteur renvoyé par psycopg2 (texte '[0.1,0.2,...]' sans adaptateur pgvector)."""
+    if isinstance(value, str):
+        return np.array(value.strip("[]").split(","), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+class PGVectorSearch:
+    def __init__(self, engine, collection_name: str, ef_search: int | None = None):
+        self.engine = engine
+        self.collection_name = collection_name
+        self.ef_search = ef_search or int(os.getenv("VECTOR_EF_SEARCH", "100"))
+        self._collection_id = None
+        self._source_column = None
+        self._tsv_column = None
+        self._iterative_scan = None
+        self._lock = threading.Lock()
+        self.exact_fallbacks = 0
+
+    def collection_id(self):
+        with self._lock:
+            if self._collection_id is None:
+                with self.engine.connect() as conn:
+                    self._collection_id = conn.execute(
+                        text("SELECT uuid FROM langchain_pg_collection WHERE name = :name"),
+                        {"name": self.collection_name}
+                    ).scalar()
+            return self._collection_id
+
+    def source_column(self) -> str:
+        # Colonne typée si la migration a été appliquée, expression JSON sinon
+        with self._lock:
+            if self._source_column is None:
+                self._source_column = "e.source" if has_column(self.engine, "source") else "(e.cmetadata->>'source')"
+            return self._source_column
+
+    def tsv_column(self) -> str:
+        with self._lock:
+            if self._tsv_column is None:
+                self._tsv_column = "e.content_tsv" if has_column(self.engine, "content_tsv") else "to_tsvector('french', coalesce(e.document, ''))"
+            return self._tsv_column
+
+    def iterative_scan(self) -> bool:
+        with self._lock:
+            if self._iterative_scan is None:
+                with self.engine.connect() as conn:
+                    version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+                parsed = tuple(int(part) for part in (version or "0").split(".")[:2] if part.isdigit())
+                self._iterative_scan = parsed >= ITERATIVE_SCAN_VERSION
+            return self._iterative_scan
+
+    def _source_clause(self, sources: list[str] | None, params: dict) -> str:
+        if not sources:
+            return ""
+        params["sources"] = list(sources)
+        return f"AND {self.source_column()} = ANY(:sources)"
+
+    def search(self, embedding, k: int = 8, sources: list[str] | None = None,
+               with_embeddings: bool = False) -> list[Document]:
+        """
+        with_embeddings : ajoute le vecteur stocké (metadata["embedding"]) pour le reranking MMR.
+
+        L'index HNSW renvoie ef_search candidats avant le filtre sur la source :
+        pour un document minoritaire, il peut en rester moins de k. Avec
+        pgvector >= 0.8, le parcours itératif continue jusqu'à k lignes ; sinon
+        on refait la recherche en parcours exact sur les sources demandées.
+        """
+        params = {"collection_id": self.collection_id(), "embedding": to_pgvector(embedding), "k": k}
+        source_clause = self._source_clause(sources, params)
+        embedding_column = ", e.embedding" if with_embeddings else ""
+
+        select = f"""
+            SELECT e.uuid, e.document, e.cmetadata, {DISTANCE_EXPR} AS distance{embedding_column}
+            FROM langchain_pg_embedding e
+            WHERE e.collection_id = :collection_id
+              {source_clause}
+        """
+        query = text(f"{select} ORDER BY {DISTANCE_EXPR} LIMIT :k;")
+        # CTE matérialisée : le tri ne peut plus passer par l'index HNSW, la distance
+        # est calculée pour toutes les lignes filtrées (index (collection_id, source))
+        exact_query = text(f"WITH filtered AS MATERIALIZED ({select}) SELECT * FROM filtered ORDER BY distance LIMIT :k;")
+
+        iterative = self.iterative_scan()
+        with self.engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL hnsw.ef_search = {int(self.ef_search)}"))
+            if iterative:
+                conn.execute(text("SET LOCAL hnsw.iterative_scan = strict_order"))
+            rows = conn.execute(query, params).fetchall()
+            if len(rows) < k and sources and not iterative:
+                rows = conn.execute(exact_query, params).fetchall()
+                self.exact_fallbacks += 1
+
+        docs = [
+            Document(page_content=row[1] or "", metadata={**(row[2] or {}), "id": str(row[0]), "distance": float(row[3])})
+            for row in rows
+        ]
+        if with_embeddings:
+            for doc, row in zip(docs, rows):
+                doc.metadata["embedding"] = parse_pgvector(row[4])
+        return docs
+
+    def full_text_search(self, query: str, k: int = 8, sources: list[str] | None = None,
+                         with_embeddings: bool = False) -> list[Document]:
+        params = {"collection_id": self.collection_id(), "query": query, "k": k}
+        source_clause = self._source_clause(sources, params)
+        tsv = self.tsv_column()
+        embedding_column = ", e.embedding" if with_embeddings else ""
+
+        sql = text(f"""
+            SELECT e.uuid, e.document, e.cmetadata, ts_rank_cd({tsv}, q) AS rank{embedding_column}
+            FROM langchain_pg_embedding e, {TSQUERY_EXPR} AS q
+            WHERE e.collection_id = :collection_id
+              AND {tsv} @@ q
+              {source_clause}
+            ORDER BY rank DESC
+            LIMIT :k;
+        """)
+        with self.engine.connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        docs = [
+            Document(page_content=row[1] or "", metadata={**(row[2] or {}), "id": str(row[0]), "text_rank": float(row[3])})
+            for row in rows
+        ]
+        if with_embeddings:
+            for doc, row in zip(docs, rows):
+                doc.metadata["embedding"] = parse_pgvector(row[4])
+        return docs
+
+
+    def iter_document_chunks(self, sources: list[str], fetch_size: int = 500):
+        """Tous les chunks des documents, dans l'ordre du cours (curseur côté serveur)."""
+        source = self.source_column()
+        query = text(f"""
+            SELECT {source} AS source, e.document
+            FROM langchain_pg_embedding e
+            WHERE e.collection_id = :collection_id
+              AND {source} = ANY(:sources)
+            ORDER BY {source},
+                     {numeric_metadata("page")} NULLS LAST,
+                     {numeric_metadata("chunk")} NULLS LAST,
+                     e.uuid;
+        """)
+        params = {"collection_id": self.collection_id(), "sources": list(sources)}
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=fetch_size).execute(query, params)
+            for row in result:
+                yield row[0], row[1] or ""
+
+
+def reciprocal_rank_fusion(result_lists: list[list[Document]], k: int, rrf_k: int = RRF_K) -> list[Document]:
+    """Fusionne plusieurs classements : score = somme des 1 / (rrf_k + rang)."""
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            doc_id = doc.metadata["id"]
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(doc_id, doc)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    for doc_id in ranked:
+        docs[doc_id].metadata["rrf_score"] = round(scores[doc_id], 6)
+    return [docs[doc_id] for doc_id in ranked]
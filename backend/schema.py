@@ -0,0 +1,95 @@
+import argparse
+import logging
+import sys
+
+from sqlalchemy import text
+
+logger = logging.getLogger("uvicorn")
+
+# Dimension de text-embedding-3-small. La colonne embedding de LangChain n'est
+# pas typée (vector sans dimension) : les index HNSW portent sur un cast.
+EMBEDDING_DIM = 1536
+
+# -------------------
+# Migrations (idempotentes)
+# -------------------
+MIGRATIONS = [
+    # Colonne source typée, calculée à partir des métadonnées JSON
+    (
+        "source_column",
+        """
+        ALTER TABLE langchain_pg_embedding
+        ADD COLUMN IF NOT EXISTS source TEXT
+        GENERATED ALWAYS AS (cmetadata->>'source') STORED;
+        """,
+    ),
+    (
+        "source_index",
+        """
+        CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_collection_source
+        ON langchain_pg_embedding (collection_id, source);
+        """,
+    ),
+    # Index ANN sur l'embedding (distance cosinus, comme PGVector)
+    (
+        "embedding_hnsw_index",
+        f"""
+        CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_hnsw
+        ON langchain_pg_embedding
+        USING hnsw ((embedding::vector({EMBEDDING_DIM})) vector_cosine_ops);
+        """,
+    ),
+    # Plein texte (stemming français) pour la recherche hybride
+    (
+        "content_tsv_column",
+        """
+        ALTER TABLE langchain_pg_embedding
+        ADD COLUMN IF NOT EXISTS content_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('french', coalesce(document, ''))) STORED;
+        """,
+    ),
+    (
+        "content_tsv_index",
+        """
+        CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_content_tsv
+        ON langchain_pg_embedding USING gin (content_tsv);
+        """,
+    ),
+]
+
+
+def apply_migrations(engine):
+    for name, statement in MIGRATIONS:
+        logger.info(f"🛠️ [MIGRATION] {name}")
+        with engine.begin() as conn:
+            conn.execute(text(statement))
+    logger.info("✅ [MIGRATION] Schéma à jour")
+
+
+def has_column(engine, column: str, table: str = "langchain_pg_embedding") -> bool:
+    query = text("""
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = :table AND column_name = :column
+        );
+    """)
+    with engine.connect() as conn:
+        return bool(conn.execute(query, {"table": table, "column": column}).scalar())
+
+
+if __name__ == "__main__":
+    # Usage : python -m backend.schema [--rebuild-catalog]
+    from backend.catalog import DocumentCatalog
+    from backend.db import create_db_engine
+
+    parser = argparse.ArgumentParser(description="Migrations du schéma de recherche")
+    parser.add_argument("--rebuild-catalog", action="store_true",
+                        help="Recalcule document_catalog depuis les embeddings et supprime les sources disparues")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format="%(asctime)s %(levelname)s %(message)s")
+    engine = create_db_engine()
+    apply_migrations(engine)
+    if args.rebuild_catalog:
+        DocumentCatalog(engine).rebuild()
+        logger.info("✅ [CATALOG] Catalogue reconstruit")
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import threading
+
+from sqlalchemy import text
+
+from backend.cache import TTLCache
+
+# -------------------
+# Stockage des fiches de révision
+# -------------------
+# Une fiche ne dépend que du contenu des documents : elle est stockée (Markdown
+# + PDF) avec la version du contenu, dérivée du catalogue. Une réingestion
+# change la version et rend la fiche obsolète.
+SHEETS_DDL = text("""
+    CREATE TABLE IF NOT EXISTS revision_sheets (
+        doc_key TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        markdown TEXT NOT NULL,
+        pdf BYTEA NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+""")
+
+SHEETS_SELECT = text("SELECT version, markdown, pdf FROM revision_sheets WHERE doc_key = :doc_key;")
+
+SHEETS_UPSERT = text("""
+    INSERT INTO revision_sheets (doc_key, version, markdown, pdf, created_at)
+    VALUES (:doc_key, :version, :markdown, :pdf, now())
+    ON CONFLICT (doc_key) DO UPDATE
+        SET version = EXCLUDED.version, markdown = EXCLUDED.markdown,
+            pdf = EXCLUDED.pdf, created_at = now();
+""")
+
+SHEETS_DELETE_SOURCE = text("""
+    DELETE FROM revision_sheets
+    WHERE :source = ANY(string_to_array(doc_key, '|'));
+""")
+
+
+BATCH_SUMMARIES_DDL = text("""
+    CREATE TABLE IF NOT EXISTS revision_batch_summaries (
+        batch_hash TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+""")
+
+BATCH_SUMMARIES_SELECT = text("""
+    SELECT batch_hash, summary FROM revision_batch_summaries WHERE batch_hash = ANY(:hashes);
+""")
+
+BATCH_SUMMARIES_INSERT = text("""
+    INSERT INTO revision_batch_summaries (batch_hash, summary)
+    VALUES (:batch_hash, :summary)
+    ON CONFLICT (batch_hash) DO NOTHING;
+""")
+
+
+def sheet_key(documents: list[str]) -> str:
+    return "|".join(sorted(documents))
+
+
+class RevisionSheetStore:
+    def __init__(self, engine, catalog, memory_size: int = 32):
+        self.engine = engine
+        self.catalog = catalog
+        self.memory = TTLCache(maxsize=memory_size)
+        self._table_ready = False
+        self._lock = threading.Lock()
+
+    def _ensure_table(self):
+        with self._lock:
+            if not self._table_ready:
+                with self.engine.begin() as conn:
+                    conn.execute(SHEETS_DDL)
+                self._table_ready = True
+
+    def version(self, documents: list[str]) -> str | None:
+        """Version du contenu (catalogue), ou None si un document est inconnu."""
+        entries = []
+        for source in sorted(documents):
+            entry = self.catalog.entry(source)
+            if entry is None:
+                return None
+            entries.append(entry)
+        return hashlib.sha1(json.dumps(entries, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, documents: list[str]) -> dict | None:
+        version = self.version(documents)
+        if version is None:
+            return None
+        key = sheet_key(documents)
+
+        sheet = self.memory.get(key)
+        if sheet is not None and sheet["version"] == version:
+            return sheet
+
+        self._ensure_table()
+        with self.engine.connect() as conn:
+            row = conn.execute(SHEETS_SELECT, {"doc_key": key}).fetchone()
+        if row is None or row[0] != version:
+            return None
+        sheet = {"version": row[0], "markdown": row[1], "pdf": bytes(row[2])}
+        self.memory.set(key, sheet)
+        return sheet
+
+    def put(self, documents: list[str], version: str, markdown: str, pdf: bytes) -> dict:
+        self._ensure_table()
+        key = sheet_key(documents)
+        with self.engine.begin() as conn:
+            conn.execute(SHEETS_UPSERT, {"doc_key": key, "version": version, "markdown": markdown, "pdf": pdf})
+        sheet = {"version": version, "markdown": markdown, "pdf": pdf}
+        self.memory.set(key, sheet)
+        return sheet
+
+    def invalidate(self, source: str):
+        """Supprime les fiches contenant ce document (réingestion)."""
+        self._ensure_table()
+        with self.engine.begin() as conn:
+            conn.execute(SHEETS_DELETE_SOURCE, {"source": source})
+        self.memory.clear()
+
+
+# -------------------
+# Map-reduce : découpage en lots et résumés par lot
+# -------------------
+def batch_hash(texts: list[str]) -> str:
+    digest = hashlib.sha256()
+    for piece in texts:
+        digest.update(piece.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def split_batches(chunks, count_tokens, min_tokens: int, max_tokens: int) -> list[list[str]]:
+    """
+    Regroupe les chunks (dans l'ordre) en lots. Les frontières dépendent du
+    contenu (hash du chunk) et non d'un compteur global : modifier une section
+    ne change que les lots voisins, les autres résumés restent en cache.
+    """
+    batches, current, tokens = [], [], 0
+    for chunk in chunks:
+        current.append(chunk)
+        tokens += count_tokens(chunk)
+        boundary = tokens >= min_tokens and hashlib.md5(chunk.encode("utf-8")).digest()[0] % 4 == 0
+        if boundary or tokens >= max_tokens:
+            batches.append(current)
+            current, tokens = [], 0
+    if current:
+        batches.append(current)
+    return batches
+
+
+class BatchSummaryCache:
+    def __init__(self, engine, memory_size: int = 4096):
+        self.engine = engine
+        self.memory = TTLCache(maxsize=memory_size)
+        self._table_ready = False
+        self._lock = threading.Lock()
+
+    def _ensure_table(self):
+        with self._lock:
+            if not self._table_ready:
+                with self.engine.begin() as conn:
+                    conn.execute(BATCH_SUMMARIES_DDL)
+                self._table_ready = True
+
+    def get_many(self, hashes: list[str]) -> dict:
+        found = {h: self.memory.get(h) for h in hashes}
+        found = {h: v for h, v in found.items() if v is not None}
+        missing = [h for h in hashes if h not in found]
+        if missing:
+            self._ensure_table()
+            with self.engine.connect() as conn:
+                for row in conn.execute(BATCH_SUMMARIES_SELECT, {"hashes": missing}):
+                    found[row[0]] = row[1]
+                    self.memory.set(row[0], row[1])
+        return found
+
+    def put(self, hash_value: str, summary: str):
+        self._ensure_table()
+        with self.engine.begin() as conn:
+            conn.execute(BATCH_SUMMARIES_INSERT, {"batch_hash": hash_value, "summary": summary})
+        self.memory.set(hash_value, summary)
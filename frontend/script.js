@@ -4,6 +4,8 @@ const progressContainer = document.getElementById("progress-container");
 const qcmContainer = document.getElementById("qcm-container");
 
 let history = [];
+// Identifiant de conversation : le serveur y rattache le résumé des anciens échanges
+const conversationId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`;
 let currentMode = 'GLOBAL';
 let selectedDoc = 'GLOBAL'; // Valeur par défaut pour le mode GLOBAL
 let selectedDocsSet = new Set();
@@ -16,7 +18,8 @@ input.addEventListener('input', function() {
 
 async function loadDocuments() {
     try {
-        const res = await fetch("/documents");
+        // no-cache : revalidation par ETag (304 si le catalogue n'a pas changé)
+        const res = await fetch("/documents", { cache: "no-cache" });
         const data = await res.json();
         const container = document.getElementById("document-cards");
         container.innerHTML = "";
@@ -126,39 +129,99 @@ async function askQuestion() {
 
     if (isQCM) progressContainer.classList.remove("hidden");
 
+    if (!isQCM) {
+        await streamAnswer(question, finalDoc, loadingMsg);
+        return;
+    }
+
     try {
-        let res;
-        if (!isQCM) {
-            res = await fetch("/ask", {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ 
-                    question, 
-                    history, 
-                    document: finalDoc // On envoie soit "GLOBAL" soit le nom du cours
-                })
-            });
-        } else {
-            const formData = new FormData();
-            formData.append("question", question);
-            const docValue = Array.isArray(finalDoc) ? finalDoc.join(",") : finalDoc;
-            formData.append("document", docValue);
-            res = await fetch("/generate-qcm", { method: "POST", body: formData });
-        }
+        const formData = new FormData();
+        formData.append("question", question);
+        const docValue = Array.isArray(finalDoc) ? finalDoc.join(",") : finalDoc;
+        formData.append("document", docValue);
+        const res = await fetch("/generate-qcm", { method: "POST", body: formData });
 
         const data = await res.json();
         loadingMsg.remove();
         progressContainer.classList.add("hidden");
 
-        if (isQCM) {
-            if (data.error) {
-                addMessage("assistant", `❌ ${data.error}`, true);
-            } else {
-                renderQCM(data);
-            }
+        if (data.error) {
+            addMessage("assistant", `❌ ${data.error}`, true);
         } else {
-            addMessage("assistant", data.answer);
-            history.push({ role: "assistant", content: data.answer });
+            renderQCM(data);
+        }
+    } catch (e) {
+        loadingMsg.innerHTML = "❌ Erreur de connexion au serveur.";
+    }
+}
+
+const TOOL_LABELS = {
+    internal_document_search: "📚 Recherche dans le cours...",
+    external_search_tool: "🌐 Recherche sur Internet..."
+};
+
+// Lit le flux SSE de /ask/stream et affiche la réponse au fil de l'eau
+async function streamAnswer(question, finalDoc, loadingMsg) {
+    let answer = "";
+    let messageDiv = null;
+
+    const render = (markdown) => {
+        if (!messageDiv) {
+            loadingMsg.remove();
+            messageDiv = addMessage("assistant", "");
+        }
+        messageDiv.innerHTML = marked.parse(markdown);
+        chat.scrollTop = chat.scrollHeight;
+    };
+
+    const handleEvent = (event) => {
+        if (event.type === "status") {
+            // Nouvelle étape d'outil : le texte éventuel de l'étape précédente est abandonné
+            answer = "";
+            if (messageDiv) { messageDiv.remove(); messageDiv = null; }
+            loadingMsg.innerHTML = `<div class='spinner'></div><p>${TOOL_LABELS[event.tool] || "⏳ Réflexion..."}</p>`;
+        } else if (event.type === "token") {
+            answer += event.content;
+            render(answer);
+        } else if (event.type === "done") {
+            answer = event.answer;
+            render(answer);
+            history.push({ role: "assistant", content: answer });
+        } else if (event.type === "error") {
+            loadingMsg.remove();
+            if (messageDiv) messageDiv.remove();
+            addMessage("assistant", `❌ ${event.error}`, true);
+        }
+    };
+
+    try {
+        const res = await fetch("/ask/stream", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ 
+                question, 
+                history, 
+                document: finalDoc, // On envoie soit "GLOBAL" soit le nom du cours
+                conversation_id: conversationId
+            })
+        });
+
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Les événements SSE sont séparés par une ligne vide
+            const parts = buffer.split("\n\n");
+            buffer = parts.pop();
+            parts.forEach(part => {
+                const line = part.trim();
+                if (line.startsWith("data:")) handleEvent(JSON.parse(line.slice(5)));
+            });
         }
     } catch (e) {
         loadingMsg.innerHTML = "❌ Erreur de connexion au serveur.";
@@ -246,11 +309,10 @@ async function generateRevision() {
     const loadingMsg = addMessage("assistant", "<div class='spinner'></div><p>Génération de votre fiche de révision personnalisée...</p>");
 
     try {
-        const formData = new FormData();
         const docValue = Array.isArray(finalDoc) ? finalDoc.join(",") : finalDoc;
-        formData.append("document", docValue);
 
-        const res = await fetch("/generate-revision-sheet", { method: "POST", body: formData });
+        // GET conditionnel : la fiche déjà générée est revalidée par ETag
+        const res = await fetch(`/revision-sheet?document=${encodeURIComponent(docValue)}`, { cache: "no-cache" });
 
         if (res.ok) {
             const blob = await res.blob();
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import random
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Variables lues à l'import de backend.rag : aucune n'ouvre de connexion
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("SERPAPI_API_KEY", "test")
+for name, value in {"PG_USER": "test", "PG_PASSWORD": "test", "PG_HOST": "localhost",
+                    "PG_PORT": "5432", "PG_DB": "test"}.items():
+    os.environ.setdefault(name, value)
+os.environ.setdefault("TRACE_SAMPLE_RATE", "0")
+
+sys.path.insert(0, str(ROOT / "tests"))
+
+
+class WordEncoding:
+    """Remplace le BPE tiktoken (téléchargé au premier usage) : un token par mot."""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture(scope="session")
+def rag():
+    # StaticFiles("frontend") est résolu depuis le répertoire courant
+    os.chdir(ROOT)
+    import backend.rag as module
+    module.context_packer._encoding = WordEncoding()
+    return module
+
+
+@pytest.fixture(autouse=True)
+def fresh_dispatchers(request):
+    # Les dispatchers portent des primitives asyncio liées à une boucle : un jeu par test
+    if "rag" in request.fixturenames:
+        module = request.getfixturevalue("rag")
+        module.llm_dispatchers.clear()
+    yield
+
+
+@pytest.fixture
+def fake_openai():
+    from fakes import FakeOpenAI
+    return FakeOpenAI()
+
+
+@pytest.fixture
+def fake_pipeline(rag, monkeypatch, fake_openai):
+    """
+    Pipeline /ask sur le faux serveur OpenAI, sans base : la recherche renvoie un
+    chunk du document demandé et note (question, filtre) dans `retrievals`.
+    """
+    from langchain.schema import Document
+
+    llm = rag.DispatchedChatOpenAI(
+        model_name="gpt-4", temperature=0, streaming=True, max_retries=0,
+        callbacks=[rag.llm_metrics], async_client=fake_openai.async_client()
+    )
+    monkeypatch.setattr(rag, "get_llm", lambda: llm)
+    pipeline = SimpleNamespace(llm=llm, retrievals=[], search_latency=0.0)
+
+    async def no_cache(question, history, document):
+        return None, None
+
+    async def chunks(question, k=8, document_name=None, mode=None, usage=None):
+        if pipeline.search_latency:
+            await asyncio.sleep(random.random() * pipeline.search_latency)
+        pipeline.retrievals.append((question, document_name))
+        return [Document(page_content="La Ve République est un régime semi-présidentiel.",
+                         metadata={"source": document_name})]
+
+    monkeypatch.setattr(rag, "lookup_cached_answer", no_cache)
+    monkeypatch.setattr(rag, "retrieve_relevant_chunks", chunks)
+    return pipeline
+
+
+@pytest.fixture(scope="session")
+def pg_engine(tmp_path_factory):
+    """PostgreSQL + pgvector embarqué (pgserver) ; test ignoré s'il n'est pas installé."""
+    pgserver = pytest.importorskip("pgserver")
+    from sqlalchemy import create_engine, text
+
+    server = pgserver.get_server(str(tmp_path_factory.mktemp("pg")), cleanup_mode="stop")
+    socket_dir = server.get_uri().split("host=")[-1]
+    engine = create_engine(f"postgresql+psycopg2://postgres@/postgres?host={socket_dir}", pool_size=10)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def vector_store(pg_engine):
+    """Tables LangChain (collection "documents") + migrations ; renvoie l'id de collection."""
+    from langchain_community.embeddings import FakeEmbeddings
+    from langchain_community.vectorstores import PGVector
+
+    from backend.retrieval import PGVectorSearch
+    from backend.schema import EMBEDDING_DIM, apply_migrations
+
+    PGVector(connection_string=pg_engine.url.render_as_string(hide_password=False), connection=pg_engine,
+             embedding_function=FakeEmbeddings(size=EMBEDDING_DIM), collection_name="documents")
+    apply_migrations(pg_engine)
+    return PGVectorSearch(pg_engine, "documents").collection_id()
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import time
+
+import httpx
+import openai
+
+
+class FakeOpenAI:
+    """
+    Serveur OpenAI local (transport httpx en mémoire) pour /v1/chat/completions :
+    réponses en streaming SSE ou JSON, 429 / 500 programmables, latence simulée.
+    Avec `function_call` (nom, arguments), une requête qui déclare des fonctions
+    reçoit d'abord cet appel de fonction, puis la réponse une fois le résultat fourni.
+    """
+
+    def __init__(self, tokens=("Bonjour", " le", " monde"), latency: float = 0.0):
+        self.tokens = list(tokens)
+        self.latency = latency
+        self.failures: list[int] = []  # codes HTTP renvoyés aux prochains appels
+        self.function_call: tuple[str, str] | None = None
+        self.model_latency: dict[str, float] = {}  # latence propre à un modèle
+        self.requests: list[dict] = []
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started_at: list[float] = []
+
+    def fail_next(self, status: int, times: int = 1):
+        self.failures.extend([status] * times)
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        self.started_at.append(time.monotonic())
+        body = json.loads(request.content)
+        self.requests.append(body)
+        if self.failures:
+            status = self.failures.pop(0)
+            return httpx.Response(status, json={"error": {"message": "fake", "type": "fake", "code": None}},
+                                  headers={"retry-after": "0"})
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            latency = self.model_latency.get(body.get("model"), self.latency)
+            if latency:
+                await asyncio.sleep(latency)
+        finally:
+            self.in_flight -= 1
+
+        model = body.get("model", "gpt-4")
+        answered = any(m.get("role") == "function" for m in body.get("messages", []))
+        if self.function_call and body.get("functions") and not answered:
+            return self._function_call_response(model, body.get("stream"))
+        if body.get("stream"):
+            lines = []
+            for i, token in enumerate(self.tokens):
+                delta = {"content": token, **({"role": "assistant"} if i == 0 else {})}
+                lines.append({"id": "c", "object": "chat.completion.chunk", "created": 0, "model": model,
+                              "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            lines.append({"id": "c", "object": "chat.completion.chunk", "created": 0, "model": model,
+                          "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            payload = "".join(f"data: {json.dumps(line)}\n\n" for line in lines) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=payload.encode(), headers={"content-type": "text/event-stream"})
+
+        return httpx.Response(200, json={
+            "id": "c", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "".join(self.tokens)}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": len(self.tokens), "total_tokens": 10 + len(self.tokens)},
+        })
+
+    def _function_call_response(self, model: str, stream: bool) -> httpx.Response:
+        name, arguments = self.function_call
+        message = {"role": "assistant", "content": None, "function_call": {"name": name, "arguments": arguments}}
+        if stream:
+            lines = [
+                {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": model,
+                 "choices": [{"index": 0, "delta": message, "finish_reason": None}]},
+                {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "function_call"}]},
+            ]
+            payload = "".join(f"data: {json.dumps(line)}\n\n" for line in lines) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=payload.encode(), headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={
+            "id": "c", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{"index": 0, "finish_reason": "function_call", "message": message}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        })
+
+    def async_client(self):
+        client = openai.AsyncOpenAI(
+            api_key="sk-test", base_url="http://fake-openai/v1", max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handler)),
+        )
+        return client.chat.completions
+
+
+def parse_sse(body: str) -> list[dict]:
+    return [json.loads(line[len("data: "):]) for line in body.splitlines() if line.startswith("data: ")]
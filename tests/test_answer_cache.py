@@ -0,0 +1,89 @@
+import asyncio
+
+import numpy as np
+
+from backend import cache
+from backend.cache import SemanticAnswerCache
+
+
+def vector(*values) -> np.ndarray:
+    return np.array(values, dtype=np.float32)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+# -------------------
+# Cache sémantique des réponses
+# -------------------
+def test_lookup_respects_similarity_threshold():
+    answers = SemanticAnswerCache(threshold=0.95)
+    answers.store("Institutions", vector(1, 0, 0), "Un régime semi-présidentiel.", latency=2.0)
+
+    # cos ≈ 0,995 : même question reformulée
+    assert answers.lookup("Institutions", vector(1, 0.1, 0)) == "Un régime semi-présidentiel."
+    # cos ≈ 0,89 : autre question
+    assert answers.lookup("Institutions", vector(1, 0.5, 0)) is None
+    # Même question, autre sélection de documents
+    assert answers.lookup("Histoire", vector(1, 0, 0)) is None
+    assert (answers.hits, answers.misses) == (1, 2)
+    assert answers.stats()["latency_saved_seconds"] == 2.0
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    answers = SemanticAnswerCache(ttl=60)
+    answers.store("Institutions", vector(1, 0), "Réponse", latency=1.0)
+
+    clock.now += 59
+    assert answers.lookup("Institutions", vector(1, 0)) == "Réponse"
+    clock.now += 2
+    assert answers.lookup("Institutions", vector(1, 0)) is None
+
+
+def test_each_scope_keeps_only_the_latest_entries():
+    answers = SemanticAnswerCache(max_entries_per_scope=2)
+    for i, direction in enumerate([vector(1, 0, 0), vector(0, 1, 0), vector(0, 0, 1)]):
+        answers.store("Institutions", direction, f"réponse {i}", latency=1.0)
+
+    assert answers.lookup("Institutions", vector(1, 0, 0)) is None
+    assert answers.lookup("Institutions", vector(0, 1, 0)) == "réponse 1"
+    assert answers.lookup("Institutions", vector(0, 0, 1)) == "réponse 2"
+
+
+def test_invalidate_scope():
+    answers = SemanticAnswerCache()
+    answers.store("Institutions", vector(1, 0), "A", latency=1.0)
+    answers.store("Histoire", vector(1, 0), "B", latency=1.0)
+
+    answers.invalidate("Institutions")
+
+    assert answers.lookup("Institutions", vector(1, 0)) is None
+    assert answers.lookup("Histoire", vector(1, 0)) == "B"
+
+
+# -------------------
+# Utilisation par /ask
+# -------------------
+def test_internet_request_bypasses_the_answer_cache(rag, monkeypatch):
+    answers = SemanticAnswerCache()
+    monkeypatch.setattr(rag, "answer_cache", answers)
+
+    async def embed(question):
+        return [1.0, 0.0]  # toutes les questions se ressemblent
+
+    monkeypatch.setattr(rag.embeddings, "aembed_query", embed)
+    answers.store(rag.document_scope("Institutions"), vector(1, 0), "Réponse du cours", latency=1.0)
+
+    course, _ = asyncio.run(rag.lookup_cached_answer("Qui est le président ?", [], "Institutions"))
+    web, web_vector = asyncio.run(rag.lookup_cached_answer("Cherche sur internet qui est le président", [],
+                                                           "Institutions"))
+
+    assert course == "Réponse du cours"
+    assert (web, web_vector) == (None, None)
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+import pytest
+
+
+def fake_model(rag, fake_openai, model_name: str):
+    return rag.DispatchedChatOpenAI(model_name=model_name, temperature=0, streaming=model_name == "gpt-4",
+                                    max_retries=0, async_client=fake_openai.async_client())
+
+
+def prompt_tokens(rag, body: dict) -> int:
+    """Tokens envoyés : messages + définitions de fonctions (comptées aussi par OpenAI)."""
+    messages = sum(rag.context_packer.count_tokens(m.get("content") or "") for m in body["messages"])
+    functions = rag.context_packer.count_tokens(json.dumps(body.get("functions", []), ensure_ascii=False))
+    return messages + functions
+
+
+@pytest.mark.benchmark
+def test_benchmark_agent_vs_pipeline(rag, monkeypatch, fake_pipeline, fake_openai):
+    """Latence de bout en bout et tokens par réponse : GPT-4 simulé à 300 ms, modèle de reformulation à 100 ms."""
+    fake_openai.latency = 0.3
+    fake_openai.model_latency = {"gpt-3.5-turbo": 0.1}
+    fake_openai.function_call = ("internal_document_search", json.dumps({"query": "Ve République"}))
+    gpt4 = fake_model(rag, fake_openai, "gpt-4")
+    rewrite = fake_model(rag, fake_openai, "gpt-3.5-turbo")
+    monkeypatch.setattr(rag, "get_llm", lambda: gpt4)
+    monkeypatch.setattr(rag, "get_rewrite_llm", lambda: rewrite)
+    # Agent reconstruit sur le faux serveur (get_agent est mis en cache au premier appel)
+    monkeypatch.setattr(rag, "get_agent", rag.lazy(rag.get_agent.__wrapped__))
+
+    scenarios = {
+        "1er tour": lambda i: (f"Qu'est-ce que la Ve République ? ({i})", []),
+        "suivi": lambda i: (f"Et son président ? ({i})", [
+            {"role": "user", "content": "Qu'est-ce que la Ve République ?"},
+            {"role": "assistant", "content": "Un régime semi-présidentiel."},
+        ]),
+    }
+
+    results = {}
+    print(f"\n{'mode':>9} {'scénario':>9} {'p50 ms':>8} {'appels':>7} {'gpt-4':>6} {'tokens':>7}")
+    for mode in ("agent", "pipeline"):
+        monkeypatch.setattr(rag, "ANSWER_MODE", mode)
+        for scenario, make in scenarios.items():
+            latencies, calls, gpt4_calls, tokens = [], [], [], []
+            for i in range(5):
+                question, history = make(i)
+                request = rag.ChatRequest(question=question, history=history, document="Institutions")
+                before = len(fake_openai.requests)
+                started = time.perf_counter()
+                answer = asyncio.run(rag.answer_question(request.question, request.history, request.document))
+                latencies.append(time.perf_counter() - started)
+                assert answer == "Bonjour le monde"
+                bodies = fake_openai.requests[before:]
+                calls.append(len(bodies))
+                gpt4_calls.append(sum(body["model"] == "gpt-4" for body in bodies))
+                tokens.append(sum(prompt_tokens(rag, body) for body in bodies))
+                rag.llm_dispatchers.clear()
+            results[mode, scenario] = (np.median(latencies), np.mean(gpt4_calls), np.mean(tokens))
+            print(f"{mode:>9} {scenario:>9} {np.median(latencies) * 1000:>8.0f} {np.mean(calls):>7.1f} "
+                  f"{np.mean(gpt4_calls):>6.1f} {np.mean(tokens):>7.0f}")
+
+    for scenario in scenarios:
+        agent, pipeline = results["agent", scenario], results["pipeline", scenario]
+        # Un seul appel GPT-4 au lieu de deux, moins de tokens (pas de définitions de fonctions)
+        assert pipeline[1] == 1 and agent[1] == 2
+        assert pipeline[0] < agent[0]
+        assert pipeline[2] < agent[2]
+
+
+@pytest.mark.parametrize("question", [
+    "Cherche sur internet la date du traité de Lisbonne",
+    "Fais une recherche en ligne sur le Brexit",
+    "Peux-tu faire une recherche internet sur le taux de chômage ?",
+    "Regarde sur le web qui est le président actuel",
+    "Vérifie sur Google la date de l'élection",
+    "Tu peux chercher ça sur internet ?",
+])
+def test_explicit_search_requests_use_internet(rag, question):
+    assert rag.wants_internet_search(question, [])
+
+
+@pytest.mark.parametrize("question", [
+    "Explique le rôle d'internet dans les campagnes électorales",
+    "Quels sont les partis en ligne de mire du Conseil constitutionnel ?",
+    "Qu'est-ce que la démocratie en ligne ?",
+    "Comment Google influence-t-il le débat public ?",
+    "Les chercheurs ont-ils étudié internet et le vote ?",
+    "Internet est-il un espace public au sens d'Habermas ?",
+])
+def test_mentions_of_internet_stay_on_the_course(rag, question):
+    assert not rag.wants_internet_search(question, [])
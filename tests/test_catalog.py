@@ -0,0 +1,39 @@
+import runpy
+import sys
+
+from sqlalchemy import text
+
+import backend.db
+from backend.catalog import DocumentCatalog
+from backend.schema import EMBEDDING_DIM
+
+INSERT_CHUNKS = text(f"""
+    INSERT INTO langchain_pg_embedding (uuid, collection_id, embedding, document, cmetadata)
+    SELECT gen_random_uuid(), CAST(:collection_id AS uuid),
+           ARRAY(SELECT random() FROM generate_series(1, {EMBEDDING_DIM}) WHERE g.i > 0)::vector,
+           'chunk ' || g.i, json_build_object('source', CAST(:source AS text), 'chunk', g.i)
+    FROM generate_series(1, :total) g(i);
+""")
+
+
+def test_schema_cli_rebuilds_catalog(pg_engine, vector_store, monkeypatch):
+    catalog = DocumentCatalog(pg_engine)
+    catalog.ensure_table()
+    with pg_engine.begin() as conn:
+        # Écritures faites hors de l'ingestion : chunks sans entrée, entrée sans chunks
+        conn.execute(INSERT_CHUNKS, {"collection_id": str(vector_store), "source": "Hors ingestion", "total": 3})
+        catalog.upsert(conn, "Supprimé à la main", 12)
+    assert catalog.entry("Hors ingestion") is None
+
+    monkeypatch.setattr(backend.db, "create_db_engine", lambda: pg_engine)
+    monkeypatch.setattr(sys, "argv", ["backend.schema", "--rebuild-catalog"])
+    try:
+        runpy.run_module("backend.schema", run_name="__main__")
+
+        catalog.invalidate()
+        assert catalog.entry("Hors ingestion")["chunk_count"] == 3
+        assert catalog.entry("Supprimé à la main") is None
+    finally:
+        with pg_engine.begin() as conn:
+            conn.execute(text("DELETE FROM langchain_pg_embedding WHERE cmetadata->>'source' = 'Hors ingestion'"))
+            conn.execute(text("DELETE FROM document_catalog WHERE source = 'Hors ingestion'"))
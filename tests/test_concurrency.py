@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import httpx
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+from fakes import parse_sse
+
+DOCUMENTS = ["Institutions", "Sociologie politique", "Relations internationales", ["Institutions", "Histoire"]]
+
+
+def document_label(document) -> str:
+    return ",".join(document) if isinstance(document, list) else document
+
+
+async def fire(rag, requests: list[tuple[str, dict]]):
+    transport = httpx.ASGITransport(app=rag.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await asyncio.gather(*(client.post(path, json=payload) for path, payload in requests))
+
+
+def interleaved_requests(rounds: int, path: str) -> list[tuple[str, dict]]:
+    requests = []
+    for i in range(rounds):
+        for document in DOCUMENTS:
+            question = f"Question {i} sur {document_label(document)}"
+            requests.append((path, {
+                "question": question,
+                "history": [{"role": "user", "content": question}],
+                "document": document,
+                "conversation_id": f"{document_label(document)}-{i}",
+            }))
+    return requests
+
+
+def assert_no_crossed_filters(retrievals: list, expected: int):
+    assert len(retrievals) == expected
+    for question, document_name in retrievals:
+        assert question.endswith(f"sur {document_label(document_name)}"), (question, document_name)
+
+
+def test_interleaved_ask_requests_keep_their_own_document(rag, fake_pipeline):
+    fake_pipeline.search_latency = 0.02
+    requests = interleaved_requests(10, "/ask")
+
+    responses = asyncio.run(fire(rag, requests))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json()["answer"] == "Bonjour le monde" for response in responses)
+    assert_no_crossed_filters(fake_pipeline.retrievals, len(requests))
+
+
+def test_interleaved_streams_keep_their_own_document(rag, fake_pipeline):
+    fake_pipeline.search_latency = 0.02
+    requests = interleaved_requests(5, "/ask/stream")
+
+    responses = asyncio.run(fire(rag, requests))
+
+    assert all(parse_sse(response.text)[-1]["type"] == "done" for response in responses)
+    assert_no_crossed_filters(fake_pipeline.retrievals, len(requests))
+
+
+# -------------------
+# Benchmark de charge : débit /ask selon la concurrence
+# -------------------
+@pytest.mark.benchmark
+def test_benchmark_ask_throughput_scales_with_concurrency(rag, monkeypatch, fake_openai):
+    """
+    /ask complet (embedding, recherche, MMR, GPT-4) sur des serveurs simulés :
+    LLM à 200 ms, embedding à 10 ms, recherche vectorielle bloquante à 20 ms
+    (exécutée dans le pool de threads, comme PGVectorSearch).
+    """
+    fake_openai.latency = 0.2
+    monkeypatch.setattr(rag, "LLM_RPM", 100000)
+    monkeypatch.setattr(rag, "LLM_TPM", 100000000)
+    llm = rag.DispatchedChatOpenAI(model_name="gpt-4", temperature=0, streaming=True, max_retries=0,
+                                   async_client=fake_openai.async_client())
+    monkeypatch.setattr(rag, "get_llm", lambda: llm)
+    rng = np.random.default_rng(0)
+
+    async def embed(text):
+        await asyncio.sleep(0.01)
+        return rng.random(64).tolist()
+
+    def vector_search(embedding, k=8, sources=None, with_embeddings=False):
+        time.sleep(0.02)
+        return [Document(page_content=f"Chunk {i} du cours.",
+                         metadata={"source": sources[0], "embedding": rng.random(64)}) for i in range(k)]
+
+    monkeypatch.setattr(rag.embeddings, "aembed_query", embed)
+    monkeypatch.setattr(rag.vector_search, "search", vector_search)
+
+    throughput = {}
+    print(f"\n{'concurrence':>11} {'requêtes':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    try:
+        for concurrency in (1, 4, 16, 64):
+            latencies = []
+
+            async def one(i, in_flight):
+                async with in_flight:
+                    started = time.perf_counter()
+                    response = await client.post("/ask", json={
+                        "question": f"Question {concurrency}-{i}", "history": [], "document": "Institutions"})
+                    assert response.status_code == 200
+                    latencies.append(time.perf_counter() - started)
+
+            async def level():
+                in_flight = asyncio.Semaphore(concurrency)
+                started = time.perf_counter()
+                await asyncio.gather(*(one(i, in_flight) for i in range(concurrency * 4)))
+                return time.perf_counter() - started
+
+            transport = httpx.ASGITransport(app=rag.app)
+            client = httpx.AsyncClient(transport=transport, base_url="http://test")
+            elapsed = asyncio.run(level())
+            rag.llm_dispatchers.clear()
+            throughput[concurrency] = len(latencies) / elapsed
+            print(f"{concurrency:>11} {len(latencies):>9} {throughput[concurrency]:>8.1f} "
+                  f"{np.percentile(latencies, 50) * 1000:>8.0f} {np.percentile(latencies, 95) * 1000:>8.0f}")
+    finally:
+        rag.answer_cache.invalidate()
+
+    # Un appel lent ne bloque pas la boucle : le débit croît avec la concurrence
+    assert throughput[16] > 5 * throughput[1]
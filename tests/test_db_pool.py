@@ -0,0 +1,68 @@
+import asyncio
+
+import httpx
+import numpy as np
+from sqlalchemy import text
+
+import backend.db as db
+from backend.catalog import DocumentCatalog
+from backend.retrieval import PGVectorSearch
+from backend.schema import EMBEDDING_DIM
+
+POOL_SIZE, MAX_OVERFLOW = 3, 2
+
+
+def test_concurrent_ask_calls_keep_connections_bounded(rag, monkeypatch, fake_openai, pg_engine, vector_store):
+    """100 /ask + /documents simultanés sur un pool de 3 + 2 connexions partagé."""
+    monkeypatch.setattr(db, "PG_CONNECTION_STRING", pg_engine.url.render_as_string(hide_password=False))
+    engine = db.create_db_engine(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+    monitor = db.PoolMonitor(engine)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO langchain_pg_embedding (uuid, collection_id, embedding, document, cmetadata)
+            SELECT gen_random_uuid(), CAST(:collection_id AS uuid),
+                   ARRAY(SELECT random() FROM generate_series(1, {EMBEDDING_DIM}) WHERE g.i > 0)::vector,
+                   'La Ve République, chunk ' || g.i, json_build_object('source', 'Pool', 'chunk', g.i)
+            FROM generate_series(1, 60) g(i);
+        """), {"collection_id": str(vector_store)})
+
+    llm = rag.DispatchedChatOpenAI(model_name="gpt-4", temperature=0, streaming=True, max_retries=0,
+                                   async_client=fake_openai.async_client())
+    rng = np.random.default_rng(0)
+
+    async def embed(text_content):
+        return rng.random(EMBEDDING_DIM).tolist()
+
+    async def no_cache(question, history, document):
+        return None, None
+
+    monkeypatch.setattr(rag, "LLM_RPM", 100000)
+    monkeypatch.setattr(rag, "LLM_TPM", 100000000)
+    monkeypatch.setattr(rag, "get_llm", lambda: llm)
+    monkeypatch.setattr(rag, "lookup_cached_answer", no_cache)
+    monkeypatch.setattr(rag.embeddings, "aembed_query", embed)
+    monkeypatch.setattr(rag, "vector_search", PGVectorSearch(engine, "documents"))
+    monkeypatch.setattr(rag, "catalog", DocumentCatalog(engine, ttl=0))
+    monkeypatch.setattr(rag, "pool_monitor", monitor)
+
+    async def stress():
+        transport = httpx.ASGITransport(app=rag.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            asks = [client.post("/ask", json={"question": f"Question {i}", "history": [], "document": "Pool"})
+                    for i in range(100)]
+            listings = [client.get("/documents") for _ in range(20)]
+            responses = await asyncio.gather(*asks, *listings)
+            return responses, (await client.get("/stats")).json()["db_pool"]
+
+    try:
+        responses, pool_stats = asyncio.run(stress())
+    finally:
+        with pg_engine.begin() as conn:
+            conn.execute(text("DELETE FROM langchain_pg_embedding WHERE source = 'Pool'"))
+        engine.dispose()
+
+    assert all(response.status_code == 200 for response in responses)
+    assert pool_stats["peak_checked_out"] <= POOL_SIZE + MAX_OVERFLOW
+    # Connexions de débordement refermées au retour : seul le pool de base reste ouvert
+    assert pool_stats["checked_in"] <= POOL_SIZE
+    assert pool_stats["checked_out"] == 0
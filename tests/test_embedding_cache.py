@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+from langchain_core.embeddings import Embeddings
+
+from backend.cache import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 1.0, 0.5]
+
+
+def record_sqlite_threads(cache: CachedEmbeddings) -> list:
+    """Threads dans lesquels la couche SQLite est appelée."""
+    threads = []
+    for name in ("get", "set"):
+        method = getattr(cache.persistent, name)
+
+        def recording(*args, _method=method, _name=name):
+            threads.append((_name, threading.get_ident()))
+            return _method(*args)
+
+        setattr(cache.persistent, name, recording)
+    return threads
+
+
+def test_aembed_query_keeps_sqlite_off_the_event_loop(tmp_path):
+    cache = CachedEmbeddings(CountingEmbeddings(), "test", sqlite_path=str(tmp_path / "cache.db"))
+    threads = record_sqlite_threads(cache)
+
+    async def scenario():
+        loop_thread = threading.get_ident()
+        await cache.aembed_query("Qu'est-ce qu'une  dérivée ?")
+        return loop_thread
+
+    loop_thread = asyncio.run(scenario())
+
+    assert [name for name, _ in threads] == ["get", "set"]
+    assert all(thread != loop_thread for _, thread in threads)
+
+
+def test_persistent_layer_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first = CachedEmbeddings(CountingEmbeddings(), "test", sqlite_path=path)
+    vector = asyncio.run(first.aembed_query("Qu'est-ce qu'une dérivée ?"))
+
+    underlying = CountingEmbeddings()
+    second = CachedEmbeddings(underlying, "test", sqlite_path=path)
+
+    assert asyncio.run(second.aembed_query("Qu'est-ce qu'une  dérivée ?")) == vector
+    assert second.embed_query("Qu'est-ce qu'une dérivée ?") == vector
+    assert underlying.calls == 0
+    assert (second.persistent_hits, second.hits, second.misses) == (1, 1, 0)
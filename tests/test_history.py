@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+from backend.history import ConversationMemory
+
+
+def message(role, content):
+    return SimpleNamespace(role=role, content=content)
+
+
+def conversation(turns: int) -> list:
+    return [message("user" if i % 2 == 0 else "assistant", f"message {i}") for i in range(turns)]
+
+
+class SlowSummarizer:
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.calls = 0
+
+    async def __call__(self, prompt):
+        self.calls += 1
+        await self.release.wait()
+        return f"résumé {self.calls}"
+
+
+def make_memory(summarize):
+    return ConversationMemory(summarize, count_tokens=lambda text: len(text.split()), keep_messages=2, max_tokens=500)
+
+
+def test_compact_does_not_wait_for_the_summary():
+    async def scenario():
+        summarizer = SlowSummarizer()
+        memory = make_memory(summarizer)
+
+        # Le résumé est bloqué : la compaction répond quand même, avec les anciens messages verbatim
+        text = await asyncio.wait_for(memory.compact(conversation(6), "c1"), timeout=1)
+        assert "RÉSUMÉ" not in text
+        assert "USER: message 0" in text and "ASSISTANT: message 5" in text
+
+        summarizer.release.set()
+        await memory.wait_updates()
+        text = await memory.compact(conversation(8), "c1")
+        return summarizer, text
+
+    summarizer, text = asyncio.run(scenario())
+    assert summarizer.calls == 2
+    assert text.startswith("RÉSUMÉ DES ÉCHANGES PLUS ANCIENS : résumé 1")
+    # Résumés : messages 0 à 3 ; les suivants restent verbatim
+    assert "message 3" not in text
+    assert "USER: message 4" in text and "ASSISTANT: message 7" in text
+
+
+def test_one_summary_update_at_a_time_per_conversation():
+    async def scenario():
+        summarizer = SlowSummarizer()
+        memory = make_memory(summarizer)
+        await memory.compact(conversation(6), "c1")
+        await memory.compact(conversation(8), "c1")
+        await memory.compact(conversation(6), "c2")
+        summarizer.release.set()
+        await memory.wait_updates()
+        return summarizer
+
+    assert asyncio.run(scenario()).calls == 2
+
+
+def test_failed_summary_keeps_messages_verbatim():
+    async def failing(prompt):
+        raise RuntimeError("LLM indisponible")
+
+    async def scenario():
+        memory = make_memory(failing)
+        await memory.compact(conversation(6), "c1")
+        await memory.wait_updates()
+        return await memory.compact(conversation(6), "c1")
+
+    text = asyncio.run(scenario())
+    assert "USER: message 0" in text
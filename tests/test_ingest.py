@@ -0,0 +1,188 @@
+import asyncio
+import os
+import signal
+
+import httpx
+import numpy as np
+import openai
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from backend import ingest
+from backend.catalog import DocumentCatalog
+from backend.qcm_bank import GENERAL_TOPIC
+from backend.ingest import embed_batch, ingest_paths, parse_pdf, process_pool
+from backend.schema import EMBEDDING_DIM
+
+
+class FakeEmbedder:
+    async def aembed_documents(self, texts):
+        rng = np.random.default_rng(len(texts))
+        return rng.random((len(texts), EMBEDDING_DIM)).tolist()
+
+
+def write_pdf(path, text_content: str):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    pdf = canvas.Canvas(str(path), pagesize=A4)
+    pdf.drawString(72, 750, text_content)
+    pdf.save()
+    return str(path)
+
+
+def test_failing_file_does_not_stop_the_others(pg_engine, vector_store, tmp_path):
+    good = write_pdf(tmp_path / "Institutions.pdf", "La Ve République est un régime semi-présidentiel.")
+    broken = tmp_path / "Casse.pdf"
+    broken.write_bytes(b"ceci n'est pas un PDF")
+    catalog = DocumentCatalog(pg_engine)
+
+    report = asyncio.run(ingest_paths([str(broken), good], pg_engine, catalog, FakeEmbedder(), vector_store))
+
+    statuses = {item["source"]: item["status"] for item in report}
+    assert statuses == {"Casse": "error", "Institutions": "indexed"}
+    assert catalog.entry("Institutions")["chunk_count"] == 1
+    with pg_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM langchain_pg_embedding WHERE source = 'Casse'")).scalar() == 0
+
+
+def test_same_document_name_in_two_folders_is_rejected(pg_engine, vector_store, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = write_pdf(tmp_path / "a" / "Doublon.pdf", "Première version du cours.")
+    second = write_pdf(tmp_path / "b" / "Doublon.pdf", "Seconde version du cours.")
+    other = write_pdf(tmp_path / "Unique.pdf", "Un autre cours.")
+    catalog = DocumentCatalog(pg_engine)
+
+    paths = ingest.collect_pdfs([str(tmp_path)])
+    report = asyncio.run(ingest_paths(paths, pg_engine, catalog, FakeEmbedder(), vector_store))
+
+    errors = sorted(item["path"] for item in report if item["status"] == "error")
+    assert errors == sorted([first, second])
+    assert {item["source"]: item["status"] for item in report if item["source"] == "Unique"} == {"Unique": "indexed"}
+    assert catalog.entry("Doublon") is None
+
+
+@pytest.mark.parametrize("error", [
+    openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/embeddings")),
+    openai.InternalServerError("boom", body=None, response=httpx.Response(
+        502, request=httpx.Request("POST", "https://api.openai.com/v1/embeddings"))),
+])
+def test_embed_batch_retries_transient_errors(monkeypatch, error):
+    monkeypatch.setattr(ingest.random, "random", lambda: 0.0)  # backoff minimal (0,5 s)
+    calls = []
+
+    class FlakyEmbedder(FakeEmbedder):
+        async def aembed_documents(self, texts):
+            calls.append(texts)
+            if len(calls) == 1:
+                raise error
+            return await super().aembed_documents(texts)
+
+    vectors = asyncio.run(embed_batch(FlakyEmbedder(), ["a", "b"], asyncio.Semaphore(1)))
+
+    assert len(vectors) == 2
+    assert len(calls) == 2
+
+
+def test_parsing_survives_a_killed_worker(tmp_path):
+    path = write_pdf(tmp_path / "Institutions.pdf", "La Ve République est un régime semi-présidentiel.")
+    asyncio.run(process_pool.run(parse_pdf, path))
+    broken = process_pool.executor()
+    assert broken._mp_context.get_start_method() == "spawn"
+    for pid in list(broken._processes):
+        os.kill(pid, signal.SIGKILL)
+
+    chunks = asyncio.run(process_pool.run(parse_pdf, path))
+
+    assert chunks[0]["text"].startswith("La Ve République")
+    assert process_pool.executor() is not broken
+
+
+def test_upload_invalidates_indexed_sources_despite_errors(rag, monkeypatch):
+    report = [{"source": "Institutions", "status": "indexed", "chunks": 3},
+              {"source": "Casse", "status": "error", "error": "PDF illisible"}]
+    invalidated, refills = [], []
+
+    async def fake_ingest(paths, engine, catalog, embeddings, collection_id):
+        return report
+
+    async def nothing(*args):
+        return None
+
+    monkeypatch.setattr(rag, "ingest_paths", fake_ingest)
+    monkeypatch.setattr(rag, "get_vectordb", lambda: None)
+    monkeypatch.setattr(rag.vector_search, "collection_id", lambda: "collection")
+    monkeypatch.setattr(rag.sheet_store, "invalidate", lambda source: invalidated.append(("sheet", source)))
+    monkeypatch.setattr(rag.qcm_bank, "invalidate", lambda source: invalidated.append(("qcm", source)))
+    monkeypatch.setattr(rag, "schedule_qcm_refill",
+                        lambda docs, question, topic=None: refills.append((docs, question, topic)))
+    monkeypatch.setattr(rag, "pregenerate_revision_sheets", nothing)
+    monkeypatch.setattr(rag, "UPLOAD_ADMIN_TOKEN", "secret")
+
+    response = TestClient(rag.app).post("/upload", headers={"X-Admin-Token": "secret"}, files=[
+        ("files", ("Institutions.pdf", b"%PDF", "application/pdf")),
+        ("files", ("Casse.pdf", b"%PDF", "application/pdf")),
+    ])
+
+    assert response.status_code == 200
+    assert response.json() == {"results": report}
+    assert invalidated == [("sheet", "Institutions"), ("qcm", "Institutions")]
+    assert refills == [(["Institutions"], rag.QCM_DEFAULT_TOPIC, GENERAL_TOPIC)]
+
+
+@pytest.mark.parametrize("configured, sent", [(None, None), ("secret", None), ("secret", "autre")])
+def test_upload_requires_admin_token(rag, monkeypatch, configured, sent):
+    monkeypatch.setattr(rag, "UPLOAD_ADMIN_TOKEN", configured)
+    headers = {"X-Admin-Token": sent} if sent else {}
+
+    response = TestClient(rag.app).post("/upload", headers=headers, files=[
+        ("files", ("Institutions.pdf", b"%PDF", "application/pdf")),
+    ])
+
+    assert response.status_code == 401
+
+
+def test_upload_size_is_capped(rag, monkeypatch):
+    monkeypatch.setattr(rag, "UPLOAD_ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(rag, "UPLOAD_MAX_BYTES", 1024)
+    client = TestClient(rag.app)
+    files = [("files", ("Institutions.pdf", b"%PDF" + b"0" * 2048, "application/pdf"))]
+
+    # Content-Length annoncé : refus avant lecture du corps
+    assert client.post("/upload", headers={"X-Admin-Token": "secret"}, files=files).status_code == 413
+
+    # Corps envoyé en chunked (sans Content-Length) : plafond appliqué pendant la copie
+    request = client.build_request("POST", "/upload", files=files)
+    body = request.read()
+
+    def chunked():
+        yield body
+
+    response = client.post("/upload", content=chunked(), headers={
+        "X-Admin-Token": "secret", "Content-Type": request.headers["content-type"]
+    })
+    assert response.status_code == 413
+
+
+def test_upload_keeps_both_files_with_the_same_name(rag, monkeypatch):
+    received = []
+
+    async def fake_ingest(paths, engine, catalog, embeddings, collection_id):
+        received.extend((ingest.source_name(path), open(path, "rb").read()) for path in paths)
+        return []
+
+    monkeypatch.setattr(rag, "ingest_paths", fake_ingest)
+    monkeypatch.setattr(rag, "get_vectordb", lambda: None)
+    monkeypatch.setattr(rag.vector_search, "collection_id", lambda: "collection")
+    monkeypatch.setattr(rag, "UPLOAD_ADMIN_TOKEN", "secret")
+
+    response = TestClient(rag.app).post("/upload", headers={"X-Admin-Token": "secret"}, files=[
+        ("files", ("Cours.pdf", b"%PDF premier", "application/pdf")),
+        ("files", ("Cours.pdf", b"%PDF second", "application/pdf")),
+    ])
+
+    # Les deux fichiers arrivent jusqu'à ingest_paths, qui les signale comme doublons
+    assert response.status_code == 200
+    assert received == [("Cours", b"%PDF premier"), ("Cours", b"%PDF second")]
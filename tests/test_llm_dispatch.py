@@ -0,0 +1,161 @@
+import asyncio
+import json
+
+import httpx
+import openai
+import pytest
+
+from backend.llm_dispatch import PRIORITY_BATCH, PRIORITY_INTERACTIVE, LLMDispatcher, set_llm_caller
+
+
+def completion_call(fake_openai):
+    client = fake_openai.async_client()
+    return lambda: client.create(model="gpt-4", messages=[{"role": "user", "content": "Bonjour"}])
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_call_retries_rate_limits_and_server_errors(fake_openai, status):
+    dispatcher = LLMDispatcher("test", rpm=1000, tpm=100000, max_delay=0.01)
+    fake_openai.fail_next(status, times=2)
+
+    response = asyncio.run(dispatcher.call(completion_call(fake_openai), tokens=10))
+
+    assert response.choices[0].message.content == "Bonjour le monde"
+    assert fake_openai.calls == 3
+    assert dispatcher.retries == 2
+    assert dispatcher.rate_limited == (2 if status == 429 else 0)
+    assert dispatcher.transient_errors == (0 if status == 429 else 2)
+
+
+def test_call_retries_connection_errors(fake_openai):
+    dispatcher = LLMDispatcher("test", rpm=1000, tpm=100000, max_delay=0.01)
+    handler = fake_openai.handler
+    failures = [httpx.ConnectTimeout("timeout"), httpx.ConnectError("reset")]
+
+    async def flaky(request):
+        if failures:
+            raise failures.pop(0)
+        return await handler(request)
+
+    fake_openai.handler = flaky
+    response = asyncio.run(dispatcher.call(completion_call(fake_openai), tokens=10))
+
+    assert response.choices[0].message.content == "Bonjour le monde"
+    assert dispatcher.transient_errors == 2
+
+
+def test_call_gives_up_after_max_retries(fake_openai):
+    dispatcher = LLMDispatcher("test", rpm=1000, tpm=100000, max_retries=2, max_delay=0.01)
+    fake_openai.fail_next(500, times=5)
+
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(dispatcher.call(completion_call(fake_openai), tokens=10))
+    assert fake_openai.calls == 3
+
+
+def test_client_errors_are_not_retried(fake_openai):
+    dispatcher = LLMDispatcher("test", rpm=1000, tpm=100000, max_delay=0.01)
+    fake_openai.fail_next(400)
+
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(dispatcher.call(completion_call(fake_openai), tokens=10))
+    assert fake_openai.calls == 1
+
+
+# -------------------
+# Charge : serveur qui renvoie des 429
+# -------------------
+def record_senders(fake_openai) -> list:
+    """Ordre d'arrivée des appels au serveur (contenu du message = expéditeur)."""
+    handler = fake_openai.handler
+    senders = []
+
+    async def recording(request):
+        senders.append(json.loads(request.content)["messages"][0]["content"])
+        return await handler(request)
+
+    fake_openai.handler = recording
+    return senders
+
+
+async def send(dispatcher, client, user, priority):
+    set_llm_caller(user, priority)
+    response = await dispatcher.call(
+        lambda: client.create(model="gpt-4", messages=[{"role": "user", "content": user}]), tokens=10
+    )
+    return response.choices[0].message.content
+
+
+def test_load_with_rate_limited_server(fake_openai):
+    dispatcher = LLMDispatcher("test", rpm=6000, tpm=1000000, max_concurrency=4, max_delay=0.01)
+    fake_openai.latency = 0.005
+    fake_openai.fail_next(429, times=15)
+    client = fake_openai.async_client()
+
+    async def scenario():
+        return await asyncio.gather(*(
+            send(dispatcher, client, f"user-{i % 6}", PRIORITY_BATCH) for i in range(60)
+        ))
+
+    answers = asyncio.run(scenario())
+
+    assert answers == ["Bonjour le monde"] * 60
+    assert dispatcher.rate_limited == 15
+    assert fake_openai.calls == 75
+    assert fake_openai.max_in_flight <= 4
+
+
+def test_interactive_first_then_round_robin(fake_openai):
+    dispatcher = LLMDispatcher("test", rpm=3000, tpm=1000000, max_concurrency=1)
+    senders = record_senders(fake_openai)
+    client = fake_openai.async_client()
+    # Quota épuisé : tout le monde passe par la file
+    dispatcher.requests.level = 0
+
+    async def scenario():
+        calls = [send(dispatcher, client, "gros", PRIORITY_BATCH) for _ in range(12)]
+        calls += [send(dispatcher, client, "petit", PRIORITY_BATCH) for _ in range(3)]
+        calls += [send(dispatcher, client, "etudiant", PRIORITY_INTERACTIVE) for _ in range(2)]
+        await asyncio.gather(*calls)
+
+    asyncio.run(scenario())
+
+    assert senders[:2] == ["etudiant", "etudiant"]
+    # Tourniquet : les 3 appels de "petit" ne restent pas derrière les 12 de "gros"
+    assert senders[2:8] == ["gros", "petit"] * 3
+
+
+# -------------------
+# Clé d'équité des endpoints
+# -------------------
+def test_fairness_key_ignores_client_controlled_values(rag, fake_pipeline, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from backend.llm_dispatch import LLMDispatcher
+
+    users = []
+    enqueue = LLMDispatcher._enqueue
+
+    def recording(self, priority, ticket):
+        users.append(ticket.user)
+        enqueue(self, priority, ticket)
+
+    monkeypatch.setattr(LLMDispatcher, "_enqueue", recording)
+    client = TestClient(rag.app)
+
+    def ask(conversation_id, forwarded):
+        rag.llm_dispatchers.clear()  # une boucle d'événements par requête TestClient
+        response = client.post("/ask", headers={"X-Forwarded-For": forwarded}, json={
+            "question": "Qu'est-ce que la Ve République ?", "history": [],
+            "document": "Institutions", "conversation_id": conversation_id,
+        })
+        assert response.status_code == 200
+
+    # Même client derrière le proxy : conversations et entrées X-Forwarded-For variées
+    ask("conv-a", "10.0.0.1, 198.51.100.7")
+    ask("conv-b", "10.0.0.2, 198.51.100.7")
+    ask("conv-c", "198.51.100.7")
+    ask("conv-d", "198.51.100.8")
+
+    assert set(users[:-1]) == {"ip:198.51.100.7"}
+    assert users[-1] == "ip:198.51.100.8"
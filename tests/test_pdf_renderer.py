@@ -0,0 +1,122 @@
+import asyncio
+import io
+import os
+import signal
+import statistics
+import time
+
+import pytest
+from pypdf import PdfReader
+
+from backend import pdf_renderer
+from backend.pdf_renderer import (
+    inline_markup, iter_pdf_chunks, markdown_to_flowables, render_revision_pdf, render_revision_pdf_async,
+)
+
+
+def revision_sheet(sections: int = 40) -> str:
+    """Fiche au format de REVISION_PROMPT (titres, listes, gras/italique)."""
+    lines = []
+    for i in range(1, sections + 1):
+        lines.append(f"### **Partie {i}** : notions clés")
+        lines.append(f"Le chapitre {i} introduit la **notion {i}** et son *intérêt* pratique pour l'examen.")
+        lines += [f"- **Définition {i}.{j}** : énoncé *à retenir* avec un exemple détaillé." for j in range(1, 6)]
+        lines += [f"• Piège fréquent {i}.{j} : confondre **cause** et *conséquence*." for j in range(1, 3)]
+        lines.append("")
+    return "\n".join(lines)
+
+
+def page_count(pdf: bytes) -> int:
+    return len(PdfReader(io.BytesIO(pdf)).pages)
+
+
+def test_inline_markup():
+    assert inline_markup("**gras** et *italique*") == "<b>gras</b> et <i>italique</i>"
+
+
+def test_markdown_to_flowables_strips_title_markup():
+    elements = markdown_to_flowables("### **Titre** *important*\n\n- point")
+    paragraphs = [e for e in elements if hasattr(e, "text")]
+    assert [p.text for p in paragraphs] == ["Titre important", "point"]
+
+
+def test_multi_page_sheet_is_streamed_in_chunks():
+    pdf = render_revision_pdf(revision_sheet(), "Cours")
+    chunks = list(iter_pdf_chunks(pdf, chunk_size=4096))
+
+    assert pdf.startswith(b"%PDF")
+    assert page_count(pdf) > 5
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    assert b"".join(chunks) == pdf
+
+
+def test_async_render_runs_in_process_pool():
+    pdf = asyncio.run(render_revision_pdf_async(revision_sheet(5), "Cours"))
+
+    assert page_count(pdf) >= 1
+    assert pdf_renderer.process_pool.executor()._mp_context.get_start_method() == "spawn"
+
+
+def test_broken_pool_is_recreated():
+    asyncio.run(render_revision_pdf_async("amorce", "Cours"))
+    broken = pdf_renderer.process_pool.executor()
+    # Worker tué (OOM killer) : le pool passe en BrokenProcessPool
+    for pid in list(broken._processes):
+        os.kill(pid, signal.SIGKILL)
+
+    pdf = asyncio.run(render_revision_pdf_async(revision_sheet(2), "Cours"))
+
+    assert pdf.startswith(b"%PDF")
+    assert pdf_renderer.process_pool.executor() is not broken
+
+
+# -------------------
+# Micro-benchmark : fiche de plusieurs pages
+# -------------------
+def median_ms(func, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+async def max_loop_lag(render) -> float:
+    """Plus long blocage de la boucle d'événements (ms) pendant `render()`."""
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append((time.perf_counter() - started - 0.005) * 1000)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.02)
+    await render()
+    stop.set()
+    await task
+    return max(lags)
+
+
+@pytest.mark.benchmark
+def test_benchmark_revision_pdf():
+    content = revision_sheet(sections=120)
+    pdf = render_revision_pdf(content, "Cours")
+    runs = 5
+
+    print(f"\nfiche : {len(content.splitlines())} lignes, {page_count(pdf)} pages, {len(pdf) // 1024} Ko")
+    print(f"Markdown -> flowables : {median_ms(lambda: markdown_to_flowables(content), runs):.1f} ms (médiane)")
+    print(f"rendu complet         : {median_ms(lambda: render_revision_pdf(content, 'Cours'), runs):.1f} ms (médiane)")
+
+    async def inline():
+        render_revision_pdf(content, "Cours")
+
+    async def pooled():
+        await render_revision_pdf_async(content, "Cours")
+
+    asyncio.run(render_revision_pdf_async("amorce", "Cours"))  # démarrage des workers hors mesure
+    print(f"blocage max de la boucle : {asyncio.run(max_loop_lag(inline)):.0f} ms dans la boucle, "
+          f"{asyncio.run(max_loop_lag(pooled)):.0f} ms avec le pool de processus")
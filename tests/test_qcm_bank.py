@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.qcm_bank import GENERAL_TOPIC, topic_key
+
+
+@pytest.mark.parametrize("request_text", ["Fais moi un QCM", "QCM", "Génère des questions sur le cours svp"])
+def test_generic_requests_map_to_general_topic(request_text):
+    assert topic_key(request_text) == GENERAL_TOPIC
+
+
+def test_topic_key_keeps_the_subject():
+    assert topic_key("Fais moi un QCM sur la Ve République") == "ve republique"
+
+
+def test_upload_pregeneration_lands_on_the_generic_key(rag, monkeypatch):
+    # /upload pré-génère sous la clé lue par /generate-qcm pour une demande générique
+    async def fake_ingest(paths, engine, catalog, embeddings, collection_id):
+        return [{"source": "Institutions", "status": "indexed", "chunks": 3}]
+
+    async def nothing(*args):
+        return None
+
+    monkeypatch.setattr(rag, "ingest_paths", fake_ingest)
+    monkeypatch.setattr(rag, "get_vectordb", lambda: None)
+    monkeypatch.setattr(rag.vector_search, "collection_id", lambda: "collection")
+    monkeypatch.setattr(rag.sheet_store, "invalidate", lambda source: None)
+    monkeypatch.setattr(rag.qcm_bank, "invalidate", lambda source: None)
+    monkeypatch.setattr(rag, "pregenerate_revision_sheets", nothing)
+    monkeypatch.setattr(rag, "UPLOAD_ADMIN_TOKEN", "secret")
+    rag.qcm_refill_pending.clear()
+    try:
+        # Sans lifespan : aucun worker ne consomme la file
+        response = TestClient(rag.app).post("/upload", headers={"X-Admin-Token": "secret"}, files=[
+            ("files", ("Institutions.pdf", b"%PDF", "application/pdf")),
+        ])
+        assert response.status_code == 200
+
+        generic_key = (rag.sheet_key(["Institutions"]), topic_key("Fais moi un QCM"))
+        assert rag.qcm_refill_pending == {generic_key}
+        assert rag.qcm_refill_queue.get_nowait() == (["Institutions"], rag.QCM_DEFAULT_TOPIC, GENERAL_TOPIC)
+    finally:
+        rag.qcm_refill_pending.clear()
+        while not rag.qcm_refill_queue.empty():
+            rag.qcm_refill_queue.get_nowait()
+
+
+def test_refill_workers_follow_the_app_lifespan(rag, monkeypatch):
+    events = []
+
+    async def worker():
+        events.append("start")
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            events.append("stop")
+            raise
+
+    monkeypatch.setattr(rag, "qcm_refill_worker", worker)
+    with TestClient(rag.app):
+        pass
+
+    assert events.count("start") == rag.QCM_WORKERS
+    assert events.count("stop") == rag.QCM_WORKERS
+
+
+def qcm_item(question: str, correct: int = 0) -> dict:
+    return {"question": question, "choices": ["A", "B", "C", "D"], "correct": correct, "explanation": "Cours"}
+
+
+def test_retry_does_not_duplicate_accepted_questions(rag, fake_pipeline, fake_openai, monkeypatch):
+    # Même réponse à chaque essai : Q1 valide, Q2 invalide (réponse hors des choix)
+    arguments = {"title": "QCM", "questions": [qcm_item("Q1 ?"), qcm_item("Q2 ?", correct=7)]}
+    fake_openai.function_call = ("create_qcm", json.dumps(arguments))
+    monkeypatch.setattr(rag, "get_qcm_llm", rag.lazy(rag.get_qcm_llm.__wrapped__))
+
+    title, items = asyncio.run(rag.generate_qcm_items("Ve République", "Institutions", 2))
+
+    assert title == "QCM"
+    assert [item["question"] for item in items] == ["Q1 ?"]
+    assert fake_openai.calls == rag.QCM_MAX_RETRIES + 1
@@ -0,0 +1,114 @@
+import statistics
+import time
+
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+from backend.context import ContextPacker
+from backend.rerank import CrossEncoderReranker, mmr_rerank, rerank_config
+from conftest import WordEncoding
+
+DIM = 1536
+
+
+def unit(vector: np.ndarray) -> np.ndarray:
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def candidate_pool(rng, fetch_k: int = 24, topics: int = 8, duplicates: int = 10):
+    """
+    Candidats triés par distance, comme ceux de PGVectorSearch.search : le
+    thème le plus proche de la question revient `duplicates` fois (chunks qui
+    se chevauchent), les autres thèmes une fois chacun.
+    """
+    query = unit(rng.normal(size=DIM))
+    centers = []
+    for t in range(topics):
+        # Similarité à la question décroissante avec le rang du thème
+        orthogonal = rng.normal(size=DIM)
+        orthogonal = unit(orthogonal - (orthogonal @ query) * query)
+        similarity = 0.9 - 0.3 * t / topics
+        centers.append(unit(similarity * query + np.sqrt(1 - similarity ** 2) * orthogonal))
+    docs = []
+    for t, center in enumerate(centers):
+        for copy in range(duplicates if t == 0 else 1):
+            embedding = unit(center + rng.normal(scale=0.01, size=DIM) / np.sqrt(DIM))
+            text = f"Thème {t} : " + " ".join(f"notion{t}_{w}" for w in range(120)) + f" (extrait {copy})"
+            docs.append(Document(page_content=text, metadata={"topic": t, "embedding": embedding}))
+    for doc in docs:
+        doc.metadata["distance"] = float(1 - doc.metadata["embedding"] @ query)
+    docs.sort(key=lambda d: d.metadata["distance"])
+    return query, docs[:fetch_k]
+
+
+def topics(docs) -> set:
+    return {doc.metadata["topic"] for doc in docs}
+
+
+def test_mmr_drops_redundant_chunks():
+    query, docs = candidate_pool(np.random.default_rng(0))
+    # Sans reranking, le top 5 n'est fait que du thème dominant
+    assert topics(docs[:5]) == {0}
+
+    reranked = mmr_rerank(query, docs, k=5)
+
+    assert len(reranked) == 5
+    assert reranked[0] is docs[0]
+    assert len(topics(reranked)) >= 4
+
+
+def test_mmr_with_fewer_candidates_than_k():
+    query, docs = candidate_pool(np.random.default_rng(1), fetch_k=1)
+    assert mmr_rerank(query, docs, k=5) == docs
+
+
+def test_rerank_config_env_override(monkeypatch):
+    monkeypatch.setenv("RERANK_K_ASK", "3")
+    assert rerank_config("ask", "mmr", fetch_k=24, k=5) == {"method": "mmr", "fetch_k": 24, "k": 3}
+
+    monkeypatch.setenv("RERANK_METHOD_ASK", "bm25")
+    with pytest.raises(ValueError):
+        rerank_config("ask", "mmr", fetch_k=24, k=5)
+
+
+# -------------------
+# Benchmark : latence du reranking vs tokens de prompt économisés
+# -------------------
+@pytest.mark.benchmark
+def test_benchmark_rerank_latency_vs_tokens():
+    # tokens ≈ mots : le BPE tiktoken n'est pas disponible hors ligne
+    packer = ContextPacker()
+    packer._encoding = WordEncoding()
+    rng = np.random.default_rng(42)
+    # (usage, k sans reranking, fetch_k, k après reranking) : valeurs de RERANK_CONFIGS
+    scenarios = [("ask", 8, 24, 5), ("sheet", 15, 40, 12)]
+    cross_encoder = CrossEncoderReranker()
+    methods = ["mmr"] + (["cross-encoder"] if cross_encoder.available() else [])
+    if len(methods) == 1:
+        print("\nsentence-transformers absent : cross-encoder non mesuré")
+
+    for usage, baseline_k, fetch_k, k in scenarios:
+        pools = [candidate_pool(rng, fetch_k=fetch_k, topics=fetch_k // 2) for _ in range(50)]
+        baseline_tokens = statistics.mean(
+            sum(packer.count_tokens(d.page_content) for d in docs[:baseline_k]) for _, docs in pools
+        )
+        baseline_topics = statistics.mean(len(topics(docs[:baseline_k])) for _, docs in pools)
+        print(f"\n[{usage}] sans reranking : top {baseline_k}, {baseline_tokens:.0f} tokens, "
+              f"{baseline_topics:.1f} thèmes distincts")
+
+        for method in methods:
+            timings, tokens, covered = [], [], []
+            for query, docs in pools:
+                started = time.perf_counter()
+                if method == "mmr":
+                    kept = mmr_rerank(query, docs, k=k)
+                else:
+                    kept = cross_encoder.rerank("question", docs, k=k)
+                timings.append((time.perf_counter() - started) * 1000)
+                tokens.append(sum(packer.count_tokens(d.page_content) for d in kept))
+                covered.append(len(topics(kept)))
+            saved = 1 - statistics.mean(tokens) / baseline_tokens
+            print(f"[{usage}] {method:<13} : {fetch_k} -> {k} chunks, p50 {statistics.median(timings):.2f} ms, "
+                  f"{statistics.mean(tokens):.0f} tokens ({saved:.0%} économisés), "
+                  f"{statistics.mean(covered):.1f} thèmes distincts")
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+import pytest
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_community.vectorstores import PGVector
+from sqlalchemy import create_engine, text
+
+from backend.retrieval import PGVectorSearch, reciprocal_rank_fusion
+from backend.schema import EMBEDDING_DIM, MIGRATIONS
+
+# Vecteurs générés côté serveur : "Gros" autour de (1, ..., 1), "Petit" à l'opposé
+INSERT_SKEWED = text(f"""
+    INSERT INTO langchain_pg_embedding (uuid, collection_id, embedding, document, cmetadata)
+    SELECT gen_random_uuid(), CAST(:collection_id AS uuid),
+           ARRAY(SELECT CASE WHEN g.i <= :big THEN 1 ELSE -1 END + random() * 0.2
+                 FROM generate_series(1, {EMBEDDING_DIM}))::vector,
+           'chunk ' || g.i,
+           json_build_object('source', CASE WHEN g.i <= :big THEN 'Gros' ELSE 'Petit' END, 'chunk', g.i)
+    FROM generate_series(1, :total) g(i);
+""")
+
+
+@pytest.fixture(scope="module")
+def skewed_collection(pg_engine, vector_store):
+    """
+    Un gros cours proche de la question, un petit cours éloigné. Sans l'index
+    (collection_id, source) et sans seq/bitmap scan, le planificateur passe par
+    l'index HNSW puis filtre : la situation d'une grosse table.
+    """
+    source_index = dict(MIGRATIONS)["source_index"]
+    with pg_engine.begin() as conn:
+        conn.execute(INSERT_SKEWED, {"collection_id": str(vector_store), "big": 600, "total": 800})
+        conn.execute(text("ANALYZE langchain_pg_embedding"))
+        conn.execute(text("DROP INDEX ix_langchain_pg_embedding_collection_source"))
+    engine = create_engine(pg_engine.url, connect_args={"options": "-c enable_seqscan=off -c enable_bitmapscan=off"})
+    yield engine
+    engine.dispose()
+    with pg_engine.begin() as conn:
+        conn.execute(text("DELETE FROM langchain_pg_embedding WHERE source IN ('Gros', 'Petit')"))
+        conn.execute(text(source_index))
+
+
+def test_filtered_search_returns_k_rows_for_a_minority_source(skewed_collection):
+    search = PGVectorSearch(skewed_collection, "documents", ef_search=10)
+
+    docs = search.search(np.ones(EMBEDDING_DIM), k=8, sources=["Petit"])
+
+    assert len(docs) == 8
+    assert {doc.metadata["source"] for doc in docs} == {"Petit"}
+    distances = [doc.metadata["distance"] for doc in docs]
+    assert distances == sorted(distances)
+
+
+def test_search_without_filter_stays_on_the_index(skewed_collection):
+    search = PGVectorSearch(skewed_collection, "documents", ef_search=40)
+
+    docs = search.search(np.ones(EMBEDDING_DIM), k=8)
+
+    assert len(docs) == 8
+    assert {doc.metadata["source"] for doc in docs} == {"Gros"}
+    assert search.exact_fallbacks == 0
+
+
+# -------------------
+# Benchmark : recherche filtrée sur plusieurs centaines de milliers de chunks
+# -------------------
+# BENCH_CHUNKS=300000 python -m pytest -m benchmark -s tests/test_retrieval.py
+BENCH_SOURCES = 50
+INSERT_BENCH = text(f"""
+    INSERT INTO langchain_pg_embedding (uuid, collection_id, embedding, document, cmetadata)
+    SELECT gen_random_uuid(), CAST(:collection_id AS uuid),
+           c.center + ARRAY(SELECT (random() - 0.5) * 0.5 FROM generate_series(1, {EMBEDDING_DIM}) WHERE g.i > 0)::vector,
+           'chunk ' || g.i, json_build_object('source', 'bench-' || c.id, 'chunk', g.i)
+    FROM generate_series(1, :total) g(i)
+    -- Tailles très inégales (loi puissance) ; g.i * 0 force un tirage par ligne
+    JOIN bench_centers c ON c.id = floor(power(random(), 3) * {BENCH_SOURCES})::int + g.i * 0;
+""")
+
+
+@pytest.mark.benchmark
+def test_benchmark_filtered_search(pg_engine, vector_store):
+    total = int(os.getenv("BENCH_CHUNKS", "300000"))
+    hnsw_index = dict(MIGRATIONS)["embedding_hnsw_index"]
+    with pg_engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE bench_centers AS
+            SELECT id, ARRAY(SELECT random() - 0.5 FROM generate_series(1, {EMBEDDING_DIM}) WHERE id >= 0)::vector AS center
+            FROM generate_series(0, {BENCH_SOURCES - 1}) id;
+        """))
+        # Index construit après le chargement : bien plus rapide qu'une insertion indexée
+        conn.execute(text("DROP INDEX IF EXISTS ix_langchain_pg_embedding_hnsw"))
+        started = time.perf_counter()
+        conn.execute(INSERT_BENCH, {"collection_id": str(vector_store), "total": total})
+        conn.execute(text("SET LOCAL maintenance_work_mem = '1GB'"))
+        conn.execute(text(hnsw_index))
+        conn.execute(text("ANALYZE langchain_pg_embedding"))
+        sizes = dict(conn.execute(text(
+            "SELECT source, COUNT(*) FROM langchain_pg_embedding WHERE source LIKE 'bench-%' GROUP BY source"
+        )).fetchall())
+        centers = {f"bench-{row[0]}": np.array(row[1].strip("[]").split(","), dtype=np.float32)
+                   for row in conn.execute(text("SELECT id, center::text FROM bench_centers"))}
+    print(f"\n{total} chunks chargés et indexés en {time.perf_counter() - started:.1f}s")
+
+    try:
+        rng = np.random.default_rng(0)
+        by_size = sorted(sizes, key=sizes.get)
+        k = 8
+        # Avant : filtre JSON de LangChain (cmetadata->>'source', sans index ni HNSW)
+        legacy = PGVector(connection_string=pg_engine.url.render_as_string(hide_password=False), connection=pg_engine,
+                          embedding_function=FakeEmbeddings(size=EMBEDDING_DIM), collection_name="documents")
+        print(f"{'source':>10} {'chunks':>7} {'JSON p50':>9} {'JSON p95':>9} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'rappel@8':>9} {'repli exact':>12}")
+        for source in [by_size[0], by_size[len(by_size) // 2], by_size[-1]]:
+            search = PGVectorSearch(pg_engine, "documents")
+            latencies, legacy_latencies, recalls = [], [], []
+            for _ in range(30):
+                query = centers[source] + rng.normal(scale=0.1, size=EMBEDDING_DIM)
+                started = time.perf_counter()
+                legacy.similarity_search_by_vector(query.tolist(), k=k, filter={"source": source})
+                legacy_latencies.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                docs = search.search(query, k=k, sources=[source])
+                latencies.append((time.perf_counter() - started) * 1000)
+                with pg_engine.connect() as conn:
+                    truth = {str(row[0]) for row in conn.execute(text(f"""
+                        WITH filtered AS MATERIALIZED (
+                            SELECT e.uuid, (e.embedding::vector({EMBEDDING_DIM})) <=> CAST(:embedding AS vector({EMBEDDING_DIM})) AS distance
+                            FROM langchain_pg_embedding e WHERE e.source = :source
+                        ) SELECT uuid FROM filtered ORDER BY distance LIMIT :k
+                    """), {"embedding": "[" + ",".join(map(str, query)) + "]", "source": source, "k": k})}
+                recalls.append(len(truth & {doc.metadata["id"] for doc in docs}) / len(truth))
+            print(f"{source:>10} {sizes[source]:>7} {np.percentile(legacy_latencies, 50):>9.1f} "
+                  f"{np.percentile(legacy_latencies, 95):>9.1f} {np.percentile(latencies, 50):>8.1f} "
+                  f"{np.percentile(latencies, 95):>8.1f} {np.mean(recalls):>9.3f} {search.exact_fallbacks:>12}")
+            assert np.mean(recalls) > 0.8
+    finally:
+        with pg_engine.begin() as conn:
+            conn.execute(text("DELETE FROM langchain_pg_embedding WHERE source LIKE 'bench-%'"))
+            conn.execute(text("DROP TABLE bench_centers"))
+
+
+# -------------------
+# Benchmark : recherche hybride (plein texte + vecteur, RRF)
+# -------------------
+# Corpus fixe : des chunks de remplissage par thème, et des chunks "aiguilles"
+# qui contiennent un terme exact (auteur, article, locution latine). Les
+# embeddings simulés ne portent que le thème (+ bruit) : comme les vrais
+# embeddings, ils distinguent mal un terme rare.
+THEMES = {
+    "institutions": "gouvernement parlement assemblée sénat constitution régime exécutif législatif",
+    "elections": "scrutin vote électeurs campagne partis majorité circonscription suffrage",
+    "relations": "diplomatie traité alliance puissance souveraineté guerre paix frontières",
+    "sociologie": "classes mobilisation militants opinion socialisation engagement groupes sociaux",
+}
+EXACT_TERMS = [
+    ("institutions", "article 49 alinéa 3"), ("institutions", "Montesquieu"), ("institutions", "habeas corpus"),
+    ("institutions", "article 16"), ("elections", "loi de Duverger"), ("elections", "Siegfried"),
+    ("elections", "panachage"), ("relations", "Clausewitz"), ("relations", "pacta sunt servanda"),
+    ("relations", "Westphalie"), ("sociologie", "Bourdieu"), ("sociologie", "habitus"),
+    ("sociologie", "Tocqueville"), ("sociologie", "Olson"),
+]
+
+
+def hybrid_corpus(rng, filler_per_theme: int = 150):
+    centers = {theme: rng.normal(size=EMBEDDING_DIM) for theme in THEMES}
+    chunks = []
+    for theme, vocabulary in THEMES.items():
+        words = vocabulary.split()
+        for i in range(filler_per_theme):
+            text_content = " ".join(rng.choice(words, size=25))
+            chunks.append((f"{theme}-{i}", text_content, centers[theme] + rng.normal(scale=0.6, size=EMBEDDING_DIM)))
+    needles = []
+    for i, (theme, term) in enumerate(EXACT_TERMS):
+        text_content = " ".join(rng.choice(THEMES[theme].split(), size=12)) + f" {term} " + \
+            " ".join(rng.choice(THEMES[theme].split(), size=12))
+        vector = centers[theme] + rng.normal(scale=0.6, size=EMBEDDING_DIM)
+        chunks.append((f"needle-{i}", text_content, vector))
+        needles.append((theme, term, f"needle-{i}", vector))
+    return centers, chunks, needles
+
+
+@pytest.mark.benchmark
+def test_benchmark_hybrid_retrieval_recall_and_latency(pg_engine, vector_store):
+    rng = np.random.default_rng(0)
+    centers, chunks, needles = hybrid_corpus(rng)
+    hnsw_index = dict(MIGRATIONS)["embedding_hnsw_index"]
+    with pg_engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_langchain_pg_embedding_hnsw"))
+        conn.execute(text("""
+            INSERT INTO langchain_pg_embedding (uuid, collection_id, embedding, document, cmetadata)
+            VALUES (CAST(:uuid AS uuid), CAST(:collection_id AS uuid), CAST(:embedding AS vector),
+                    :document, CAST(:cmetadata AS json))
+        """), [{"uuid": str(uuid.uuid4()), "collection_id": str(vector_store), "document": content,
+                "embedding": "[" + ",".join(map(str, vector)) + "]",
+                "cmetadata": json.dumps({"source": "bench-hybride", "chunk_id": chunk_id})}
+               for chunk_id, content, vector in chunks])
+        conn.execute(text(hnsw_index))
+        conn.execute(text("ANALYZE langchain_pg_embedding"))
+
+    search = PGVectorSearch(pg_engine, "documents")
+    sources = ["bench-hybride"]
+    k, candidates = 5, 20
+    # Terme exact (le vecteur de la question ne porte que le thème) et
+    # paraphrase (aucun mot commun, vecteur proche de l'aiguille)
+    queries = [(f"Que signifie {term} ?", centers[theme] + rng.normal(scale=0.6, size=EMBEDDING_DIM), chunk_id, "terme exact")
+               for theme, term, chunk_id, _ in needles]
+    queries += [("Pouvez-vous reformuler cette notion ?", vector + rng.normal(scale=0.05, size=EMBEDDING_DIM), chunk_id, "paraphrase")
+                for _, _, chunk_id, vector in needles]
+
+    def run_vector(question, embedding):
+        return search.search(embedding, k=k, sources=sources)
+
+    def run_text(question, embedding):
+        return search.full_text_search(question, k=k, sources=sources)
+
+    def run_hybrid(question, embedding):
+        async def both():
+            loop = asyncio.get_running_loop()
+            return await asyncio.gather(
+                loop.run_in_executor(None, lambda: search.search(embedding, k=candidates, sources=sources)),
+                loop.run_in_executor(None, lambda: search.full_text_search(question, k=candidates, sources=sources)),
+            )
+        return reciprocal_rank_fusion(list(asyncio.run(both())), k=k)
+
+    try:
+        recall = {}
+        print(f"\n{'mode':>11} {'requêtes':>12} {'rappel@5':>9} {'p50 ms':>8} {'p95 ms':>8}")
+        for mode, run in (("vector", run_vector), ("plein texte", run_text), ("hybrid", run_hybrid)):
+            for kind in ("terme exact", "paraphrase"):
+                hits, latencies = [], []
+                for question, embedding, chunk_id, query_kind in queries:
+                    if query_kind != kind:
+                        continue
+                    started = time.perf_counter()
+                    docs = run(question, embedding)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    hits.append(any(doc.metadata.get("chunk_id") == chunk_id for doc in docs))
+                recall[mode, kind] = float(np.mean(hits))
+                print(f"{mode:>11} {kind:>12} {recall[mode, kind]:>9.2f} "
+                      f"{np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 95):>8.1f}")
+    finally:
+        with pg_engine.begin() as conn:
+            conn.execute(text("DELETE FROM langchain_pg_embedding WHERE source = 'bench-hybride'"))
+
+    # L'hybride garde les termes exacts du plein texte et les paraphrases du vecteur
+    assert recall["hybrid", "terme exact"] > recall["vector", "terme exact"]
+    assert recall["hybrid", "paraphrase"] >= recall["plein texte", "paraphrase"]
+    assert recall["hybrid", "terme exact"] >= 0.8 and recall["hybrid", "paraphrase"] >= 0.8
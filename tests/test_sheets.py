@@ -0,0 +1,116 @@
+import asyncio
+import json
+import uuid
+from types import SimpleNamespace
+
+from langchain.schema import AIMessage
+from sqlalchemy import text
+
+from backend.retrieval import PGVectorSearch
+from backend.schema import EMBEDDING_DIM
+from backend.sheets import split_batches
+
+
+def word_count(text_content: str) -> int:
+    return len(text_content.split())
+
+
+def course_chunks(count: int = 40, words: int = 10) -> list[str]:
+    return [" ".join(f"c{i}m{w}" for w in range(words)) for i in range(count)]
+
+
+# -------------------
+# Découpage en lots
+# -------------------
+def test_split_batches_keeps_order_and_bounds():
+    chunks = course_chunks()
+    batches = split_batches(chunks, word_count, min_tokens=20, max_tokens=40)
+
+    assert [chunk for batch in batches for chunk in batch] == chunks
+    assert all(sum(word_count(c) for c in batch) <= 40 for batch in batches)
+    assert all(sum(word_count(c) for c in batch) >= 20 for batch in batches[:-1])
+
+
+def test_split_batches_boundaries_depend_on_content():
+    chunks = course_chunks()
+    edited = list(chunks)
+    edited[25] = "section réécrite " * 5
+
+    before = split_batches(chunks, word_count, min_tokens=20, max_tokens=40)
+    after = split_batches(edited, word_count, min_tokens=20, max_tokens=40)
+
+    # Seuls les lots voisins de la section modifiée changent : les autres restent en cache
+    unchanged = [batch for batch in after if batch in before]
+    assert len(unchanged) >= len(after) - 2
+
+
+# -------------------
+# Map-reduce
+# -------------------
+class StubMapLLM:
+    """Résumé de `words` mots, numéroté dans l'ordre des appels."""
+
+    def __init__(self, words: int):
+        self.words = words
+        self.calls = 0
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        return AIMessage(content=" ".join([f"résumé{self.calls}"] + ["mot"] * (self.words - 1)))
+
+
+def mapreduce(rag, monkeypatch, summary_words: int, budget: int) -> tuple[str, StubMapLLM]:
+    llm = StubMapLLM(summary_words)
+    monkeypatch.setattr(rag, "get_map_llm", lambda: llm)
+    monkeypatch.setattr(rag, "batch_summaries", SimpleNamespace(get_many=lambda hashes: {}, put=lambda *args: None))
+    monkeypatch.setattr(rag, "vector_search", SimpleNamespace(iter_document_chunks=lambda sources: iter(
+        [("Cours", chunk) for chunk in course_chunks()]
+    )))
+    monkeypatch.setattr(rag, "SHEET_BATCH_MIN_TOKENS", 20)
+    monkeypatch.setattr(rag, "SHEET_BATCH_MAX_TOKENS", 40)
+    monkeypatch.setitem(rag.CONTEXT_BUDGETS, "sheet", budget)
+    return asyncio.run(rag.collect_revision_context_mapreduce(["Cours"])), llm
+
+
+def test_reduce_summarizes_again_until_within_budget(rag, monkeypatch):
+    context, llm = mapreduce(rag, monkeypatch, summary_words=5, budget=30)
+
+    batches = len(split_batches(course_chunks(), word_count, 20, 40))
+    assert llm.calls > batches  # au moins une passe de reduce après la phase map
+    assert rag.context_packer.count_tokens(context) <= 30
+
+
+def test_summaries_that_cannot_be_regrouped_are_truncated_to_budget(rag, monkeypatch):
+    # Chaque résumé dépasse SHEET_BATCH_MAX_TOKENS : le regroupement ne réduit plus rien
+    context, llm = mapreduce(rag, monkeypatch, summary_words=50, budget=60)
+
+    batches = len(split_batches(course_chunks(), word_count, 20, 40))
+    assert llm.calls == batches
+    assert rag.context_packer.count_tokens(context) <= 60
+    # Chaque lot du cours reste représenté
+    assert all(f"résumé{i}" in context.split() for i in range(1, batches + 1))
+
+
+# -------------------
+# Lecture ordonnée des chunks
+# -------------------
+def test_document_chunks_tolerate_non_integer_pages(pg_engine, vector_store):
+    rows = [("p2", "2", 0), ("p1", "1", 1), ("legacy-b", "ii", 3), ("legacy-a", "ii", 2), ("sans page", None, None)]
+    with pg_engine.begin() as conn:
+        for document, page, chunk in rows:
+            metadata = {"source": "Pages mixtes", "page": page, "chunk": chunk}
+            conn.execute(text(f"""
+                INSERT INTO langchain_pg_embedding (uuid, collection_id, embedding, document, cmetadata)
+                VALUES (CAST(:uuid AS uuid), CAST(:collection_id AS uuid),
+                        ARRAY(SELECT 0.1 FROM generate_series(1, {EMBEDDING_DIM}))::vector,
+                        :document, CAST(:cmetadata AS json))
+            """), {"uuid": str(uuid.uuid4()), "collection_id": str(vector_store), "document": document,
+                   "cmetadata": json.dumps({k: v for k, v in metadata.items() if v is not None})})
+    try:
+        search = PGVectorSearch(pg_engine, "documents")
+        chunks = [chunk for _, chunk in search.iter_document_chunks(["Pages mixtes"])]
+
+        assert chunks == ["p1", "p2", "legacy-a", "legacy-b", "sans page"]
+    finally:
+        with pg_engine.begin() as conn:
+            conn.execute(text("DELETE FROM langchain_pg_embedding WHERE cmetadata->>'source' = 'Pages mixtes'"))
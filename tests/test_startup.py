@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from conftest import ROOT
+
+# Exécuté dans un processus neuf : mesure de l'import à la première réponse
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import backend.rag as rag
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(rag.app)
+status = client.get("/healthz").status_code
+first_request = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "first_request_s": first_request - started,
+    "healthz": status,
+    "heavy_modules": sorted(m for m in ("reportlab", "langchain.agents", "serpapi", "sentence_transformers")
+                            if m in sys.modules),
+    "initialized": {name: getattr(rag, name).initialized()
+                    for name in ("get_vectordb", "get_llm", "get_agent", "get_serp")},
+    "db_connections": rag.pool_monitor.connects,
+}))
+"""
+
+
+def measure_startup() -> dict:
+    env = {**os.environ, "PG_HOST": "203.0.113.1", "PG_PORT": "5432"}  # adresse injoignable (TEST-NET-3)
+    result = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=120, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_connects_to_nothing_and_defers_heavy_modules():
+    metrics = measure_startup()
+
+    assert metrics["healthz"] == 200
+    assert metrics["db_connections"] == 0
+    assert metrics["heavy_modules"] == []
+    assert not any(metrics["initialized"].values())
+
+
+@pytest.mark.benchmark
+def test_benchmark_startup_time():
+    runs = [measure_startup() for _ in range(5)]
+    imports = [run["import_s"] * 1000 for run in runs]
+    firsts = [run["first_request_s"] * 1000 for run in runs]
+    print(f"\nimport de backend.rag : p50 {np.median(imports):.0f} ms (min {min(imports):.0f}, max {max(imports):.0f})")
+    print(f"import -> 1re réponse /healthz : p50 {np.median(firsts):.0f} ms (min {min(firsts):.0f}, max {max(firsts):.0f})")
@@ -0,0 +1,24 @@
+from fastapi.testclient import TestClient
+
+from fakes import parse_sse
+
+
+def test_ask_stream_emits_token_events(rag, fake_pipeline):
+    client = TestClient(rag.app)
+
+    response = client.post("/ask/stream", json={
+        "question": "Qu'est-ce que la Ve République ?",
+        "history": [{"role": "user", "content": "Qu'est-ce que la Ve République ?"}],
+        "document": "Institutions",
+    })
+
+    events = parse_sse(response.text)
+    tokens = [event["content"] for event in events if event["type"] == "token"]
+    assert tokens == ["Bonjour", " le", " monde"]
+    assert events[-1] == {"type": "done", "answer": "Bonjour le monde"}
+
+
+def test_dispatched_llm_keeps_run_manager_in_signature(rag):
+    # langchain ne transmet run_manager que si _agenerate le déclare
+    import inspect
+    assert "run_manager" in inspect.signature(rag.DispatchedChatOpenAI._agenerate).parameters
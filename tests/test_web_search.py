@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from backend.cache import CachedSearch, CircuitBreaker, SearchUnavailable
+
+
+class FakeSearchBackend:
+    """SerpAPI simulé : latence, pannes programmables, appels comptés."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.failing = False
+        self.calls = 0
+        self.release = None  # asyncio.Event : bloque les appels jusqu'à set()
+
+    async def __call__(self, query: str) -> str:
+        self.calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failing:
+            raise ConnectionError("SerpAPI indisponible")
+        return f"résultats pour {query}"
+
+
+def open_circuit(search: CachedSearch, backend: FakeSearchBackend, failures: int):
+    backend.failing = True
+    for i in range(failures):
+        with pytest.raises(SearchUnavailable):
+            asyncio.run(search.run(f"question {i}"))
+
+
+def test_identical_queries_share_one_upstream_call():
+    backend = FakeSearchBackend(latency=0.05)
+    search = CachedSearch(backend)
+
+    async def scenario():
+        return await asyncio.gather(*(search.run("Élections  législatives 2024") for _ in range(10)),
+                                    search.run("élections législatives 2024"))
+
+    results = asyncio.run(scenario())
+    assert set(results) == {"résultats pour Élections  législatives 2024"}
+    assert backend.calls == 1
+    assert asyncio.run(search.run("ÉLECTIONS législatives 2024")) == results[0]
+    assert search.stats()["hits"] == 1
+
+
+def test_timeout_and_errors_are_not_cached():
+    backend = FakeSearchBackend(latency=0.2)
+    search = CachedSearch(backend, timeout=0.05)
+
+    with pytest.raises(SearchUnavailable):
+        asyncio.run(search.run("question"))
+    backend.latency = 0
+    assert asyncio.run(search.run("question")) == "résultats pour question"
+    assert backend.calls == 2
+
+
+def test_open_circuit_rejects_without_calling_upstream():
+    backend = FakeSearchBackend()
+    search = CachedSearch(backend, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+    open_circuit(search, backend, 3)
+
+    with pytest.raises(SearchUnavailable, match="circuit ouvert"):
+        asyncio.run(search.run("autre question"))
+    assert backend.calls == 3
+    assert search.stats()["circuit"] == "open"
+
+
+def test_half_open_lets_a_single_trial_through():
+    backend = FakeSearchBackend()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    search = CachedSearch(backend, breaker=breaker)
+    open_circuit(search, backend, 2)
+
+    async def scenario():
+        await asyncio.sleep(0.06)
+        backend.failing = False
+        backend.release = asyncio.Event()
+        trial = asyncio.ensure_future(search.run("essai"))
+        await asyncio.sleep(0)
+        # Essai en cours : les autres requêtes (différentes) sont refusées
+        others = await asyncio.gather(*(search.run(f"autre {i}") for i in range(5)), return_exceptions=True)
+        backend.release.set()
+        return await trial, others
+
+    result, others = asyncio.run(scenario())
+    assert result == "résultats pour essai"
+    assert all(isinstance(error, SearchUnavailable) for error in others)
+    assert backend.calls == 3
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_reopens_the_circuit():
+    backend = FakeSearchBackend()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    search = CachedSearch(backend, breaker=breaker)
+    open_circuit(search, backend, 2)
+
+    asyncio.run(asyncio.sleep(0.06))
+    assert breaker.state == "half-open"
+    with pytest.raises(SearchUnavailable):
+        asyncio.run(search.run("essai"))
+    assert breaker.state == "open"
+    assert not breaker.trial_in_flight